@@ -0,0 +1,18 @@
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# Transaction that only reads. The SQLite backend of app/db_backends/sqlite3 begins it with a deferred BEGIN, so it
+# does not take the write lock and does not wait for the writers (or make them wait) like the other transactions do.
+# The other backends run it like transaction.atomic(). It is not nested inside another transaction, where the
+# transaction has already begun, and it is not used for a transaction that writes: a deferred transaction that reads
+# before it writes fails with "database is locked" when another connection writes in between.
+@contextmanager
+def read_only_atomic(using=None):
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    deferred_begin = getattr(connection, 'deferred_begin', False)
+    connection.deferred_begin = True
+    try:
+        with transaction.atomic(using=using):
+            yield
+    finally:
+        connection.deferred_begin = deferred_begin
@@ -0,0 +1,28 @@
+from django.db.backends.sqlite3 import base
+
+# SQLite backend that starts transactions with BEGIN IMMEDIATE instead of BEGIN.
+# A deferred transaction that reads before it writes fails with "database is locked" as soon as another connection is
+# writing, because SQLite cannot upgrade its read lock. Taking the write lock when the transaction begins makes
+# concurrent writers wait for each other through the busy timeout instead. The transactions that only read do not need
+# the write lock, they begin with a deferred BEGIN when they are started with app.db_backends.read_only_atomic().
+#
+# The pragmas in the 'pragmas' option of the database (see app/db_profiles.py) are set on every new connection.
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deferred_begin = False # set by read_only_atomic()
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # the other options are passed to sqlite3.connect()
+        kwargs.pop('pragmas', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN' if self.deferred_begin else 'BEGIN IMMEDIATE')
@@ -0,0 +1,68 @@
+import os
+
+# Database profiles selected with the PARKING_DATABASE_PROFILE environment variable (see settings.DATABASES).
+#
+# - sqlite: the default, a SQLite file in write-ahead log mode so the readers do not block the writer and the writer does
+#   not block the readers, with the fsync at the checkpoints only (synchronous=NORMAL), a busy timeout for the writers
+#   that wait for the write lock, memory mapped reads and persistent connections.
+# - sqlite-basic: the SQLite file with the settings of SQLite and Django (rollback journal, a connection per request),
+#   kept for comparing the profiles (see the benchmark_database_profiles command).
+# - postgres: PostgreSQL configured by the POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST and
+#   POSTGRES_PORT environment variables, with persistent connections that are checked before being reused. It needs
+#   the psycopg package, which is not part of the requirements.
+#
+# The SQLite file is PARKING_DATABASE_NAME when it is set, and the persistent connections are kept for
+# PARKING_CONN_MAX_AGE seconds (600 by default).
+
+PROFILES = ['sqlite', 'sqlite-basic', 'postgres']
+
+# pragmas of the sqlite profile, set on every new connection by app/db_backends/sqlite3
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    # 64 MiB of page cache per connection instead of 2 MiB, the distance rows of a provisioned mall are inserted at
+    # random places of the ranking index, which is much slower once the index does not fit in the cache
+    'cache_size': -64 * 1024,
+}
+
+SQLITE_BUSY_TIMEOUT = 20 # seconds a connection waits for the write lock before failing with "database is locked"
+
+def database(profile, base_dir, environ=os.environ):
+    conn_max_age = int(environ.get('PARKING_CONN_MAX_AGE', 600))
+
+    if profile == 'postgres':
+        return {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': environ.get('POSTGRES_DB', 'parking'),
+            'USER': environ.get('POSTGRES_USER', 'parking'),
+            'PASSWORD': environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': conn_max_age,
+            'CONN_HEALTH_CHECKS': True,
+        }
+
+    if profile not in PROFILES:
+        raise ValueError('Unknown database profile %r, the profiles are %s.' % (profile, ', '.join(PROFILES)))
+
+    # The backend in app/db_backends/sqlite3 takes the write lock when a transaction begins so concurrent entries wait
+    # for each other instead of failing, except for the read-only transactions (see app.db_backends.read_only_atomic).
+    config = {
+        'ENGINE': 'app.db_backends.sqlite3',
+        'NAME': environ.get('PARKING_DATABASE_NAME') or base_dir / 'db.sqlite3',
+        # The whole test suite runs on this file instead of the in-memory database of Django, for the threads of
+        # ConcurrentEntryTests: they share the in-memory database through the shared cache, whose table locks fail at
+        # once instead of waiting for the busy timeout. Django deletes the file after the tests, it is ignored by git in
+        # case an interrupted run leaves it behind.
+        'TEST': {
+            'NAME': base_dir / 'test_db.sqlite3',
+        },
+    }
+    if profile == 'sqlite':
+        config.update({
+            'CONN_MAX_AGE': conn_max_age,
+            'OPTIONS': {'timeout': SQLITE_BUSY_TIMEOUT, 'pragmas': SQLITE_PRAGMAS},
+        })
+    return config
@@ -11,6 +11,10 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import os
+import tempfile
+
+from . import db_profiles
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'parking.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,13 +89,13 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-# Note: We are just using SQLite for the app for simplicity
+# The database is selected with the PARKING_DATABASE_PROFILE environment variable, a tuned SQLite file by default
+# (see app/db_profiles.py for the profiles and their environment variables).
+
+DATABASE_PROFILE = os.environ.get('PARKING_DATABASE_PROFILE', 'sqlite')
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': db_profiles.database(DATABASE_PROFILE, BASE_DIR),
 }
 
 
@@ -133,3 +138,51 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Parking slot allocation
+# The allocator decides which free parking slot is assigned to entering vehicles (see parking/allocator.py). The
+# HeapSlotAllocator keeps the free slots in the memory of the process and is meant for single-process deployments.
+
+PARKING_SLOT_ALLOCATOR = 'parking.allocator.DistanceTableSlotAllocator'
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The parking configuration cache (see parking/config_cache.py) keeps its version stamp in a file based cache so that
+# every worker process on the machine sees the changes made by the others.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'parking_config': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'parking_config_cache',
+    },
+}
+
+PARKING_CONFIG_CACHE = 'parking_config'
+PARKING_CONFIG_CACHE_CHECK_INTERVAL = 1.0 # seconds between the checks of the shared version
+
+
+# Metrics
+# Every request is timed by parking.metrics.MetricsMiddleware, the metrics are served at /metrics in the Prometheus format.
+
+PARKING_METRICS_SERVER_TIMING = True # adds the db, serializer and allocator timings to the Server-Timing header
+
+
+# Parking archive
+# The parkings that exited more than PARKING_ARCHIVE_AFTER_DAYS days ago are moved to the archive table by the
+# archive_parkings command, which is meant to be scheduled (e.g. daily from cron).
+
+PARKING_ARCHIVE_AFTER_DAYS = 90
+
+
+# Idempotency keys
+# The responses of the entries and exits sent with an Idempotency-Key header are kept in a cache of every worker process
+# (see parking/idempotency.py), so the retries of the gate controllers get the same response.
+
+PARKING_IDEMPOTENCY_CACHE_SIZE = 10000 # responses kept, the least recently used ones are evicted
+PARKING_IDEMPOTENCY_TTL = 3600 # seconds a response is kept
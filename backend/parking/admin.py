@@ -6,6 +6,8 @@ admin.site.register(models.MallParking)
 admin.site.register(models.Vehicle)
 admin.site.register(models.ParkingSlotSize)
 admin.site.register(models.VehicleParking)
+admin.site.register(models.ParkingEvent)
+admin.site.register(models.ParkingSlotRanking)
 
 @admin.register(models.ParkingSlot)
 class ParkingSlotAdmin(admin.ModelAdmin):
@@ -0,0 +1,633 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+from django.utils.module_loading import import_string
+import heapq
+import json
+import threading
+import time
+
+from . import models
+from .config_cache import config_cache
+
+# Slot allocators decide which free parking slot a vehicle entering through a given entrance gets.
+# The allocator used by the application is configured through the PARKING_SLOT_ALLOCATOR setting.
+#
+# Every allocator follows the same rules:
+# - only unoccupied slots whose size value is greater than or equal to the vehicle type are considered
+# - the slot with the smallest distance from the entry index is chosen
+# - if the distances are equal, the smaller parking slot is prioritized
+# - if both are equal, the slot that comes first in the default ordering of the parking slots is chosen
+
+DEFAULT_SLOT_ALLOCATOR = 'parking.allocator.DistanceTableSlotAllocator'
+
+class BaseSlotAllocator:
+    # returns the nearest free parking slot for the vehicle type, or None if there are no available slots.
+    # slots with primary keys inside exclude are skipped. When the mall parking is given, only the slots of that mall
+    # are considered, otherwise the slots of every mall are.
+    def allocate(self, vehicle_type, entry_index, exclude=(), mall_parking_id=None):
+        raise NotImplementedError
+
+    # async version of allocate() for the async views, allocators that cannot query with the async ORM run allocate()
+    # in the thread of the database connection
+    async def aallocate(self, vehicle_type, entry_index, exclude=(), mall_parking_id=None):
+        return await sync_to_async(self.allocate)(vehicle_type, entry_index, exclude, mall_parking_id)
+
+    # called once the parking slot has been created, edited, occupied or freed
+    def update(self, parking_slot):
+        pass
+
+    # called once the parking slot of the mall parking has been deleted or occupied without being saved
+    def remove(self, parking_slot_pk, mall_parking_id):
+        pass
+
+    # drops any state kept by the allocator so it is loaded again from the database
+    def reset(self):
+        pass
+
+    # loads the state kept by the allocator when the application starts
+    def warm_up(self):
+        pass
+
+# original allocation algorithm which scans every free parking slot in the database
+class ScanSlotAllocator(BaseSlotAllocator):
+    def allocate(self, vehicle_type, entry_index, exclude=(), mall_parking_id=None):
+        # Get all parking slots that are unoccupied and fits the size of the vehicle
+        free_parking_slots = models.ParkingSlot.objects.filter(
+            vehicle_parking=None,
+            parking_slot_size__value__gte=vehicle_type
+        ).exclude(pk__in=exclude).select_related('parking_slot_size')
+        if mall_parking_id is not None:
+            free_parking_slots = free_parking_slots.filter(mall_parking_id=mall_parking_id)
+
+        parking_slot = None
+        min_distance = None
+        for free_parking_slot in free_parking_slots:
+            # distances array is saved as a string in json format
+            distance = json.loads(free_parking_slot.distances)[entry_index]
+
+            # set the minimum as the new parking slot and update the current minimum distance
+            if parking_slot is None or min_distance > distance:
+                parking_slot = free_parking_slot
+                min_distance = distance
+            # if the distances are equal, prioritize assigning small parking slots
+            elif min_distance == distance and parking_slot.parking_slot_size.value > free_parking_slot.parking_slot_size.value:
+                parking_slot = free_parking_slot
+                min_distance = distance
+
+        return parking_slot
+
+# Allocator which ranks the free slots in the database using the normalized distance table.
+# The slot of a mall is chosen with a single query that walks the (mall, entry index, distance, size value) index until
+# the first free slot. The slots that are tied on the distance and the size value are ordered by the default ordering of
+# the parking slots, which the database sorts for the rows of that tie only (SQLite plans it as a temp b-tree for the
+# right part of the order by), so the timestamps of the slots are not copied into the index. When the mall is not given
+# the nearest slot of every mall is looked up the same way and the nearest of those is chosen.
+class DistanceTableSlotAllocator(BaseSlotAllocator):
+    def _ranked_slot_distances(self, vehicle_type, entry_index, exclude, mall_parking_id):
+        return models.ParkingSlotDistance.objects.filter(
+            mall_parking_id=mall_parking_id,
+            entry_index=entry_index,
+            size_value__gte=vehicle_type,
+            parking_slot__vehicle_parking=None
+        ).exclude(parking_slot__in=exclude).select_related(
+            'parking_slot__parking_slot_size'
+        ).order_by(
+            'distance', 'size_value', '-parking_slot__updated_at', '-parking_slot__created_at', 'parking_slot_id'
+        )
+
+    def _mall_parking_ids(self, mall_parking_id):
+        if mall_parking_id is not None:
+            return [mall_parking_id]
+        return models.MallParking.objects.order_by('pk').values_list('pk', flat=True)
+
+    # the nearest of the slot distances of the malls in the ranking order
+    @staticmethod
+    def _nearest(slot_distances):
+        slot_distances = [slot_distance for slot_distance in slot_distances if slot_distance is not None]
+        if not slot_distances:
+            return None
+        return min(slot_distances, key=lambda slot_distance: (
+            slot_distance.distance,
+            slot_distance.size_value,
+            _recency_key(slot_distance.parking_slot.updated_at),
+            _recency_key(slot_distance.parking_slot.created_at),
+            slot_distance.parking_slot_id
+        )).parking_slot
+
+    def allocate(self, vehicle_type, entry_index, exclude=(), mall_parking_id=None):
+        return self._nearest([
+            self._ranked_slot_distances(vehicle_type, entry_index, exclude, pk).first()
+            for pk in self._mall_parking_ids(mall_parking_id)
+        ])
+
+    async def aallocate(self, vehicle_type, entry_index, exclude=(), mall_parking_id=None):
+        if mall_parking_id is None:
+            mall_parking_ids = [pk async for pk in self._mall_parking_ids(None)]
+        else:
+            mall_parking_ids = [mall_parking_id]
+        return self._nearest([
+            await self._ranked_slot_distances(vehicle_type, entry_index, exclude, pk).afirst()
+            for pk in mall_parking_ids
+        ])
+
+# ordering key that reproduces the default ordering of the parking slots (most recently updated first)
+def _recency_key(value):
+    if value is None:
+        # null values are sorted last in descending order
+        return float('inf')
+    return -value.timestamp()
+
+# Heaps of the free parking slots of one mall, for every (entry index, slot size).
+# Entries of slots that were occupied or changed are not removed right away, instead they are discarded once they reach
+# the top of a heap, and the heaps are rebuilt once they contain too many of them.
+class _MallSlotHeaps:
+    # rebuild the heaps once they contain this many times more entries than the entries that are still current
+    COMPACTION_FACTOR = 4
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.heaps = {} # entry index -> slot size value -> heap
+        self.free_slots = {} # slot pk -> (version, slot size value, distances, sort key)
+        self.version = 0
+        self.shared_version = None # version of the mall in the shared cache the heaps are up to date with
+        self.num_entries = 0 # entries inside the heaps, including the ones that are no longer current
+        self.num_current_entries = 0
+
+    # adds the heap entries of a free slot, entries are only appended when the heaps are going to be heapified after
+    def add_free_slot(self, pk, size_value, distances, sort_key, push=True):
+        self.version += 1
+        self.free_slots[pk] = (self.version, size_value, distances, sort_key)
+
+        for entry_index, distance in enumerate(distances):
+            heap = self.heaps.setdefault(entry_index, {}).setdefault(size_value, [])
+            heap_entry = (distance, size_value) + sort_key + (self.version,)
+            if push:
+                heapq.heappush(heap, heap_entry)
+            else:
+                heap.append(heap_entry)
+        self.num_entries += len(distances)
+        self.num_current_entries += len(distances)
+
+    def remove_free_slot(self, pk):
+        free_slot = self.free_slots.pop(pk, None)
+        if free_slot is not None:
+            self.num_current_entries -= len(free_slot[2])
+
+    def heapify(self):
+        for size_heaps in self.heaps.values():
+            for heap in size_heaps.values():
+                heapq.heapify(heap)
+
+    def compact_if_needed(self):
+        if self.num_entries <= self.COMPACTION_FACTOR * self.num_current_entries + 1024:
+            return
+        # rebuild the heaps from the free slots to get rid of the entries that are no longer current
+        free_slots = self.free_slots
+        self.heaps = {}
+        self.free_slots = {}
+        self.num_entries = 0
+        self.num_current_entries = 0
+        for pk, (_, size_value, distances, sort_key) in free_slots.items():
+            self.add_free_slot(pk, size_value, distances, sort_key, push=False)
+        self.heapify()
+
+    def _is_current(self, heap_entry):
+        free_slot = self.free_slots.get(heap_entry[4])
+        return free_slot is not None and free_slot[0] == heap_entry[5]
+
+    # returns the top entry of the heap that is still current and not excluded
+    def _peek(self, heap, exclude):
+        skipped = []
+        top = None
+        while heap:
+            if not self._is_current(heap[0]):
+                heapq.heappop(heap)
+                self.num_entries -= 1
+            elif heap[0][4] in exclude:
+                skipped.append(heapq.heappop(heap))
+            else:
+                top = heap[0]
+                break
+
+        for heap_entry in skipped:
+            heapq.heappush(heap, heap_entry)
+        return top
+
+    # returns the heap entry of the nearest free slot for the vehicle type, or None
+    def best(self, vehicle_type, entry_index, exclude):
+        best = None
+        for size_value, heap in self.heaps.get(entry_index, {}).items():
+            if size_value < vehicle_type:
+                continue
+            top = self._peek(heap, exclude)
+            if top is not None and (best is None or top < best):
+                best = top
+        return best
+
+# In-memory allocator which keeps a heap of free parking slots for every (mall, entry index, slot size).
+# Each heap is ordered by the distance from the entry and then by the slot size, so the nearest slot is found by
+# only looking at the top of the heaps of the sizes that fit the vehicle.
+#
+# Every mall has its own heaps and lock, and the heaps of a mall are loaded from the database the first time a vehicle
+# enters it (or of every mall when the application starts, see warm_up()), so the traffic and the size of one mall do
+# not slow down the others. Once loaded, the heaps are kept up to date incrementally whenever a parking slot is saved
+# (see signals.py).
+#
+# Several worker processes keep their own heaps. Every change of a slot is recorded in the shared cache
+# (PARKING_CONFIG_CACHE) under the next version of its mall, and at most PARKING_CONFIG_CACHE_CHECK_INTERVAL seconds
+# later the other processes read the slots changed since the version of their heaps again and apply them. The heaps of
+# a mall are only loaded again when more than MAX_REPLAYED_CHANGES changes were made or the changes are no longer in
+# the cache, and the heaps of every mall when the allocator is reset. A slot that is still in the heaps of a process
+# while it is occupied or moved to another mall is checked against the database before it is given to a vehicle.
+class HeapSlotAllocator(BaseSlotAllocator):
+    VERSION_KEY = 'parking:slot_heaps_version'
+    MALL_VERSION_KEY = 'parking:slot_heaps_version:%d'
+    CHANGE_KEY = 'parking:slot_heaps_change:%d:%d' # mall pk, version -> changed slot pk
+    CHANGE_TIMEOUT = 60 * 60
+    MAX_REPLAYED_CHANGES = 1000
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._checked_at = None
+        self._clear()
+
+    def _clear(self):
+        with self._lock:
+            self._malls = {} # mall pk -> _MallSlotHeaps of the malls that are loaded
+            self._all_loaded = False
+
+    def reset(self):
+        self._clear()
+        self._bump_version()
+
+    def _shared_cache(self):
+        return caches[getattr(settings, 'PARKING_CONFIG_CACHE', 'default')]
+
+    # drops the heaps when another process reset the allocator and applies the slots changed by the other processes
+    def _check_version(self):
+        now = time.monotonic()
+        interval = getattr(settings, 'PARKING_CONFIG_CACHE_CHECK_INTERVAL', 1.0)
+        if self._checked_at is not None and now - self._checked_at < interval:
+            return
+        self._checked_at = now
+
+        shared_cache = self._shared_cache()
+        version = shared_cache.get(self.VERSION_KEY)
+        if version is None:
+            shared_cache.add(self.VERSION_KEY, 1, timeout=None)
+            version = shared_cache.get(self.VERSION_KEY, 1)
+        with self._lock:
+            if version != self._version:
+                self._clear()
+                self._version = version
+                return
+        self._replay_changes(shared_cache)
+
+    # bumps the shared version after a reset by this process, the heaps are kept when they were up to date
+    def _bump_version(self):
+        version = self._incr(self._shared_cache(), self.VERSION_KEY)
+        with self._lock:
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    @staticmethod
+    def _incr(shared_cache, key):
+        try:
+            return shared_cache.incr(key)
+        except ValueError:
+            shared_cache.add(key, 0, timeout=None)
+            return shared_cache.incr(key)
+
+    # returns the versions of the malls in the shared cache, to be read before their slots are loaded
+    def _shared_versions(self, mall_parking_ids):
+        versions = self._shared_cache().get_many([self.MALL_VERSION_KEY % pk for pk in mall_parking_ids])
+        return {pk: versions.get(self.MALL_VERSION_KEY % pk, 0) for pk in mall_parking_ids}
+
+    # records the change of the parking slot under the next version of its mall for the other processes
+    def _record_change(self, parking_slot_pk, mall_parking_id):
+        shared_cache = self._shared_cache()
+        version = self._incr(shared_cache, self.MALL_VERSION_KEY % mall_parking_id)
+        shared_cache.set(self.CHANGE_KEY % (mall_parking_id, version), parking_slot_pk, timeout=self.CHANGE_TIMEOUT)
+        mall_heaps = self._malls.get(mall_parking_id)
+        if mall_heaps is not None and mall_heaps.shared_version == version - 1:
+            mall_heaps.shared_version = version
+
+    # applies the slots changed by the other processes to the heaps of the loaded malls, the heaps of a mall are loaded
+    # again when too many changes were made or they are no longer in the shared cache
+    def _replay_changes(self, shared_cache):
+        malls = dict(self._malls)
+        for mall_parking_id, version in self._shared_versions(list(malls)).items():
+            mall_heaps = malls[mall_parking_id]
+            if mall_heaps.shared_version is None or mall_heaps.shared_version == version:
+                continue
+            change_keys = [
+                self.CHANGE_KEY % (mall_parking_id, change) for change in range(mall_heaps.shared_version + 1, version + 1)
+            ]
+            changes = shared_cache.get_many(change_keys) if len(change_keys) <= self.MAX_REPLAYED_CHANGES else {}
+            if not change_keys or len(changes) != len(change_keys):
+                with self._lock:
+                    if self._malls.get(mall_parking_id) is mall_heaps:
+                        del self._malls[mall_parking_id]
+                        self._all_loaded = False
+                continue
+
+            changed_pks = set(changes.values())
+            parking_slots = models.ParkingSlot.objects.filter(pk__in=changed_pks).in_bulk()
+            for pk in changed_pks:
+                if pk in parking_slots:
+                    self._apply(parking_slots[pk])
+                else:
+                    self._discard(pk)
+            mall_heaps.shared_version = version
+
+    # returns the values of the free parking slots in the format expected by load()
+    @staticmethod
+    def free_slot_values(parking_slots=None):
+        if parking_slots is None:
+            parking_slots = models.ParkingSlot.objects.all()
+        return parking_slots.filter(vehicle_parking=None).values_list(
+            'pk', 'mall_parking_id', 'parking_slot_size__value', 'distances', 'updated_at', 'created_at'
+        )
+
+    # returns the values of the free slots that are nearest to the entry for the vehicle type, in the format expected by
+    # load(). When count vehicles are given slots, the slot of any of them for that entry and type is among these.
+    @staticmethod
+    def nearest_free_slot_values(vehicle_type, entry_index, count):
+        distance_table_allocator = DistanceTableSlotAllocator()
+        free_slots = [
+            free_slot
+            for mall_parking_id in distance_table_allocator._mall_parking_ids(None)
+            for free_slot in distance_table_allocator._ranked_slot_distances(vehicle_type, entry_index, (), mall_parking_id).values_list(
+                'parking_slot', 'mall_parking_id', 'size_value', 'parking_slot__distances',
+                'parking_slot__updated_at', 'parking_slot__created_at', 'distance'
+            )[:count]
+        ]
+        # the nearest slots of every mall, merged in the ranking order
+        free_slots.sort(key=lambda free_slot: (
+            free_slot[6], free_slot[2], _recency_key(free_slot[4]), _recency_key(free_slot[5]), free_slot[0]
+        ))
+        return [free_slot[:6] for free_slot in free_slots[:count]]
+
+    def rebuild(self):
+        shared_versions = self._shared_versions(list(models.MallParking.objects.values_list('pk', flat=True)))
+        malls = self._build_heaps(self.free_slot_values().iterator(), shared_versions)
+        for mall_parking_id, mall_heaps in malls.items():
+            # a mall created since its version was read replays its changes from the start
+            mall_heaps.shared_version = shared_versions.get(mall_parking_id, 0)
+        with self._lock:
+            self._malls = malls
+            self._all_loaded = True
+
+    def warm_up(self):
+        self._check_version()
+        self.rebuild()
+
+    # Replaces the heaps with the given free slots. The malls in mall_parking_ids are treated as loaded even when none
+    # of their slots are free, when it is None every mall is.
+    def load(self, free_slots, mall_parking_ids=None):
+        malls = self._build_heaps(free_slots, mall_parking_ids or ())
+        with self._lock:
+            self._malls = malls
+            self._all_loaded = mall_parking_ids is None
+
+    def _build_heaps(self, free_slots, mall_parking_ids):
+        malls = {mall_parking_id: _MallSlotHeaps() for mall_parking_id in mall_parking_ids}
+        for pk, mall_parking_id, size_value, distances, updated_at, created_at in free_slots:
+            mall_heaps = malls.get(mall_parking_id)
+            if mall_heaps is None:
+                mall_heaps = malls[mall_parking_id] = _MallSlotHeaps()
+            sort_key = (_recency_key(updated_at), _recency_key(created_at), pk)
+            mall_heaps.add_free_slot(pk, size_value, json.loads(distances), sort_key, push=False)
+        for mall_heaps in malls.values():
+            mall_heaps.heapify()
+        return malls
+
+    # returns the heaps of the mall, loading them from the database the first time
+    def _mall_heaps(self, mall_parking_id):
+        mall_heaps = self._malls.get(mall_parking_id)
+        if mall_heaps is not None:
+            return mall_heaps
+
+        shared_version = self._shared_versions([mall_parking_id])[mall_parking_id]
+        with self._lock:
+            mall_heaps = self._malls.get(mall_parking_id)
+            if mall_heaps is not None:
+                return mall_heaps
+            mall_heaps = self._malls[mall_parking_id] = _MallSlotHeaps()
+            mall_heaps.shared_version = shared_version
+            if self._all_loaded:
+                # every mall with free slots is loaded, so the mall has none yet
+                return mall_heaps
+            # the updates and allocations of the mall wait for the heaps to be loaded, while the other malls are not blocked
+            mall_heaps.lock.acquire()
+
+        try:
+            free_slots = self.free_slot_values(models.ParkingSlot.objects.filter(mall_parking_id=mall_parking_id))
+            for pk, _, size_value, distances, updated_at, created_at in free_slots.iterator():
+                sort_key = (_recency_key(updated_at), _recency_key(created_at), pk)
+                mall_heaps.add_free_slot(pk, size_value, json.loads(distances), sort_key, push=False)
+            mall_heaps.heapify()
+        except Exception:
+            with self._lock:
+                self._malls.pop(mall_parking_id, None)
+            raise
+        finally:
+            mall_heaps.lock.release()
+        return mall_heaps
+
+    # returns the heaps of the given mall, or of every mall
+    def _heaps_to_search(self, mall_parking_id):
+        if mall_parking_id is not None:
+            return [self._mall_heaps(mall_parking_id)]
+        if not self._all_loaded:
+            self.rebuild()
+        return list(self._malls.values())
+
+    def _allocate_pk(self, vehicle_type, entry_index, exclude, mall_parking_id, remove=False):
+        best = None
+        best_heaps = None
+        for mall_heaps in self._heaps_to_search(mall_parking_id):
+            with mall_heaps.lock:
+                top = mall_heaps.best(vehicle_type, entry_index, exclude)
+            if top is not None and (best is None or top < best):
+                best = top
+                best_heaps = mall_heaps
+        if best is None:
+            return None
+        if remove:
+            with best_heaps.lock:
+                best_heaps.remove_free_slot(best[4])
+        return best[4]
+
+    def allocate(self, vehicle_type, entry_index, exclude=(), mall_parking_id=None):
+        self._check_version()
+        exclude = set(exclude)
+        while True:
+            pk = self._allocate_pk(vehicle_type, entry_index, exclude, mall_parking_id)
+            if pk is None:
+                return None
+
+            # the heaps may be behind the database when the slot was changed by another process
+            parking_slot = models.ParkingSlot.objects.select_related('parking_slot_size').filter(pk=pk).first()
+            if parking_slot is None:
+                self._discard(pk)
+            elif parking_slot.vehicle_parking_id is not None or mall_parking_id not in (None, parking_slot.mall_parking_id):
+                self._apply(parking_slot)
+            else:
+                return parking_slot
+
+    # removes and returns the primary key of the nearest free slot without checking it against the database.
+    # this is used for assigning slots to a batch of vehicles from slots that were loaded inside the same transaction,
+    # by an allocator that is only used by one thread.
+    def take(self, vehicle_type, entry_index, mall_parking_id=None):
+        return self._allocate_pk(vehicle_type, entry_index, (), mall_parking_id, remove=True)
+
+    def update(self, parking_slot):
+        self._apply(parking_slot)
+        self._record_change(parking_slot.pk, parking_slot.mall_parking_id)
+
+    def remove(self, parking_slot_pk, mall_parking_id):
+        self._discard(parking_slot_pk)
+        self._record_change(parking_slot_pk, mall_parking_id)
+
+    def _apply(self, parking_slot):
+        # the slot may have been moved from another mall
+        self._discard(parking_slot.pk)
+
+        # malls that are not loaded yet read the slot from the database once they are
+        mall_heaps = self._malls.get(parking_slot.mall_parking_id)
+        if mall_heaps is None or parking_slot.vehicle_parking_id is not None:
+            return
+
+        with mall_heaps.lock:
+            mall_heaps.add_free_slot(
+                parking_slot.pk,
+                config_cache.get_parking_slot_size(parking_slot.parking_slot_size_id).value,
+                json.loads(parking_slot.distances),
+                (_recency_key(parking_slot.updated_at), _recency_key(parking_slot.created_at), parking_slot.pk)
+            )
+            mall_heaps.compact_if_needed()
+
+    def _discard(self, parking_slot_pk):
+        for mall_heaps in list(self._malls.values()):
+            with mall_heaps.lock:
+                mall_heaps.remove_free_slot(parking_slot_pk)
+                mall_heaps.compact_if_needed()
+
+# Allocator which walks the precomputed rankings of the slots for the entry (see models.ParkingSlotRanking) and returns
+# the first one that is free. The rankings are kept in memory and read again when their version changes, and the free
+# slots are looked up in the database in chunks of the ranking that grow until a free slot is found.
+#
+# The ranking order is fixed by the distance and the size value, the slots that are tied on both are ordered by the
+# default ordering of the parking slots once they are read, so a chunk always ends at the end of a tie.
+class RankedSlotAllocator(BaseSlotAllocator):
+    CHUNK_SIZE = 64
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._rankings = {} # (mall pk, entry index) -> (version, ranked records)
+
+    # returns the ranked records of the entry of the mall, or of the entry of every mall
+    def _ranked_records(self, entry_index, mall_parking_id):
+        rankings = models.ParkingSlotRanking.objects.filter(entry_index=entry_index)
+        if mall_parking_id is not None:
+            rankings = rankings.filter(mall_parking_id=mall_parking_id)
+        versions = dict(rankings.values_list('mall_parking_id', 'version'))
+
+        with self._lock:
+            stale = [pk for pk, version in versions.items() if self._rankings.get((pk, entry_index), (None,))[0] != version]
+        if stale:
+            loaded = {
+                (pk, entry_index): (version, models.ParkingSlotRanking.unpack(slots))
+                for pk, version, slots in rankings.filter(mall_parking_id__in=stale).values_list('mall_parking_id', 'version', 'slots')
+            }
+            with self._lock:
+                self._rankings.update(loaded)
+
+        with self._lock:
+            ranked_records = [self._rankings[(pk, entry_index)][1] for pk in versions if (pk, entry_index) in self._rankings]
+        return ranked_records[0] if len(ranked_records) == 1 else heapq.merge(*ranked_records)
+
+    # yields chunks of the (distance, size value, slot pk) records that fit the vehicle, ending at the end of a tie
+    def _chunks(self, records, vehicle_type, exclude):
+        chunk = []
+        chunk_size = self.CHUNK_SIZE
+        for record in records:
+            if record[1] < vehicle_type or record[2] in exclude:
+                continue
+            if len(chunk) >= chunk_size and record[:2] != chunk[-1][:2]:
+                yield chunk
+                chunk = []
+                chunk_size *= 4
+            chunk.append(record)
+        if chunk:
+            yield chunk
+
+    def allocate(self, vehicle_type, entry_index, exclude=(), mall_parking_id=None):
+        exclude = set(exclude)
+        for chunk in self._chunks(self._ranked_records(entry_index, mall_parking_id), vehicle_type, exclude):
+            free_slots = models.ParkingSlot.objects.select_related('parking_slot_size').filter(
+                pk__in=[record[2] for record in chunk], vehicle_parking=None
+            ).in_bulk()
+            if not free_slots:
+                continue
+
+            # the free slots of the first tie that has any, in the default ordering of the parking slots
+            rank = next(record[:2] for record in chunk if record[2] in free_slots)
+            return min(
+                (free_slots[record[2]] for record in chunk if record[:2] == rank and record[2] in free_slots),
+                key=lambda parking_slot: (
+                    _recency_key(parking_slot.updated_at), _recency_key(parking_slot.created_at), parking_slot.pk
+                )
+            )
+        return None
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+# returns the allocator instance configured in the settings
+def get_allocator():
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                allocator_class = import_string(getattr(settings, 'PARKING_SLOT_ALLOCATOR', DEFAULT_SLOT_ALLOCATOR))
+                _allocator = allocator_class()
+    return _allocator
+
+# discards the allocator instance so it is created again from the settings
+def reset_allocator():
+    global _allocator
+    with _allocator_lock:
+        _allocator = None
+
+# updates the allocator with the parking slot once the current transaction is committed
+def update_on_commit(parking_slot):
+    transaction.on_commit(lambda: get_allocator().update(parking_slot))
+
+# removes the occupied parking slots, as (parking slot pk, mall parking pk) pairs, from the allocator once the current
+# transaction is committed
+def remove_on_commit(parking_slots):
+    def remove():
+        slot_allocator = get_allocator()
+        for parking_slot_pk, mall_parking_id in parking_slots:
+            slot_allocator.remove(parking_slot_pk, mall_parking_id)
+    transaction.on_commit(remove)
+
+# drops the state of the allocator once the current transaction is committed, used after bulk changes to the slots
+def reset_on_commit():
+    transaction.on_commit(lambda: get_allocator().reset())
+
+# loads the state of the configured allocator when the application starts, unless the tables are not migrated yet
+def warm_up():
+    try:
+        get_allocator().warm_up()
+    except DatabaseError:
+        pass
@@ -0,0 +1,224 @@
+from django.db import connection
+from django.db.models import Count, DurationField, ExpressionWrapper, F, FloatField, Func, Sum
+from django.db.models.functions import Substr, TruncDay, TruncHour
+from datetime import datetime, timezone
+
+from . import fares
+from . import models
+from .config_cache import config_cache
+
+# Revenue and utilization of the closed parkings, aggregated by the database.
+#
+# The charges are computed and stored when the vehicles exit (see VehicleParking.set_charges), so the revenue is a sum of
+# the stored charges and the fare rules are not evaluated again. Both the parkings and the archived parkings are
+# aggregated with one grouped query each and the groups are added up. The parkings are counted in the UTC hour or day
+# of their exit.
+#
+# Django computes datetime differences and truncations on SQLite with functions written in Python that are called for
+# every row, which takes most of the time of the query, so on SQLite they are replaced with the built-in julianday()
+# and with the prefix of the stored UTC datetime text.
+
+GROUP_BY_CHOICES = ['hour', 'day', 'mall_parking', 'parking_slot_size', 'entry_index']
+
+PERIOD_SECONDS = {'hour': 3600, 'day': 86400}
+
+# length of the prefix of the SQLite datetime text 'YYYY-MM-DD HH:MM:SS' for the hour and the day
+SQLITE_PERIOD_PREFIXES = {'hour': 13, 'day': 10}
+
+def _sqlite():
+    return connection.vendor == 'sqlite'
+
+# the parked time of the parkings, in seconds on SQLite and as a duration on the other databases
+def _duration_expression():
+    if _sqlite():
+        return (
+            Func('exit_datetime', function='julianday', output_field=FloatField())
+            - Func('entry_datetime', function='julianday', output_field=FloatField())
+        ) * 86400
+    return ExpressionWrapper(F('exit_datetime') - F('entry_datetime'), output_field=DurationField())
+
+def _seconds(duration):
+    if duration is None:
+        return 0.0
+    return duration if isinstance(duration, (int, float)) else duration.total_seconds()
+
+# converts the truncated exit datetime of a group to a UTC datetime, SQLite returns the prefix of the datetime text
+def _period_start(name, value):
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d %H' if name == 'hour' else '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return value
+
+# group expressions of the parkings and of the archived parkings, the names are used as the keys of the rows
+def _group_expressions(group_by, archived):
+    expressions = {}
+    for name in group_by:
+        if name in PERIOD_SECONDS and _sqlite():
+            expressions[name] = Substr('exit_datetime', 1, SQLITE_PERIOD_PREFIXES[name])
+        elif name == 'hour':
+            expressions[name] = TruncHour('exit_datetime', tzinfo=timezone.utc)
+        elif name == 'day':
+            expressions[name] = TruncDay('exit_datetime', tzinfo=timezone.utc)
+        elif name == 'mall_parking':
+            expressions[name] = F('mall_parking_id' if archived else 'parking_slot__mall_parking_id')
+        elif name == 'parking_slot_size':
+            expressions[name] = F('parking_slot_size_id' if archived else 'parking_slot__parking_slot_size_id')
+        else:
+            expressions[name] = F(name)
+    return expressions
+
+# returns the rows of the revenue, the number of parkings and the parked time of every group of the queryset
+def _aggregate(queryset, group_expressions):
+    aggregates = {
+        'revenue': Sum('total_charge'),
+        'parkings': Count('pk'),
+        'parked_duration': Sum(_duration_expression(), output_field=FloatField() if _sqlite() else DurationField()),
+    }
+    if not group_expressions:
+        return [queryset.aggregate(**aggregates)]
+
+    # the expressions are annotated under other names, a name such as entry_index cannot be reused for an annotation
+    queryset = queryset.annotate(**{'_group_' + name: expression for name, expression in group_expressions.items()})
+    return [
+        {name[len('_group_'):] if name.startswith('_group_') else name: value for name, value in row.items()}
+        for row in queryset.values(*['_group_' + name for name in group_expressions]).annotate(**aggregates).order_by()
+    ]
+
+# returns the number of slots of every (mall parking, parking slot size) from the occupancy counters
+def _total_slots(mall_parking):
+    counters = models.ParkingOccupancy.objects.all()
+    if mall_parking is not None:
+        counters = counters.filter(mall_parking=mall_parking)
+    return {
+        (mall_parking_id, parking_slot_size_id): total_slots
+        for mall_parking_id, parking_slot_size_id, total_slots in counters.values_list('mall_parking', 'parking_slot_size', 'total_slots')
+    }
+
+# Returns the revenue, the number of parkings, the average duration in seconds and the occupancy rate of the parkings
+# that exited between start (inclusive) and end (exclusive), grouped by the names of GROUP_BY_CHOICES.
+# The occupancy rate is the parked time divided by the slot time of the group, the time being the hour or the day of
+# the group or the whole range, so a group can go over 1 when its parkings started before it.
+def revenue_and_utilization(start, end, group_by=(), mall_parking=None):
+    vehicle_parkings = models.VehicleParking.objects.filter(exit_datetime__gte=start, exit_datetime__lt=end)
+    archived_parkings = models.ArchivedVehicleParking.objects.filter(exit_datetime__gte=start, exit_datetime__lt=end)
+    if mall_parking is not None:
+        vehicle_parkings = vehicle_parkings.filter(parking_slot__mall_parking=mall_parking)
+        archived_parkings = archived_parkings.filter(mall_parking_id=mall_parking)
+
+    # add up the groups of both tables
+    groups = {}
+    for archived, queryset in ((False, vehicle_parkings), (True, archived_parkings)):
+        for row in _aggregate(queryset, _group_expressions(group_by, archived)):
+            key = tuple(_period_start(name, row[name]) for name in group_by)
+            group = groups.setdefault(key, {'revenue': 0, 'parkings': 0, 'parked_seconds': 0.0})
+            group['revenue'] += row['revenue'] or 0
+            group['parkings'] += row['parkings']
+            group['parked_seconds'] += _seconds(row['parked_duration'])
+
+    total_slots = _total_slots(mall_parking)
+    period_seconds = next(
+        (PERIOD_SECONDS[name] for name in group_by if name in PERIOD_SECONDS), (end - start).total_seconds()
+    )
+
+    rows = []
+    for key in sorted(groups, key=lambda key: tuple((value is None, value) for value in key)):
+        group = groups[key]
+        row = dict(zip(group_by, key))
+
+        # slots of the mall and the slot size of the group, the entries share the slots of their mall
+        slots = sum(
+            count for (mall_parking_id, parking_slot_size_id), count in total_slots.items()
+            if row.get('mall_parking', mall_parking_id) == mall_parking_id
+            and row.get('parking_slot_size', parking_slot_size_id) == parking_slot_size_id
+        )
+        slot_seconds = slots * period_seconds
+
+        row.update({
+            'revenue': group['revenue'],
+            'parkings': group['parkings'],
+            'average_duration': group['parked_seconds'] / group['parkings'] if group['parkings'] else None,
+            'occupancy_rate': group['parked_seconds'] / slot_seconds if slot_seconds else None,
+        })
+        rows.append(row)
+    return rows
+
+# columns of the closed parkings read by the what-if simulation, in the same order for both tables
+WHAT_IF_LOOKUPS = {
+    False: ['entry_datetime', 'exit_datetime', 'is_fixed_starting_rate', 'total_charge', 'parking_slot__mall_parking_id', 'parking_slot__parking_slot_size_id'],
+    True: ['entry_datetime', 'exit_datetime', 'is_fixed_starting_rate', 'total_charge', 'mall_parking_id', 'parking_slot_size_id'],
+}
+
+# returns the sum of the values of every index from 0 to size - 1
+def _sums_by_index(values, indexes, size):
+    if fares.numpy is not None and indexes:
+        return [int(value) for value in fares.numpy.bincount(indexes, weights=values, minlength=size)]
+    sums = [0] * size
+    for value, index in zip(values, indexes):
+        sums[index] += value
+    return sums
+
+# Re-rates the parkings that exited between start (inclusive) and end (exclusive) with the batch fare engine and returns
+# the revenue of every mall parking at the stored charges, at the current tariffs and at the what-if tariffs.
+# The what-if tariffs are the current ones with the tariff parameters (see fares.Tariff.FIELDS) replaced for every mall
+# parking and the continuous rates of the slot sizes in slot_rates (parking slot size pk -> rate) replaced.
+# The fixed starting rates stored at exit are kept, so the return duration is not simulated.
+def what_if_revenue(start, end, mall_parking=None, tariff=None, slot_rates=None):
+    vehicle_parkings = models.VehicleParking.objects.filter(exit_datetime__gte=start, exit_datetime__lt=end)
+    archived_parkings = models.ArchivedVehicleParking.objects.filter(exit_datetime__gte=start, exit_datetime__lt=end)
+    if mall_parking is not None:
+        vehicle_parkings = vehicle_parkings.filter(parking_slot__mall_parking=mall_parking)
+        archived_parkings = archived_parkings.filter(mall_parking_id=mall_parking)
+
+    # columns of the parkings of both tables, the mall parkings and the slot sizes are numbered in order of appearance
+    parking_durations = []
+    is_fixed_starting_rates = []
+    stored_charges = []
+    mall_indexes = []
+    size_indexes = []
+    mall_parking_ids = {}
+    parking_slot_size_ids = {}
+    for archived, queryset in ((False, vehicle_parkings), (True, archived_parkings)):
+        for entry_datetime, exit_datetime, is_fixed_starting_rate, total_charge, mall_parking_id, parking_slot_size_id in (
+            queryset.order_by().values_list(*WHAT_IF_LOOKUPS[archived]).iterator(chunk_size=5000)
+        ):
+            parking_durations.append(fares.parking_duration(entry_datetime, exit_datetime))
+            is_fixed_starting_rates.append(is_fixed_starting_rate)
+            stored_charges.append(total_charge or 0)
+            mall_indexes.append(mall_parking_ids.setdefault(mall_parking_id, len(mall_parking_ids)))
+            size_indexes.append(parking_slot_size_ids.setdefault(parking_slot_size_id, len(parking_slot_size_ids)))
+
+    parking_slot_sizes = config_cache.get_parking_slot_sizes()
+    current_rates = [parking_slot_sizes[pk].continuous_rate for pk in parking_slot_size_ids]
+    what_if_rates = [(slot_rates or {}).get(pk, parking_slot_sizes[pk].continuous_rate) for pk in parking_slot_size_ids]
+    mall_parkings = [config_cache.get_mall_parking(pk) for pk in mall_parking_ids]
+
+    # continuous rate of every parking from the rate of its slot size
+    def rates(size_rates):
+        size_rates = [float(rate) for rate in size_rates]
+        return [size_rates[index] for index in size_indexes]
+
+    current_charges = fares.total_charges(
+        parking_durations, rates(current_rates), is_fixed_starting_rates,
+        [fares.Tariff(mall) for mall in mall_parkings], mall_indexes
+    )
+    what_if_charges = fares.total_charges(
+        parking_durations, rates(what_if_rates), is_fixed_starting_rates,
+        [fares.Tariff(mall, **(tariff or {})) for mall in mall_parkings], mall_indexes
+    )
+
+    size = len(mall_parking_ids)
+    parkings = _sums_by_index([1] * len(mall_indexes), mall_indexes, size)
+    stored_revenues = _sums_by_index(stored_charges, mall_indexes, size)
+    current_revenues = _sums_by_index(current_charges, mall_indexes, size)
+    what_if_revenues = _sums_by_index(what_if_charges, mall_indexes, size)
+
+    rows = sorted((
+        {
+            'mall_parking': mall_parking_id,
+            'parkings': parkings[index],
+            'stored_revenue': stored_revenues[index],
+            'current_revenue': current_revenues[index],
+            'what_if_revenue': what_if_revenues[index],
+        }
+        for mall_parking_id, index in mall_parking_ids.items()
+    ), key=lambda row: row['mall_parking'])
+    return rows
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ParkingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'parking'
+
+    def ready(self):
+        # register the signal receivers
+        from . import signals
+
+        # load the free slots of the allocators that keep them in memory before the first vehicle enters
+        from . import allocator
+        allocator.warm_up()
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.db import transaction
+from datetime import datetime, timedelta, timezone
+
+from . import bulk
+from . import models
+
+# Archive of the closed parkings.
+#
+# The entries, exits and the return check only need the open and recent parkings, so the parkings that exited before
+# the archive horizon are moved in batches to ArchivedVehicleParking, which is only appended to and read by the history.
+# The history list, retrieve and export read both tables, the archived parkings are shown like the other parkings.
+
+BATCH_SIZE = 5000
+
+ARCHIVE_FIELDS = [
+    'id', 'entry_index', 'entry_datetime', 'exit_datetime', 'plate_number', 'vehicle_type', 'mall_parking_id',
+    'parking_slot_id', 'parking_slot_size_id', 'is_fixed_starting_rate', 'total_charge',
+]
+
+# lookups of the vehicle parking values in the order of ARCHIVE_FIELDS
+VEHICLE_PARKING_LOOKUPS = [
+    'pk', 'entry_index', 'entry_datetime', 'exit_datetime', 'vehicle_id', 'vehicle__type', 'parking_slot__mall_parking_id',
+    'parking_slot_id', 'parking_slot__parking_slot_size_id', 'is_fixed_starting_rate', 'total_charge',
+]
+
+# parkings that exited before this datetime are archived, PARKING_ARCHIVE_AFTER_DAYS days ago by default
+def archive_horizon(days=None):
+    if days is None:
+        days = getattr(settings, 'PARKING_ARCHIVE_AFTER_DAYS', 90)
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+# Moves the parkings that exited before the datetime to the archive, every batch in its own transaction so the job can
+# be stopped at any time. The parkings are read in primary key order starting after the previous batch.
+# Returns the number of archived parkings.
+def archive_parkings(before, batch_size=BATCH_SIZE, progress=None):
+    archived = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            rows = list(models.VehicleParking.objects.filter(
+                pk__gt=last_pk,
+                exit_datetime__lt=before
+            ).order_by('pk').values_list(*VEHICLE_PARKING_LOOKUPS)[:batch_size])
+            if not rows:
+                break
+
+            bulk.insert_rows(models.ArchivedVehicleParking, ARCHIVE_FIELDS, (
+                row[:2] + (
+                    bulk.adapt_value(models.ArchivedVehicleParking, 'entry_datetime', row[2]),
+                    bulk.adapt_value(models.ArchivedVehicleParking, 'exit_datetime', row[3]),
+                ) + row[4:]
+                for row in rows
+            ))
+            models.VehicleParking.objects.filter(pk__in=[row[0] for row in rows]).delete()
+
+        archived += len(rows)
+        last_pk = rows[-1][0]
+        if progress is not None:
+            progress(archived)
+    return archived
+
+# returns the archived parkings with their parking slots loaded in one query, as vehicle parkings
+def to_vehicle_parkings(archived_parkings):
+    parking_slots = models.ParkingSlot.objects.select_related('mall_parking', 'parking_slot_size').in_bulk(
+        {archived_parking.parking_slot_id for archived_parking in archived_parkings}
+    ) if archived_parkings else {}
+    return [
+        archived_parking.to_vehicle_parking(parking_slots[archived_parking.parking_slot_id])
+        for archived_parking in archived_parkings
+    ]
+
+# Queryset-like view of the parkings of both tables for the history pagination.
+# It supports the order_by(), filter() and slicing used by the cursor pagination, the slices are read from both tables
+# and merged, and the fields of the ordering must exist in both tables and be sorted in the same direction.
+class ParkingHistory:
+    def __init__(self, vehicle_parkings, archived_parkings, ordering=()):
+        self.model = vehicle_parkings.model
+        self.vehicle_parkings = vehicle_parkings
+        self.archived_parkings = archived_parkings
+        self.ordering = ordering
+
+    def order_by(self, *ordering):
+        return ParkingHistory(self.vehicle_parkings.order_by(*ordering), self.archived_parkings.order_by(*ordering), ordering)
+
+    def filter(self, *args, **kwargs):
+        return ParkingHistory(
+            self.vehicle_parkings.filter(*args, **kwargs), self.archived_parkings.filter(*args, **kwargs), self.ordering
+        )
+
+    def __getitem__(self, key):
+        start = key.start or 0
+        parkings = list(self.vehicle_parkings[:key.stop]) + to_vehicle_parkings(list(self.archived_parkings[:key.stop]))
+        field_names = [field_name.lstrip('-') for field_name in self.ordering]
+        parkings.sort(
+            key=lambda parking: tuple(getattr(parking, field_name) for field_name in field_names),
+            reverse=bool(self.ordering) and self.ordering[0].startswith('-')
+        )
+        return parkings[start:key.stop]
+
+# returns the parking with the primary key from either table, raises VehicleParking.DoesNotExist like a query would
+def get_vehicle_parking(queryset, pk):
+    try:
+        return queryset.get(pk=pk)
+    except models.VehicleParking.DoesNotExist:
+        archived_parking = models.ArchivedVehicleParking.objects.filter(pk=pk).first()
+        if archived_parking is None:
+            raise
+        return to_vehicle_parkings([archived_parking])[0]
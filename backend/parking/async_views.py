@@ -0,0 +1,81 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework import serializers as rest_serializers
+from rest_framework.renderers import JSONRenderer
+import json
+
+from . import idempotency
+from . import models
+from . import serializers
+
+# Async versions of the park and unpark endpoints for ASGI servers (see app/asgi.py).
+# The lookups are made with the async ORM so the event loop keeps serving other gate connections while they wait on the
+# database. The transactional part is the same code as the sync endpoints and runs in the thread of the database
+# connection with sync_to_async, since transactions are not supported by the async ORM. The responses are rendered the
+# same way as the DRF endpoints.
+#
+# The views are exempt from CSRF like the DRF views. The csrf_exempt and require_http_methods decorators of Django 4.2
+# do not support async views, so the attribute and the method check are done here.
+
+def _response(data, status):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+def _request_data(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def _save_entry(serializer):
+    serializer.save()
+    return serializer.data
+
+async def _vehicle_entry(data):
+    serializer = serializers.VehicleParkingEntrySerializer(data=data)
+    if not await serializer.ais_valid():
+        return serializer.errors, 400
+
+    try:
+        content = await sync_to_async(_save_entry)(serializer)
+    except rest_serializers.ValidationError as exc:
+        return exc.detail, 400
+    return content, 201
+
+async def vehicle_entry(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    data = _request_data(request)
+    if data is None:
+        return _response({'detail': 'Invalid JSON body.'}, 400)
+
+    return _response(*await idempotency.arun(request, data, _vehicle_entry))
+
+def _save_exit(vehicle_parking, data):
+    serializer = serializers.VehicleParkingSerializer(instance=vehicle_parking, data=data)
+    if serializer.is_valid():
+        serializer.save()
+        return serializer.data, 200
+    return serializer.errors, 400
+
+async def _vehicle_exit(data):
+    # Get the parking slot for the vehicle. We expect there to be only one parking slot containing the vehicle.
+    parking_slot = await models.ParkingSlot.objects.select_related('vehicle_parking').filter(
+        vehicle_parking__vehicle__pk=data.get('plate_number')
+    ).afirst()
+    if parking_slot is None:
+        return 'Unknown plate number.', 400
+
+    return await sync_to_async(_save_exit)(parking_slot.vehicle_parking, data)
+
+async def vehicle_exit(request):
+    if request.method != 'PATCH':
+        return HttpResponseNotAllowed(['PATCH'])
+    data = _request_data(request)
+    if data is None:
+        return _response({'detail': 'Invalid JSON body.'}, 400)
+
+    return _response(*await idempotency.arun(request, data, _vehicle_exit))
+
+vehicle_entry.csrf_exempt = True
+vehicle_exit.csrf_exempt = True
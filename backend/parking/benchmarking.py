@@ -0,0 +1,209 @@
+from contextlib import contextmanager
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from datetime import datetime, timedelta, timezone
+from statistics import median
+import time
+
+from . import bulk
+from . import models
+
+# Helpers shared by the benchmark commands.
+# The benchmarks run against a throwaway copy of the database (the test database) so they never touch real data.
+
+@contextmanager
+def isolated_database():
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        call_command('loaddata', 'parking_sizes', verbosity=0)
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+# measures the wall time and the number of queries of the block, the results are stored in the yielded dictionary
+@contextmanager
+def measure():
+    result = {}
+    # the query log only keeps the last queries, it is emptied so that long benchmarks are counted correctly
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        yield result
+        result['seconds'] = time.perf_counter() - start
+    result['queries'] = len(queries)
+
+# returns the value at the percentile (0 to 100) of the sorted values using the nearest rank
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+# summarizes a list of latencies in seconds as milliseconds
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+# Synthetic data and scenarios of the benchmark suite (see the run_benchmarks command).
+# Every scenario is measured through the API with the test client, so the timings include the views and serializers.
+
+# returns the request data of a mall layout with random distances and sizes
+def mall_layout(rng, num_slots, num_entries, name='Benchmark'):
+    return {
+        'mall_parking': {'name': name, 'num_entries': num_entries},
+        'parking_slot_distance_list': [[rng.randint(0, 1000) for _ in range(num_entries)] for _ in range(num_slots)],
+        'parking_slot_size_list': [rng.randint(0, 2) for _ in range(num_slots)],
+    }
+
+# inserts closed parkings spread over the days before now, as if the mall had been running for a while
+def seed_history(rng, mall_parking, num_parkings, days=90):
+    parking_slot_pks = list(models.ParkingSlot.objects.filter(mall_parking=mall_parking).values_list('pk', flat=True))
+    num_vehicles = max(1, num_parkings // 5)
+    now = datetime.now(timezone.utc)
+
+    created_at = bulk.adapt_value(models.Vehicle, 'created_at', now)
+    bulk.insert_rows(
+        models.Vehicle,
+        ['created_at', 'updated_at', 'plate_number', 'type'],
+        ((created_at, created_at, 'HISTORY-%d' % i, rng.randint(0, 2)) for i in range(num_vehicles))
+    )
+
+    def parking_rows():
+        for _ in range(num_parkings):
+            entry_datetime = now - timedelta(seconds=rng.randint(3600, days * 86400))
+            exit_datetime = entry_datetime + timedelta(seconds=rng.randint(600, 6 * 3600))
+            yield (
+                bulk.adapt_value(models.VehicleParking, 'created_at', entry_datetime),
+                bulk.adapt_value(models.VehicleParking, 'updated_at', exit_datetime),
+                rng.randint(0, mall_parking.num_entries - 1),
+                bulk.adapt_value(models.VehicleParking, 'entry_datetime', entry_datetime),
+                bulk.adapt_value(models.VehicleParking, 'exit_datetime', exit_datetime),
+                rng.choice(parking_slot_pks),
+                'HISTORY-%d' % rng.randrange(num_vehicles),
+                True,
+                rng.randint(40, 500),
+            )
+    bulk.insert_rows(
+        models.VehicleParking,
+        ['created_at', 'updated_at', 'entry_index', 'entry_datetime', 'exit_datetime', 'parking_slot', 'vehicle',
+         'is_fixed_starting_rate', 'total_charge'],
+        parking_rows()
+    )
+
+# sends the requests made by make_request() and returns the latency summary along with the query counts
+def run_scenario(requests):
+    latencies = []
+    queries = []
+    for make_request in requests:
+        with measure() as result:
+            response = make_request()
+        if response.status_code >= 400:
+            raise RuntimeError('Benchmark request failed with status %d: %s' % (response.status_code, response.content[:200]))
+        latencies.append(result['seconds'])
+        queries.append(result['queries'])
+
+    summary = latency_summary(latencies)
+    summary['queries_mean'] = sum(queries) / len(queries)
+    summary['queries_max'] = max(queries)
+    return summary
+
+# runs every scenario on a mall of the given size and returns the summaries by scenario name
+def run_suite(client, rng, num_slots, num_entries, num_history, num_requests):
+    results = {}
+    layout = mall_layout(rng, num_slots, num_entries)
+
+    results['mall_creation'] = run_scenario([
+        lambda: client.post('/parking/mall_parking_slots/', layout, format='json')
+    ])
+    mall_parking = models.MallParking.objects.get(name='Benchmark')
+    seed_history(rng, mall_parking, num_history)
+
+    # at most half of the slots are occupied so that the large vehicles do not run out of large slots
+    num_requests = min(num_requests, num_slots // 2)
+    vehicles = [('BENCH-%d' % i, rng.randint(0, 2), rng.randrange(num_entries)) for i in range(num_requests)]
+    results['entry'] = run_scenario([
+        (lambda vehicle=vehicle: client.post('/parking/mall_parking_slots/entry', {
+            'plate_number': vehicle[0],
+            'type': vehicle[1],
+            'entry_index': vehicle[2]
+        }, format='json'))
+        for vehicle in vehicles
+    ])
+
+    rng.shuffle(vehicles)
+    results['exit'] = run_scenario([
+        (lambda vehicle=vehicle: client.patch('/parking/mall_parking_slots/exit', {'plate_number': vehicle[0]}, format='json'))
+        for vehicle in vehicles
+    ])
+
+    # walks the history pages with the cursors returned by the api, starting over at the last page
+    cursor = {'next': None}
+    def history_page():
+        response = client.get(cursor['next'] or '/parking/mall_parking_slots/view')
+        cursor['next'] = response.data.get('next') if response.status_code == 200 else None
+        return response
+    results['history_list'] = run_scenario([history_page] * num_requests)
+
+    # revenue and utilization of the last 30 days by day and slot size
+    results['analytics'] = run_scenario([
+        lambda: client.get('/parking/mall_parking_slots/analytics', {'group_by': ['day', 'parking_slot_size']})
+    ] * num_requests)
+
+    return results
+
+# Combines the summaries of repeated runs of the suite (see run_suite()) by scenario. The latencies are the medians
+# of the runs, so a single slow run does not move them, and the p95 latency of every run is kept in p95_runs_ms for
+# compare(). The query counts are the ones of the run that made the most queries.
+def combine_runs(runs):
+    results = {}
+    for scenario in runs[0]:
+        summaries = [run[scenario] for run in runs]
+        p95_runs = [summary['p95_ms'] for summary in summaries]
+        results[scenario] = {
+            'count': sum(summary['count'] for summary in summaries),
+            'runs': len(summaries),
+            'p50_ms': median([summary['p50_ms'] for summary in summaries]),
+            'p95_ms': median(p95_runs),
+            'p99_ms': median([summary['p99_ms'] for summary in summaries]),
+            'max_ms': max(summary['max_ms'] for summary in summaries),
+            'p95_runs_ms': p95_runs,
+            'queries_mean': max(summary['queries_mean'] for summary in summaries),
+            'queries_max': max(summary['queries_max'] for summary in summaries),
+        }
+    return results
+
+# Returns the regressions of the current results against the baseline results as readable strings.
+# A scenario regresses when its median p95 latency grew by more than the threshold (a fraction, ignoring changes under
+# min_difference_ms) and every run of the current results is slower than every run of the baseline, so the growth is
+# not within the noise between runs. It also regresses when it makes more queries per request than before.
+def compare(baseline, current, threshold=0.2, min_difference_ms=1.0):
+    regressions = []
+    for size, scenarios in current['results'].items():
+        for scenario, summary in scenarios.items():
+            baseline_summary = baseline.get('results', {}).get(size, {}).get(scenario)
+            if baseline_summary is None:
+                continue
+
+            before = baseline_summary['p95_ms']
+            after = summary['p95_ms']
+            # the results of a single run only have their own p95 latency
+            before_runs = baseline_summary.get('p95_runs_ms', [before])
+            after_runs = summary.get('p95_runs_ms', [after])
+            if after > before * (1 + threshold) and after - before > min_difference_ms and min(after_runs) > max(before_runs):
+                regressions.append('%s %s: p95 latency %.2fms -> %.2fms (+%.0f%%, %d runs)' % (
+                    size, scenario, before, after, (after / before - 1) * 100 if before else float('inf'), len(after_runs)
+                ))
+            if summary['queries_max'] > baseline_summary['queries_max']:
+                regressions.append('%s %s: queries per request %d -> %d' % (
+                    size, scenario, baseline_summary['queries_max'], summary['queries_max']
+                ))
+    return regressions
@@ -0,0 +1,30 @@
+from django.db import connection
+from itertools import islice
+
+# Inserts rows of plain values with executemany instead of bulk_create.
+# bulk_create builds a model instance and compiles every value of every row, which dominates the time of inserting
+# hundreds of thousands of rows. The values are given in the order of field_names and must already be in the format of
+# the database (see adapt_value), and no save signals are sent.
+def insert_rows(model, field_names, rows, batch_size=5000):
+    quote_name = connection.ops.quote_name
+    columns = [model._meta.get_field(field_name).column for field_name in field_names]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote_name(model._meta.db_table),
+        ', '.join(quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns))
+    )
+
+    rows = iter(rows)
+    inserted = 0
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+            inserted += len(batch)
+    return inserted
+
+# converts the value of the field to the format of the database, used for values that are the same on every row
+def adapt_value(model, field_name, value):
+    return model._meta.get_field(field_name).get_db_prep_save(value, connection)
@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.core.cache import caches
+import threading
+import time
+
+from . import models
+
+# Process-local cache of the mall parking and parking slot size configuration.
+#
+# The tariffs and the slot sizes almost never change, so the fare and allocation code reads them from memory instead of
+# querying them on every request. Every change bumps a version stamp that is kept in a Django cache backend shared by
+# the worker processes (PARKING_CONFIG_CACHE). Each process compares its version with the shared one at most once every
+# PARKING_CONFIG_CACHE_CHECK_INTERVAL seconds and drops its entries when they differ, while the process that made the
+# change drops its entries right away (see signals.py).
+
+VERSION_KEY = 'parking:config_version'
+
+class ConfigCache:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._mall_parkings = {}
+        self._parking_slot_sizes = None
+        self._version = None
+        self._checked_at = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _shared_cache(self):
+        return caches[getattr(settings, 'PARKING_CONFIG_CACHE', 'default')]
+
+    def _shared_version(self):
+        shared_cache = self._shared_cache()
+        version = shared_cache.get(VERSION_KEY)
+        if version is None:
+            shared_cache.add(VERSION_KEY, 1, timeout=None)
+            version = shared_cache.get(VERSION_KEY, 1)
+        return version
+
+    def _clear(self):
+        self._mall_parkings = {}
+        self._parking_slot_sizes = None
+
+    # drops the local entries when another process changed the configuration
+    def _check_version(self):
+        now = time.monotonic()
+        interval = getattr(settings, 'PARKING_CONFIG_CACHE_CHECK_INTERVAL', 1.0)
+        if self._checked_at is not None and now - self._checked_at < interval:
+            return
+        self._checked_at = now
+
+        version = self._shared_version()
+        if version != self._version:
+            self._clear()
+            self._version = version
+
+    # returns the mall parking with the primary key, raises MallParking.DoesNotExist like a query would
+    def get_mall_parking(self, pk):
+        with self._lock:
+            self._check_version()
+            mall_parking = self._mall_parkings.get(pk)
+            if mall_parking is not None:
+                self.hits += 1
+                return mall_parking
+            self.misses += 1
+
+        mall_parking = models.MallParking.objects.get(pk=pk)
+        with self._lock:
+            self._mall_parkings[pk] = mall_parking
+        return mall_parking
+
+    # returns all the parking slot sizes by primary key, the table is small so it is loaded as a whole
+    def get_parking_slot_sizes(self):
+        with self._lock:
+            self._check_version()
+            parking_slot_sizes = self._parking_slot_sizes
+            if parking_slot_sizes is not None:
+                self.hits += 1
+                return parking_slot_sizes
+            self.misses += 1
+
+        parking_slot_sizes = models.ParkingSlotSize.objects.in_bulk()
+        with self._lock:
+            self._parking_slot_sizes = parking_slot_sizes
+        return parking_slot_sizes
+
+    # returns the parking slot size with the primary key, raises ParkingSlotSize.DoesNotExist like a query would
+    def get_parking_slot_size(self, pk):
+        parking_slot_size = self.get_parking_slot_sizes().get(pk)
+        if parking_slot_size is None:
+            raise models.ParkingSlotSize.DoesNotExist('ParkingSlotSize matching query does not exist.')
+        return parking_slot_size
+
+    # drops the local entries and bumps the shared version so the other processes drop theirs
+    def invalidate(self):
+        shared_cache = self._shared_cache()
+        try:
+            version = shared_cache.incr(VERSION_KEY)
+        except ValueError:
+            shared_cache.add(VERSION_KEY, 1, timeout=None)
+            version = shared_cache.incr(VERSION_KEY)
+
+        with self._lock:
+            self._clear()
+            self._version = version
+            self._checked_at = time.monotonic()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'invalidations': self.invalidations,
+                'mall_parkings': len(self._mall_parkings),
+                'parking_slot_sizes': 0 if self._parking_slot_sizes is None else len(self._parking_slot_sizes),
+            }
+
+config_cache = ConfigCache()
@@ -0,0 +1,93 @@
+from rest_framework.utils.encoders import JSONEncoder
+import csv
+import heapq
+import json
+
+from . import models
+from .config_cache import config_cache
+
+# Streaming export of the parking history.
+# The rows are read as plain values in chunks with iterator(), so the memory used does not depend on the number of rows.
+
+CHUNK_SIZE = 2000
+
+# columns of the exported rows, as (column name, field lookup)
+EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('plate_number', 'vehicle_id'),
+    ('vehicle_type', 'vehicle__type'),
+    ('mall_parking', 'parking_slot__mall_parking_id'),
+    ('parking_slot', 'parking_slot_id'),
+    ('parking_slot_size', 'parking_slot__parking_slot_size__name'),
+    ('entry_index', 'entry_index'),
+    ('entry_datetime', 'entry_datetime'),
+    ('exit_datetime', 'exit_datetime'),
+    ('is_fixed_starting_rate', 'is_fixed_starting_rate'),
+    ('total_charge', 'total_charge'),
+]
+
+# returns the parkings that entered within the range, optionally only for a single mall
+def history_queryset(start=None, end=None, mall_parking=None):
+    queryset = models.VehicleParking.objects.all()
+    if start is not None:
+        queryset = queryset.filter(entry_datetime__gte=start)
+    if end is not None:
+        queryset = queryset.filter(entry_datetime__lt=end)
+    if mall_parking is not None:
+        queryset = queryset.filter(parking_slot__mall_parking=mall_parking)
+    return queryset.order_by('entry_datetime', 'id')
+
+# returns the archived parkings that entered within the range, optionally only for a single mall
+def archived_history_queryset(start=None, end=None, mall_parking=None):
+    queryset = models.ArchivedVehicleParking.objects.all()
+    if start is not None:
+        queryset = queryset.filter(entry_datetime__gte=start)
+    if end is not None:
+        queryset = queryset.filter(entry_datetime__lt=end)
+    if mall_parking is not None:
+        queryset = queryset.filter(mall_parking_id=mall_parking)
+    return queryset.order_by('entry_datetime', 'id')
+
+# yields the rows of the queryset as tuples in the order of EXPORT_COLUMNS
+def export_rows(queryset):
+    return queryset.values_list(*[lookup for _, lookup in EXPORT_COLUMNS]).iterator(chunk_size=CHUNK_SIZE)
+
+# yields the rows of the archived parkings as tuples in the order of EXPORT_COLUMNS
+def archived_export_rows(queryset):
+    parking_slot_sizes = config_cache.get_parking_slot_sizes()
+    for row in queryset.values_list(
+        'id', 'plate_number', 'vehicle_type', 'mall_parking_id', 'parking_slot_id', 'parking_slot_size_id', 'entry_index',
+        'entry_datetime', 'exit_datetime', 'is_fixed_starting_rate', 'total_charge'
+    ).iterator(chunk_size=CHUNK_SIZE):
+        parking_slot_size = parking_slot_sizes.get(row[5])
+        yield row[:5] + (None if parking_slot_size is None else parking_slot_size.name,) + row[6:]
+
+# yields the rows of the parkings and the archived parkings that entered within the range, ordered by their entry datetime
+def history_rows(start=None, end=None, mall_parking=None):
+    return heapq.merge(
+        export_rows(history_queryset(start, end, mall_parking)),
+        archived_export_rows(archived_history_queryset(start, end, mall_parking)),
+        key=lambda row: (row[7], row[0])
+    )
+
+# yields the rows as newline delimited JSON
+def ndjson_stream(rows):
+    column_names = [column_name for column_name, _ in EXPORT_COLUMNS]
+    encoder = JSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(column_names, row))) + '\n'
+
+# file-like object that returns the written value instead of buffering it, used for streaming the csv writer
+class _Echo:
+    def write(self, value):
+        return value
+
+# yields the rows as CSV with a header row
+def csv_stream(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([column_name for column_name, _ in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow([
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in row
+        ])
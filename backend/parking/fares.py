@@ -0,0 +1,98 @@
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Fare rules of the parking, shared by the VehicleParking properties, the batch exit and the batch fare engine.
+# The rates are stored as decimals but the continuous rate is applied on a per second basis as a float, so every
+# amount is added up as a float (adding a float to a decimal raises a TypeError).
+
+SECONDS_PER_HOUR = 60 * 60
+
+# checks if the starting rate is fixed rate given the latest exit of the same vehicle from another parking
+def is_fixed_starting_rate(entry_datetime, latest_exit_datetime, return_duration):
+    if latest_exit_datetime is None:
+        # handle the case where there is no pre-existing parking records
+        return True
+
+    # return False if the vehicle enters again within the return duration threshold after its last exit
+    if entry_datetime.timestamp() - latest_exit_datetime.timestamp() <= return_duration:
+        return False
+    return True
+
+# computes the total charge for a parking duration in seconds with the rates of the mall and the parking slot size
+def total_charge(parking_duration, slot_rate, is_fixed_starting_rate, mall_parking):
+    total_fee = 0
+    if is_fixed_starting_rate:
+        # compute the duration that is not covered by the fixed rate
+        non_fixed_rate_duration = parking_duration - mall_parking.flatRate_duration
+
+        # add the fixed rate to the total fee
+        total_fee += float(mall_parking.flat_rate)
+
+        # handle the case when the duration exceeds the flat rate duration
+        if non_fixed_rate_duration > 0:
+            # add the fee based on the continuous rate to be applied on a per second basis
+            total_fee += non_fixed_rate_duration * float(slot_rate) / SECONDS_PER_HOUR
+    else:
+        # add the fee based on the continuous rate to be applied on a per second basis
+        total_fee += parking_duration * float(slot_rate) / SECONDS_PER_HOUR
+
+    # add the penalty for exceeding 24 hours
+    if parking_duration >= mall_parking.exceed_duration:
+        total_fee += float(mall_parking.exceed_rate)
+
+    # return the rounded up value
+    return math.ceil(total_fee)
+
+# computes the parking duration in seconds
+def parking_duration(entry_datetime, exit_datetime):
+    return exit_datetime.timestamp() - entry_datetime.timestamp()
+
+# Tariff parameters of a mall parking used by the batch fare engine, with the names of the MallParking fields so it can
+# also be passed to total_charge. Any parameter that is not given is taken from the mall parking.
+class Tariff:
+    FIELDS = ['flat_rate', 'exceed_rate', 'flatRate_duration', 'exceed_duration']
+
+    def __init__(self, mall_parking=None, **parameters):
+        for field in self.FIELDS:
+            setattr(self, field, parameters[field] if parameters.get(field) is not None else getattr(mall_parking, field))
+
+# Batch fare engine: computes the total charges of many parkings from columns of the parking durations in seconds, the
+# continuous rates of their slots and their fixed starting rate flags, with the tariff of every parking given as
+# tariffs[tariff_indexes[i]] (the first tariff for every parking when there are no indexes).
+# The charges are equal to the ones of total_charge: the amounts are added up as floats in the same order and rounded up.
+# The columns are computed in one pass with numpy (see requirements.txt), and row by row with total_charge when it is
+# not installed.
+def total_charges(parking_durations, slot_rates, is_fixed_starting_rates, tariffs, tariff_indexes=None):
+    if numpy is None:
+        if tariff_indexes is None:
+            tariff_indexes = [0] * len(parking_durations)
+        return [
+            total_charge(parking_duration, slot_rate, is_fixed_starting_rate, tariffs[tariff_index])
+            for parking_duration, slot_rate, is_fixed_starting_rate, tariff_index
+            in zip(parking_durations, slot_rates, is_fixed_starting_rates, tariff_indexes)
+        ]
+
+    parking_durations = numpy.asarray(parking_durations, dtype=numpy.float64)
+    slot_rates = numpy.asarray(slot_rates, dtype=numpy.float64)
+    is_fixed_starting_rates = numpy.asarray(is_fixed_starting_rates, dtype=bool)
+    tariff_indexes = numpy.zeros(len(parking_durations), dtype=numpy.intp) if tariff_indexes is None else numpy.asarray(tariff_indexes, dtype=numpy.intp)
+
+    # tariff parameters of every parking
+    flat_rates = numpy.array([float(tariff.flat_rate) for tariff in tariffs])[tariff_indexes]
+    exceed_rates = numpy.array([float(tariff.exceed_rate) for tariff in tariffs])[tariff_indexes]
+    flat_rate_durations = numpy.array([tariff.flatRate_duration for tariff in tariffs], dtype=numpy.float64)[tariff_indexes]
+    exceed_durations = numpy.array([tariff.exceed_duration for tariff in tariffs], dtype=numpy.float64)[tariff_indexes]
+
+    # fixed starting rate: the flat rate and the continuous rate for the duration that is not covered by it
+    non_fixed_rate_durations = parking_durations - flat_rate_durations
+    fixed_fees = flat_rates + numpy.where(non_fixed_rate_durations > 0, non_fixed_rate_durations * slot_rates / SECONDS_PER_HOUR, 0.0)
+    # otherwise the continuous rate for the whole duration
+    continuous_fees = parking_durations * slot_rates / SECONDS_PER_HOUR
+
+    total_fees = numpy.where(is_fixed_starting_rates, fixed_fees, continuous_fees)
+    total_fees = total_fees + numpy.where(parking_durations >= exceed_durations, exceed_rates, 0.0)
+    return numpy.ceil(total_fees).astype(numpy.int64)
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+import functools
+import hashlib
+import json
+import threading
+import time
+
+from . import metrics
+
+# Idempotency keys for the entry and exit endpoints.
+#
+# Gate controllers send an Idempotency-Key header with every entry or exit and send the same key again when they retry
+# the request. The response of the first request is kept in a bounded cache of the process, and the retries get it back
+# right away without being validated again, so they do not search for a slot or touch the parking slots. The cached
+# entries expire after PARKING_IDEMPOTENCY_TTL seconds and the least recently used ones are evicted once the cache holds
+# PARKING_IDEMPOTENCY_CACHE_SIZE responses.
+#
+# A retry that arrives while the first request is still running gets a 409, and a key that is sent again with another
+# body gets a 422. The responses with a server error are not kept, so the request can be retried. The cache is not
+# shared with the other worker processes, a retry handled by another process runs again and is rejected by the usual
+# checks (e.g. the vehicle is already parked).
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# results of IdempotencyCache.begin()
+NEW, REPLAY, IN_PROGRESS, MISMATCH = 'new', 'replay', 'in_progress', 'mismatch'
+
+class IdempotencyCache:
+    def __init__(self, max_size=None, ttl=None):
+        self._lock = threading.Lock()
+        self._max_size = max_size
+        self._ttl = ttl
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._entries = OrderedDict() # key -> [expires at, fingerprint, (status, data) or None while running]
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expirations = 0
+
+    @property
+    def max_size(self):
+        return self._max_size if self._max_size is not None else getattr(settings, 'PARKING_IDEMPOTENCY_CACHE_SIZE', 10000)
+
+    @property
+    def ttl(self):
+        return self._ttl if self._ttl is not None else getattr(settings, 'PARKING_IDEMPOTENCY_TTL', 3600)
+
+    # Looks up the key and returns (result, response). The key is reserved for the request when the result is NEW, and
+    # the request has to call finish() or cancel() afterwards.
+    def begin(self, key, fingerprint):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                metrics.IDEMPOTENCY_LOOKUPS.inc(result='miss')
+                self._entries[key] = [now + self.ttl, fingerprint, None]
+                self._evict()
+                return NEW, None
+
+            self._entries.move_to_end(key)
+            if entry[1] != fingerprint:
+                return MISMATCH, None
+            if entry[2] is None:
+                return IN_PROGRESS, None
+            self.hits += 1
+            metrics.IDEMPOTENCY_LOOKUPS.inc(result='hit')
+            return REPLAY, entry[2]
+
+    # keeps the response of the request, responses with a server error are dropped so the request can be retried
+    def finish(self, key, status_code, data):
+        if status_code >= 500:
+            self.cancel(key)
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2] = (status_code, data)
+
+    def cancel(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is None:
+                del self._entries[key]
+
+    # drops the least recently used entries beyond the maximum size, the running requests are kept
+    def _evict(self):
+        excess = len(self._entries) - self.max_size
+        for key in list(self._entries):
+            if excess <= 0:
+                break
+            if self._entries[key][2] is not None:
+                del self._entries[key]
+                self.evictions += 1
+                excess -= 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+idempotency_cache = IdempotencyCache()
+
+# returns the cache key of the request and the fingerprint of its body
+def request_key(method, path, key, data):
+    fingerprint = hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+    return (method, path, key), fingerprint
+
+# returns the (status, data) to respond with instead of running the request, or None when it has to run
+def replayed_response(result, response):
+    if result == REPLAY:
+        return response
+    if result == IN_PROGRESS:
+        return status.HTTP_409_CONFLICT, {'detail': 'A request with the same idempotency key is in progress.'}
+    if result == MISMATCH:
+        return status.HTTP_422_UNPROCESSABLE_ENTITY, {'detail': 'The idempotency key was already used for another request.'}
+    return None
+
+# decorator for the DRF view methods that makes them idempotent when the request has an idempotency key
+def idempotent(view_method):
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        cache_key, fingerprint = request_key(request.method, request.path, key, request.data)
+        result, response = idempotency_cache.begin(cache_key, fingerprint)
+        replayed = replayed_response(result, response)
+        if replayed is not None:
+            status_code, data = replayed
+            return Response(data, status=status_code, headers={REPLAYED_HEADER: 'true'} if result == REPLAY else None)
+
+        try:
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except APIException as exc:
+                # validation errors are kept like the other responses
+                response = self.handle_exception(exc)
+        except BaseException:
+            idempotency_cache.cancel(cache_key)
+            raise
+        idempotency_cache.finish(cache_key, response.status_code, response.data)
+        return response
+    return wrapper
+
+# same as idempotent() for the async views, the view function returns (data, status) for the request data
+async def arun(request, data, view_function):
+    key = request.headers.get(HEADER)
+    if not key:
+        return await view_function(data)
+
+    cache_key, fingerprint = request_key(request.method, request.path, key, data)
+    result, response = idempotency_cache.begin(cache_key, fingerprint)
+    replayed = replayed_response(result, response)
+    if replayed is not None:
+        status_code, content = replayed
+        return content, status_code
+
+    try:
+        content, status_code = await view_function(data)
+    except BaseException:
+        idempotency_cache.cancel(cache_key)
+        raise
+    idempotency_cache.finish(cache_key, status_code, content)
+    return content, status_code
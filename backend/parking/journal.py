@@ -0,0 +1,94 @@
+from django.db import transaction
+import json
+
+from app.db_backends import read_only_atomic
+
+from . import allocator
+from . import models
+from . import occupancy
+
+# Replay of the parking event journal (see models.ParkingEvent).
+#
+# The entries and exits still update the parking slots and the vehicle parkings, the journal is the ordered record of
+# those changes. Replaying it rebuilds the open parkings and the occupied slots, which can then be compared with the
+# tables or used to restore them. A snapshot stores the replayed state up to an event, so the next replay starts from
+# the latest snapshot and only reads the events after it.
+
+class JournalState:
+    def __init__(self, last_event_id=0, open_parkings=None):
+        self.last_event_id = last_event_id
+        # vehicle parking pk -> (parking slot pk, mall parking pk, plate number)
+        self.open_parkings = {} if open_parkings is None else open_parkings
+        self.events_replayed = 0
+
+    def apply(self, event_id, kind, vehicle_parking_id, parking_slot_id, mall_parking_id, plate_number):
+        if kind == models.ParkingEvent.Kind.PARK:
+            self.open_parkings[vehicle_parking_id] = (parking_slot_id, mall_parking_id, plate_number)
+        else:
+            self.open_parkings.pop(vehicle_parking_id, None)
+        self.last_event_id = event_id
+        self.events_replayed += 1
+
+    # parking slot pk -> vehicle parking pk of the occupied slots
+    def occupied_slots(self):
+        return {parking_slot_id: vehicle_parking_id for vehicle_parking_id, (parking_slot_id, _, _) in self.open_parkings.items()}
+
+# returns the state of the latest snapshot, or the empty state before the first event when there is none
+def load_snapshot():
+    snapshot = models.ParkingJournalSnapshot.objects.first()
+    if snapshot is None:
+        return JournalState()
+    return JournalState(snapshot.last_event_id, {
+        int(vehicle_parking_id): tuple(parking) for vehicle_parking_id, parking in json.loads(snapshot.open_parkings).items()
+    })
+
+# replays the events after the latest snapshot, or every event when from_snapshot is False
+def replay(from_snapshot=True, chunk_size=5000):
+    state = load_snapshot() if from_snapshot else JournalState()
+    events = models.ParkingEvent.objects.filter(pk__gt=state.last_event_id).order_by('pk').values_list(
+        'pk', 'kind', 'vehicle_parking_id', 'parking_slot_id', 'mall_parking_id', 'plate_number'
+    )
+    for event in events.iterator(chunk_size=chunk_size):
+        state.apply(*event)
+    return state
+
+# replays the tail of the journal and stores the state as the new snapshot, the older snapshots are dropped
+def take_snapshot():
+    with transaction.atomic():
+        state = replay()
+        snapshot = models.ParkingJournalSnapshot.objects.create(
+            last_event_id=state.last_event_id,
+            open_parkings=json.dumps({
+                vehicle_parking_id: list(parking) for vehicle_parking_id, parking in state.open_parkings.items()
+            })
+        )
+        models.ParkingJournalSnapshot.objects.exclude(pk=snapshot.pk).delete()
+    return snapshot, state
+
+# Compares the occupied slots of the journal with the parking slots table and returns the slots that differ as
+# (parking slot pk, vehicle parking pk in the journal, vehicle parking pk in the table), None meaning free.
+# When fix is True, the slots are set to the journal state and the occupancy counters and the allocator are updated.
+def verify(state, fix=False):
+    # the write lock is only taken when the mismatches are fixed
+    with transaction.atomic() if fix else read_only_atomic():
+        journal_slots = state.occupied_slots()
+        table_slots = dict(models.ParkingSlot.objects.exclude(vehicle_parking=None).values_list('pk', 'vehicle_parking'))
+
+        mismatches = [
+            (parking_slot_id, journal_slots.get(parking_slot_id), table_slots.get(parking_slot_id))
+            for parking_slot_id in sorted(set(journal_slots) | set(table_slots))
+            if journal_slots.get(parking_slot_id) != table_slots.get(parking_slot_id)
+        ]
+
+        if fix and mismatches:
+            # the parkings that were deleted since their entry cannot occupy a slot again
+            existing_vehicle_parking_ids = set(models.VehicleParking.objects.filter(
+                pk__in=[vehicle_parking_id for _, vehicle_parking_id, _ in mismatches if vehicle_parking_id is not None]
+            ).values_list('pk', flat=True))
+            for parking_slot_id, vehicle_parking_id, _ in mismatches:
+                if vehicle_parking_id is None or vehicle_parking_id in existing_vehicle_parking_ids:
+                    models.ParkingSlot.objects.filter(pk=parking_slot_id).update(vehicle_parking=vehicle_parking_id)
+            occupancy.reconcile(fix=True)
+            allocator.reset_on_commit()
+
+    return mismatches
@@ -0,0 +1,149 @@
+from django.db import transaction
+import csv
+import json
+
+from . import allocator
+from .config_cache import config_cache
+from . import models
+
+# Streaming import of mall layouts from files with one parking slot per line, used by the import_layout command and the
+# layout upload endpoint.
+#
+# csv: the parking slot size followed by the distance from every entry of the mall, e.g. 0,4,7,2
+#      a first line that does not start with a number is treated as the header and skipped
+# ndjson: one JSON object per line with the parking slot size and the distances, e.g. {"size": 0, "distances": [4, 7, 2]}
+#
+# The rows are read, validated and inserted in fixed-size batches, so the memory used does not depend on the size of the
+# file. Every batch is committed along with the number of imported rows of the LayoutImport, which is the checkpoint
+# used for resuming a failed or interrupted import. The slot rankings of the mall are rebuilt once the import stops.
+
+FILE_FORMATS = ['csv', 'ndjson']
+
+# number of slots inserted per transaction
+BATCH_SIZE = 5000
+
+class LayoutImportError(Exception):
+    pass
+
+# returns the file format from the extension of the file name, or None if it is unknown
+def file_format_from_name(file_name):
+    extension = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+    if extension in ('jsonl', 'ndjson'):
+        return 'ndjson'
+    if extension == 'csv':
+        return 'csv'
+    return None
+
+# yields (line number, parking slot size, distances) for every slot of the file, the values are validated by validate_row()
+def read_rows(lines, file_format):
+    if file_format == 'csv':
+        reader = csv.reader(lines)
+        for row in reader:
+            if not any(value.strip() for value in row):
+                continue
+            if reader.line_num == 1 and not _is_integer(row[0]):
+                continue
+            yield reader.line_num, row[0], row[1:]
+    else:
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise LayoutImportError('Line %d: invalid JSON.' % line_number)
+            if not isinstance(row, dict):
+                raise LayoutImportError('Line %d: expected an object with the size and the distances.' % line_number)
+            yield line_number, row.get('size'), row.get('distances')
+
+def _integer(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        return int(value.strip())
+    raise ValueError(value)
+
+def _is_integer(value):
+    try:
+        _integer(value)
+        return True
+    except ValueError:
+        return False
+
+# returns the (parking slot size, distances) row of a slot in the format of ParkingSlot.provision()
+def validate_row(line_number, size, distances, num_entries, parking_slot_sizes):
+    try:
+        parking_slot_size = parking_slot_sizes.get(_integer(size))
+        if not isinstance(distances, list):
+            raise ValueError(distances)
+        distances = [_integer(distance) for distance in distances]
+    except ValueError:
+        raise LayoutImportError('Line %d: the size and the distances must be integers.' % line_number)
+
+    if parking_slot_size is None:
+        raise LayoutImportError('Line %d: unknown parking slot size %s.' % (line_number, size))
+    # check that the number of distance matches the number of entries in the mall
+    if len(distances) != num_entries:
+        raise LayoutImportError('Line %d: expected %d distances, got %d.' % (line_number, num_entries, len(distances)))
+    if any(distance < 0 for distance in distances):
+        raise LayoutImportError('Line %d: the distances cannot be negative.' % line_number)
+
+    return parking_slot_size, distances
+
+def _import_batch(layout_import, parking_slot_rows):
+    with transaction.atomic():
+        models.ParkingSlot.provision(layout_import.mall_parking, parking_slot_rows, batch_size=len(parking_slot_rows))
+        layout_import.rows_imported += len(parking_slot_rows)
+        layout_import.save(update_fields=['rows_imported', 'updated_at'])
+
+        # bulk inserts do not send the save signals, so the allocator is loaded again
+        allocator.reset_on_commit()
+
+# Imports the slots from the lines of the file into the mall of the layout import, skipping the rows that were already
+# imported. progress is called with the layout import after every batch. Raises LayoutImportError at the first invalid
+# row, after saving the error on the layout import; the batches before it stay imported.
+def run(layout_import, lines, batch_size=BATCH_SIZE, progress=None):
+    if layout_import.status == models.LayoutImport.Status.COMPLETED:
+        raise LayoutImportError('The layout import is already completed.')
+
+    layout_import.status = models.LayoutImport.Status.RUNNING
+    layout_import.error = ''
+    layout_import.save(update_fields=['status', 'error', 'updated_at'])
+
+    num_entries = layout_import.mall_parking.num_entries
+    parking_slot_sizes = config_cache.get_parking_slot_sizes()
+    rows_to_skip = layout_import.rows_imported
+
+    try:
+        batch = []
+        for row_number, (line_number, size, distances) in enumerate(read_rows(lines, layout_import.file_format)):
+            if row_number < rows_to_skip:
+                continue
+            batch.append(validate_row(line_number, size, distances, num_entries, parking_slot_sizes))
+            if len(batch) == batch_size:
+                _import_batch(layout_import, batch)
+                batch = []
+                if progress is not None:
+                    progress(layout_import)
+        if batch:
+            _import_batch(layout_import, batch)
+            if progress is not None:
+                progress(layout_import)
+    except (LayoutImportError, UnicodeDecodeError, csv.Error) as error:
+        if not isinstance(error, LayoutImportError):
+            error = LayoutImportError('The file could not be read: ' + str(error))
+        layout_import.status = models.LayoutImport.Status.FAILED
+        layout_import.error = str(error)
+        layout_import.save(update_fields=['status', 'error', 'updated_at'])
+        raise error
+    finally:
+        # the rankings of the mall are built once for all the batches, including the ones before an invalid row
+        if layout_import.rows_imported > rows_to_skip:
+            models.ParkingSlotRanking.rebuild(layout_import.mall_parking_id)
+
+    layout_import.status = models.LayoutImport.Status.COMPLETED
+    layout_import.save(update_fields=['status', 'updated_at'])
+    return layout_import
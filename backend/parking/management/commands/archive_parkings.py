@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from parking import archive
+
+class Command(BaseCommand):
+    help = (
+        'Moves the parkings that exited before the archive horizon to the archive table, meant to be scheduled '
+        '(e.g. daily from cron).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help='Archive the parkings that exited more than this many days ago, PARKING_ARCHIVE_AFTER_DAYS by default.'
+        )
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE, help='Number of parkings moved in every transaction.')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('The number of days cannot be negative.')
+        if options['batch_size'] < 1:
+            raise CommandError('The batch size must be at least 1.')
+
+        before = archive.archive_horizon(options['days'])
+        start = time.perf_counter()
+        archived = archive.archive_parkings(
+            before,
+            batch_size=options['batch_size'],
+            progress=lambda archived: self.stdout.write('Archived %d parkings.' % archived)
+        )
+        self.stdout.write(self.style.SUCCESS('Archived %d parkings that exited before %s in %.2fs.' % (
+            archived, before.isoformat(), time.perf_counter() - start
+        )))
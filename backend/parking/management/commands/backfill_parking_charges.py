@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from parking import models
+
+class Command(BaseCommand):
+    help = 'Computes and stores the charges of the parkings that were closed before the charges were stored at exit.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of parkings updated per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # Go through the closed parkings of every vehicle in the order of their exits, so the latest exit of the vehicle
+        # before each parking is the previous row. This gives the same values that are stored when the vehicle exits.
+        vehicle_parkings = models.VehicleParking.objects.filter(
+            exit_datetime__isnull=False
+        ).select_related(
+            'parking_slot__mall_parking', 'parking_slot__parking_slot_size'
+        ).order_by('vehicle_id', 'exit_datetime', 'pk')
+
+        updated = 0
+        batch = []
+        latest_exit_datetime = None
+        previous_vehicle_id = None
+        for vehicle_parking in vehicle_parkings.iterator(chunk_size=batch_size):
+            if vehicle_parking.vehicle_id != previous_vehicle_id:
+                latest_exit_datetime = None
+                previous_vehicle_id = vehicle_parking.vehicle_id
+
+            parking_slot = vehicle_parking.parking_slot
+            vehicle_parking.set_charges(
+                parking_slot.mall_parking,
+                parking_slot.parking_slot_size.continuous_rate,
+                latest_exit_datetime
+            )
+            latest_exit_datetime = vehicle_parking.exit_datetime
+            batch.append(vehicle_parking)
+
+            if len(batch) >= batch_size:
+                updated += self._save(batch)
+                batch = []
+        updated += self._save(batch)
+
+        self.stdout.write(self.style.SUCCESS('Updated the charges of %d parkings.' % updated))
+
+    def _save(self, batch):
+        with transaction.atomic():
+            models.VehicleParking.objects.bulk_update(batch, ['is_fixed_starting_rate', 'total_charge'])
+        return len(batch)
@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+import asyncio
+import random
+import time
+
+from parking import benchmarking
+from parking import serializers
+
+class Command(BaseCommand):
+    help = (
+        'Compares the throughput of the sync entry and exit endpoints served by worker threads with the async endpoints '
+        'served by one event loop, under the same number of concurrent clients, on a throwaway database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slots', type=int, default=2000, help='Number of parking slots of the mall.')
+        parser.add_argument('--entries', type=int, default=3, help='Number of entries of the mall.')
+        parser.add_argument('--vehicles', type=int, default=500, help='Number of vehicles that park and then exit.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Number of concurrent clients.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['vehicles'] > options['slots'] // 2:
+            raise CommandError('The number of vehicles cannot be more than half of the slots.')
+        rng = random.Random(options['seed'])
+        num_entries = options['entries']
+
+        with benchmarking.isolated_database():
+            serializer = serializers.MallParkingSlotsSerializer(data=benchmarking.mall_layout(rng, options['slots'], num_entries))
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+            for name, run in [('sync', self.run_sync), ('async', self.run_async)]:
+                vehicles = [
+                    ('%s-%d' % (name.upper(), i), rng.randint(0, 2), rng.randrange(num_entries))
+                    for i in range(options['vehicles'])
+                ]
+                start = time.perf_counter()
+                latencies = run(vehicles, options['concurrency'])
+                elapsed = time.perf_counter() - start
+
+                summary = benchmarking.latency_summary(latencies)
+                self.stdout.write('%-5s %7.1f requests/s  p50 %8.2fms  p95 %8.2fms  p99 %8.2fms' % (
+                    name, len(latencies) / elapsed, summary['p50_ms'], summary['p95_ms'], summary['p99_ms']
+                ))
+
+    # sends the entries of every vehicle and then their exits, and returns the latencies of the requests
+    def run_sync(self, vehicles, concurrency):
+        def request(send):
+            start = time.perf_counter()
+            response = send(Client())
+            if response.status_code >= 400:
+                raise CommandError('Request failed with status %d: %s' % (response.status_code, response.content[:200]))
+            return time.perf_counter() - start
+
+        def run_requests(sends):
+            # every worker thread opens its own database connection, like the threads of a WSGI server
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                return list(executor.map(request, sends))
+
+        return run_requests([
+            (lambda client, vehicle=vehicle: client.post('/parking/mall_parking_slots/entry', {
+                'plate_number': vehicle[0], 'type': vehicle[1], 'entry_index': vehicle[2]
+            }, content_type='application/json'))
+            for vehicle in vehicles
+        ]) + run_requests([
+            (lambda client, vehicle=vehicle: client.patch('/parking/mall_parking_slots/exit', {
+                'plate_number': vehicle[0]
+            }, content_type='application/json'))
+            for vehicle in vehicles
+        ])
+
+    def run_async(self, vehicles, concurrency):
+        async def run_requests(sends):
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def request(send):
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await send(client)
+                    if response.status_code >= 400:
+                        raise CommandError('Request failed with status %d: %s' % (response.status_code, response.content[:200]))
+                    return time.perf_counter() - start
+
+            return await asyncio.gather(*(request(send) for send in sends))
+
+        async def run():
+            return await run_requests([
+                (lambda client, vehicle=vehicle: client.post('/parking/mall_parking_slots/async/entry', {
+                    'plate_number': vehicle[0], 'type': vehicle[1], 'entry_index': vehicle[2]
+                }, content_type='application/json'))
+                for vehicle in vehicles
+            ]) + await run_requests([
+                (lambda client, vehicle=vehicle: client.patch('/parking/mall_parking_slots/async/exit', {
+                    'plate_number': vehicle[0]
+                }, content_type='application/json'))
+                for vehicle in vehicles
+            ])
+
+        return asyncio.run(run())
@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from parking import benchmarking
+from parking import serializers
+
+# the profiles that use a SQLite file, the benchmark never runs against a configured PostgreSQL database
+SQLITE_PROFILES = ['sqlite-basic', 'sqlite']
+
+class Command(BaseCommand):
+    help = (
+        'Compares the write throughput of the SQLite database profiles (see app/db_profiles.py) with concurrent clients '
+        'that park and unpark vehicles, every profile in its own process on a new SQLite file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', choices=SQLITE_PROFILES, default=SQLITE_PROFILES, help='Profiles to measure.')
+        parser.add_argument('--slots', type=int, default=500, help='Number of parking slots of the mall.')
+        parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent clients.')
+        parser.add_argument('--vehicles', type=int, default=20, help='Number of vehicles that every client parks and unparks.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--worker', action='store_true', help='Runs the clients on the database of the environment and prints the results as JSON.')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] > options['slots']:
+            raise CommandError('The number of clients cannot be more than the number of slots.')
+        if options['worker']:
+            self.stdout.write(json.dumps(self.run_clients(options)))
+            return
+
+        for profile in options['profiles']:
+            result = self.run_profile(profile, options)
+            self.stdout.write('%-12s %7.1f writes/s  errors %4d  p50 %8.2fms  p95 %8.2fms  p99 %8.2fms' % (
+                profile, result['writes'] / result['seconds'], result['errors'],
+                result['p50_ms'], result['p95_ms'], result['p99_ms']
+            ))
+
+    # runs the clients in a new process with the profile selected by the environment, on a SQLite file of a temporary directory
+    def run_profile(self, profile, options):
+        with tempfile.TemporaryDirectory() as directory:
+            environ = dict(
+                os.environ,
+                PARKING_DATABASE_PROFILE=profile,
+                PARKING_DATABASE_NAME=os.path.join(directory, 'benchmark.sqlite3')
+            )
+            command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'benchmark_database_profiles', '--worker'] + [
+                '--%s=%s' % (name, options[name]) for name in ['slots', 'concurrency', 'vehicles', 'seed']
+            ]
+            completed = subprocess.run(command, env=environ, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError('The %s profile failed:\n%s' % (profile, completed.stderr))
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    # creates the tables and a mall, then every client parks and unparks its vehicles one after the other
+    def run_clients(self, options):
+        # allows the host of the test client
+        setup_test_environment()
+        call_command('migrate', verbosity=0, interactive=False)
+        call_command('loaddata', 'parking_sizes', verbosity=0)
+        rng = random.Random(options['seed'])
+        serializer = serializers.MallParkingSlotsSerializer(data=benchmarking.mall_layout(rng, options['slots'], 3))
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        connection.close()
+
+        def run_client(client_index):
+            client = Client()
+            latencies = []
+            errors = 0
+            for i in range(options['vehicles']):
+                plate_number = 'BENCH-%d-%d' % (client_index, i)
+                for send in [
+                    lambda: client.post('/parking/mall_parking_slots/entry', {
+                        'plate_number': plate_number, 'type': 0, 'entry_index': i % 3
+                    }, content_type='application/json'),
+                    lambda: client.patch('/parking/mall_parking_slots/exit', {
+                        'plate_number': plate_number
+                    }, content_type='application/json'),
+                ]:
+                    start = time.perf_counter()
+                    try:
+                        failed = send().status_code >= 400
+                    except Exception:
+                        # "database is locked" and the other database errors are raised by the test client
+                        failed = True
+                    if failed:
+                        errors += 1
+                    else:
+                        latencies.append(time.perf_counter() - start)
+            connection.close()
+            return latencies, errors
+
+        start = time.perf_counter()
+        # every client thread has its own database connection, like the threads of a WSGI server
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(run_client, range(options['concurrency'])))
+        seconds = time.perf_counter() - start
+
+        latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+        summary = benchmarking.latency_summary(latencies) if latencies else {'p50_ms': 0, 'p95_ms': 0, 'p99_ms': 0}
+        return {
+            'writes': len(latencies),
+            'errors': sum(errors for _, errors in results),
+            'seconds': seconds,
+            'p50_ms': summary['p50_ms'],
+            'p95_ms': summary['p95_ms'],
+            'p99_ms': summary['p99_ms'],
+        }
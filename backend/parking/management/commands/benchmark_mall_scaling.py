@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+import random
+
+from parking import allocator
+from parking import benchmarking
+from parking import models
+
+class Command(BaseCommand):
+    help = (
+        'Measures the entry latency as the number of malls grows, with the entries scoped to their mall and without, '
+        'each mall count on a throwaway database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--malls', type=int, nargs='+', default=[1, 10, 100], help='Numbers of malls to measure.')
+        parser.add_argument('--slots', type=int, default=1000, help='Number of parking slots of every mall.')
+        parser.add_argument('--entries', type=int, default=3, help='Number of entries of every mall.')
+        parser.add_argument('--requests', type=int, default=200, help='Number of entries measured for every mall count.')
+        parser.add_argument('--allocator', default=None, help='Allocator class to use instead of the PARKING_SLOT_ALLOCATOR setting.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        settings = {'PARKING_SLOT_ALLOCATOR': options['allocator']} if options['allocator'] else {}
+        with override_settings(**settings):
+            self.stdout.write('Allocator: %s' % type(allocator.get_allocator()).__name__)
+            for num_malls in options['malls']:
+                self.run(num_malls, options)
+
+    def run(self, num_malls, options):
+        rng = random.Random('%d-%d' % (options['seed'], num_malls))
+        num_entries = options['entries']
+
+        with benchmarking.isolated_database():
+            allocator.get_allocator().reset()
+            parking_slot_sizes = models.ParkingSlotSize.objects.in_bulk()
+            mall_parkings = []
+            for i in range(num_malls):
+                mall_parking = models.MallParking.objects.create(name='Mall %d' % i, num_entries=num_entries)
+                models.ParkingSlot.provision(mall_parking, [
+                    (parking_slot_sizes[rng.randint(0, 2)], [rng.randint(0, 1000) for _ in range(num_entries)])
+                    for _ in range(options['slots'])
+                ], rank=True)
+                mall_parkings.append(mall_parking)
+
+            client = APIClient()
+            results = {}
+            for scoped in (True, False):
+                requests = []
+                for i in range(options['requests']):
+                    data = {
+                        'plate_number': '%s-%d' % ('SCOPED' if scoped else 'ANY', i),
+                        'type': rng.randint(0, 2),
+                        'entry_index': rng.randrange(num_entries),
+                    }
+                    if scoped:
+                        data['mall_parking'] = rng.choice(mall_parkings).pk
+                    requests.append(lambda data=data: client.post('/parking/mall_parking_slots/entry', data, format='json'))
+                results['scoped' if scoped else 'any mall'] = benchmarking.run_scenario(requests)
+            allocator.get_allocator().reset()
+
+        for name, summary in results.items():
+            self.stdout.write('%4d malls, %-9s p50 %8.2fms  p95 %8.2fms  queries %.1f' % (
+                num_malls, name, summary['p50_ms'], summary['p95_ms'], summary['queries_mean']
+            ))
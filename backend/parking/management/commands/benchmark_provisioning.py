@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+import random
+
+from parking import benchmarking
+from parking import models
+from parking import serializers
+
+class Command(BaseCommand):
+    help = 'Measures how long it takes to provision a mall with the given number of parking slots on a throwaway database.'
+
+    # a mall of 100000 slots with 3 entries, 300000 distance rows, should be provisioned within 10 seconds
+    TARGET_DISTANCES_PER_SECOND = 30000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slots', type=int, default=100000, help='Number of parking slots of the mall.')
+        parser.add_argument('--entries', type=int, default=3, help='Number of entries of the mall.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--max-seconds', type=float,
+            help='Fails when validation and provisioning take longer, %d distance rows per second by default.' % (
+                self.TARGET_DISTANCES_PER_SECOND
+            )
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        num_entries = options['entries']
+        max_seconds = options['max_seconds']
+        if max_seconds is None:
+            max_seconds = options['slots'] * num_entries / self.TARGET_DISTANCES_PER_SECOND
+        data = benchmarking.mall_layout(rng, options['slots'], num_entries)
+
+        with benchmarking.isolated_database():
+            serializer = serializers.MallParkingSlotsSerializer(data=data)
+            with benchmarking.measure() as validation:
+                serializer.is_valid(raise_exception=True)
+            with benchmarking.measure() as provisioning:
+                serializer.save()
+
+            self.stdout.write('Provisioned %d parking slots with %d entries.' % (models.ParkingSlot.objects.count(), num_entries))
+
+        self.stdout.write('validation: %.2fs, %d queries' % (validation['seconds'], validation['queries']))
+        self.stdout.write('provisioning: %.2fs, %d queries' % (provisioning['seconds'], provisioning['queries']))
+
+        total_seconds = validation['seconds'] + provisioning['seconds']
+        if total_seconds > max_seconds:
+            raise CommandError('total: %.2fs, over the target of %.2fs.' % (total_seconds, max_seconds))
+        self.stdout.write(self.style.SUCCESS('total: %.2fs, target: %.2fs' % (total_seconds, max_seconds)))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from parking import layout_import
+from parking import models
+
+class Command(BaseCommand):
+    help = 'Imports the parking slots of a mall from a CSV or NDJSON layout file with one slot per line (see parking/layout_import.py).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the layout file.')
+        parser.add_argument('--mall-parking', type=int, help='Primary key of the mall to add the slots to.')
+        parser.add_argument('--name', help='Name of a new mall to create for the slots.')
+        parser.add_argument('--num-entries', type=int, default=3, help='Number of entries of the new mall.')
+        parser.add_argument('--resume', type=int, help='Primary key of a failed or interrupted layout import to continue.')
+        parser.add_argument('--format', choices=layout_import.FILE_FORMATS, help='Format of the file, guessed from the extension by default.')
+        parser.add_argument('--batch-size', type=int, default=layout_import.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+
+        if options['resume'] is not None:
+            try:
+                import_record = models.LayoutImport.objects.select_related('mall_parking').get(pk=options['resume'])
+            except models.LayoutImport.DoesNotExist:
+                raise CommandError('Unknown layout import %d.' % options['resume'])
+            self.stdout.write('Resuming after %d imported rows.' % import_record.rows_imported)
+        else:
+            file_format = options['format'] or layout_import.file_format_from_name(path)
+            if file_format is None:
+                raise CommandError('Unknown file format, use --format.')
+
+            if options['mall_parking'] is not None:
+                try:
+                    mall_parking = models.MallParking.objects.get(pk=options['mall_parking'])
+                except models.MallParking.DoesNotExist:
+                    raise CommandError('Unknown mall parking %d.' % options['mall_parking'])
+            elif options['name']:
+                if options['num_entries'] < 3:
+                    raise CommandError('The number of entries cannot be less than 3.')
+                mall_parking = models.MallParking.objects.create(name=options['name'], num_entries=options['num_entries'])
+            else:
+                raise CommandError('Either --mall-parking, --name or --resume is required.')
+
+            import_record = models.LayoutImport.objects.create(
+                mall_parking=mall_parking,
+                file_name=path,
+                file_format=file_format
+            )
+
+        def progress(import_record):
+            self.stdout.write('Imported %d rows.' % import_record.rows_imported)
+
+        with open(path, encoding='utf-8', newline='') as lines:
+            try:
+                layout_import.run(import_record, lines, batch_size=options['batch_size'], progress=progress)
+            except layout_import.LayoutImportError as error:
+                raise CommandError('%s Resume with --resume %d once the file is fixed.' % (error, import_record.pk))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d parking slots into mall parking %d (layout import %d).' % (
+                import_record.rows_imported, import_record.mall_parking_id, import_record.pk
+            )
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from parking import occupancy
+
+class Command(BaseCommand):
+    help = 'Verifies the occupancy counters against the parking slots, meant to be run periodically (e.g. from cron).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Replace the counters that are off with the actual values.')
+
+    def handle(self, *args, **options):
+        mismatches = occupancy.reconcile(fix=options['fix'])
+        for mall_parking_id, parking_slot_size_id, counted, actual in mismatches:
+            self.stdout.write(
+                'Mall parking %s, parking slot size %s: counted %d/%d occupied, actual %d/%d occupied.' % (
+                    mall_parking_id, parking_slot_size_id, counted[1], counted[0], actual[1], actual[0]
+                )
+            )
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('The occupancy counters are correct.'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS('Fixed %d occupancy counters.' % len(mismatches)))
+        else:
+            self.stdout.write(self.style.WARNING('%d occupancy counters are off, run with --fix to correct them.' % len(mismatches)))
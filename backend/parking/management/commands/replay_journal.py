@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+import time
+
+from parking import journal
+
+class Command(BaseCommand):
+    help = 'Replays the parking event journal and compares the open parkings with the parking slots.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-start', action='store_true', help='Replay every event instead of starting from the latest snapshot.')
+        parser.add_argument('--snapshot', action='store_true', help='Store the replayed state as the new snapshot.')
+        parser.add_argument('--fix', action='store_true', help='Set the parking slots that differ to the state of the journal.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['snapshot']:
+            snapshot, state = journal.take_snapshot()
+        else:
+            state = journal.replay(from_snapshot=not options['from_start'])
+        self.stdout.write('Replayed %d events up to event %d in %.2fs, %d open parkings.' % (
+            state.events_replayed, state.last_event_id, time.perf_counter() - start, len(state.open_parkings)
+        ))
+        if options['snapshot']:
+            self.stdout.write('Stored the snapshot at event %d.' % snapshot.last_event_id)
+
+        mismatches = journal.verify(state, fix=options['fix'])
+        for parking_slot_id, journal_vehicle_parking_id, table_vehicle_parking_id in mismatches:
+            self.stdout.write('Parking slot %s: vehicle parking %s in the journal, %s in the table.' % (
+                parking_slot_id, journal_vehicle_parking_id, table_vehicle_parking_id
+            ))
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('The parking slots match the journal.'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS('Fixed %d parking slots.' % len(mismatches)))
+        else:
+            self.stdout.write(self.style.WARNING('%d parking slots differ from the journal, run with --fix to restore them.' % len(mismatches)))
@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+from datetime import datetime, timezone
+import django
+import json
+import platform
+import random
+
+from parking import benchmarking
+
+class Command(BaseCommand):
+    help = (
+        'Measures the latency percentiles and query counts of mall creation, entry, exit and the history list on synthetic '
+        'malls, each on a throwaway database. The results can be saved as JSON and compared against a stored baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', default=['1000x3', '10000x10'],
+            help='Mall sizes as <slots>x<entries>, e.g. 1000x3 10000x10 100000x20.'
+        )
+        parser.add_argument('--history', type=int, default=10000, help='Number of past parkings seeded for every mall.')
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests of the entry, exit, history list and analytics scenarios.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--repeats', type=int, default=5,
+            help='Number of runs of every size, the latencies are the medians of the runs.'
+        )
+        parser.add_argument('--output', help='Path of the JSON file the results are written to.')
+        parser.add_argument('--compare', help='Path of a JSON file with baseline results, regressions make the command fail.')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Allowed growth of the median p95 latencies, as a fraction.')
+
+    def parse_size(self, size):
+        try:
+            num_slots, num_entries = (int(value) for value in size.lower().split('x'))
+        except ValueError:
+            raise CommandError('Invalid size %s, expected <slots>x<entries>.' % size)
+        if num_slots < 2 or num_entries < 3:
+            raise CommandError('Invalid size %s, a mall needs at least 2 slots and 3 entries.' % size)
+        return num_slots, num_entries
+
+    def handle(self, *args, **options):
+        sizes = [(size, self.parse_size(size)) for size in options['sizes']]
+        if options['repeats'] < 1:
+            raise CommandError('The number of repeats must be at least 1.')
+
+        report = {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'seed': options['seed'],
+                'history': options['history'],
+                'requests': options['requests'],
+                'repeats': options['repeats'],
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'results': {},
+        }
+
+        for size, (num_slots, num_entries) in sizes:
+            self.stdout.write('Benchmarking a mall with %d slots and %d entries...' % (num_slots, num_entries))
+            runs = []
+            for _ in range(options['repeats']):
+                # every size gets the same random data for the same seed, whichever sizes are run and in every run
+                rng = random.Random('%d-%s' % (options['seed'], size))
+                with benchmarking.isolated_database():
+                    runs.append(benchmarking.run_suite(
+                        APIClient(), rng, num_slots, num_entries, options['history'], options['requests']
+                    ))
+            results = benchmarking.combine_runs(runs)
+            report['results'][size] = results
+
+            for scenario, summary in results.items():
+                self.stdout.write('  %-14s p50 %8.2fms  p95 %8.2fms (%.2f-%.2fms)  p99 %8.2fms  queries %5.1f (max %d)' % (
+                    scenario, summary['p50_ms'], summary['p95_ms'], min(summary['p95_runs_ms']), max(summary['p95_runs_ms']),
+                    summary['p99_ms'], summary['queries_mean'], summary['queries_max']
+                ))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write('Results written to %s.' % options['output'])
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = benchmarking.compare(baseline, report, threshold=options['threshold'])
+            if regressions:
+                for regression in regressions:
+                    self.stdout.write(self.style.ERROR(regression))
+                raise CommandError('%d regressions against %s.' % (len(regressions), options['compare']))
+            self.stdout.write(self.style.SUCCESS('No regressions against %s.' % options['compare']))
@@ -0,0 +1,252 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.http import HttpResponse
+import threading
+import time
+
+from . import models
+
+# Request instrumentation and metrics in the Prometheus text format.
+#
+# MetricsMiddleware times every request along with the database queries, the serializers and the allocator, adds the
+# timings to a Server-Timing header and records them in the metrics below, which are served by metrics_view() at /metrics.
+# The counters and histograms live in the memory of the process, so with several worker processes every process has to
+# be scraped on its own. The occupancy gauges are read from the database and are the same in every process.
+# The body of streaming responses (e.g. the history export) is sent after the middleware, so it is not part of the timings.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _format_labels(labels):
+    labels = list(labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.label_names), 0)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.description), '# TYPE %s counter' % self.name]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append('%s%s %s' % (self.name, _format_labels(zip(self.label_names, key)), _format_value(value)))
+        return lines
+
+class Histogram:
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {} # labels -> [bucket counts..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            # the counts are stored per bucket and made cumulative when rendered
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-1] += value
+
+    def count(self, **labels):
+        counts = self._values.get(tuple(labels[name] for name in self.label_names))
+        return 0 if counts is None else sum(counts[:-1])
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.description), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in values:
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (self.name, _format_labels(labels + [('le', _format_value(bound))]), cumulative))
+            lines.append('%s_sum%s %s' % (self.name, _format_labels(labels), _format_value(counts[-1])))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(labels), cumulative))
+        return lines
+
+REQUEST_DURATION = Histogram(
+    'parking_http_request_duration_seconds', 'Duration of the HTTP requests.', ('method', 'route', 'status')
+)
+DB_QUERIES = Counter('parking_db_queries_total', 'Number of database queries made by the requests.', ('route',))
+DB_DURATION = Counter('parking_db_query_duration_seconds_total', 'Time spent in database queries by the requests.', ('route',))
+SERIALIZER_DURATION = Counter(
+    'parking_serializer_duration_seconds_total', 'Time spent converting instances to responses by the serializers.', ('route',)
+)
+ALLOCATOR_DURATION = Counter('parking_allocator_duration_seconds_total', 'Time spent choosing parking slots.', ('route',))
+ENTRIES = Counter('parking_entries_total', 'Number of vehicles that were parked.')
+EXITS = Counter('parking_exits_total', 'Number of vehicles that exited.')
+ALLOCATION_FAILURES = Counter('parking_allocation_failures_total', 'Number of vehicles that could not be given a parking slot.')
+IDEMPOTENCY_LOOKUPS = Counter(
+    'parking_idempotency_lookups_total', 'Lookups of the idempotency keys of the entries and exits, by hit or miss.', ('result',)
+)
+
+METRICS = [
+    REQUEST_DURATION, DB_QUERIES, DB_DURATION, SERIALIZER_DURATION, ALLOCATOR_DURATION, ENTRIES, EXITS, ALLOCATION_FAILURES,
+    IDEMPOTENCY_LOOKUPS
+]
+
+# timings of the request handled by the current thread or task, None outside of MetricsMiddleware
+_timings = ContextVar('parking_request_timings', default=None)
+
+# adds the time spent inside the block to the named timing of the current request
+@contextmanager
+def timer(name):
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+# Times the queries of the request that is being handled. It is added to every database connection once it is created
+# (see signals.py), so the queries are counted whichever thread runs them, e.g. the sync_to_async calls of the async views.
+def _execute_wrapper(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings['db'] += time.perf_counter() - start
+        timings['db_queries'] += 1
+
+def instrument_connection(connection):
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+# Serializer mixin that adds the time spent in to_representation() to the serializer timing of the request.
+# Nested serializers are counted once as part of the outermost serializer.
+class TimedSerializerMixin:
+    def to_representation(self, instance):
+        timings = _timings.get()
+        if timings is None or timings.get('_serializing'):
+            return super().to_representation(instance)
+
+        timings['_serializing'] = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings['_serializing'] = False
+            timings['serializer'] = timings.get('serializer', 0.0) + time.perf_counter() - start
+
+# The middleware supports both the sync and the async request paths, so the async views are not moved to a thread.
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'PARKING_METRICS_SERVER_TIMING', True)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings = {'db': 0.0, 'db_queries': 0}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self._record(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = {'db': 0.0, 'db_queries': 0}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self._record(request, response, timings, time.perf_counter() - start)
+
+    def _record(self, request, response, timings, duration):
+        # the route pattern keeps the number of label values small, unlike the path
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = '/' + resolver_match.route if resolver_match is not None else 'unmatched'
+
+        REQUEST_DURATION.observe(duration, method=request.method, route=route, status=response.status_code)
+        DB_QUERIES.inc(timings['db_queries'], route=route)
+        DB_DURATION.inc(timings['db'], route=route)
+        SERIALIZER_DURATION.inc(timings.get('serializer', 0.0), route=route)
+        if 'allocator' in timings:
+            ALLOCATOR_DURATION.inc(timings['allocator'], route=route)
+
+        if self.server_timing:
+            entries = ['db;dur=%.2f;desc="%d queries"' % (timings['db'] * 1000, timings['db_queries'])]
+            for name in ('serializer', 'allocator'):
+                if name in timings:
+                    entries.append('%s;dur=%.2f' % (name, timings[name] * 1000))
+            entries.append('total;dur=%.2f' % (duration * 1000))
+            response['Server-Timing'] = ', '.join(entries)
+        return response
+
+# returns the lines of the occupancy gauges from the occupancy counters of every mall (see models.ParkingOccupancy)
+def _occupancy_lines():
+    lines = [
+        '# HELP parking_slots Number of parking slots.',
+        '# TYPE parking_slots gauge',
+    ]
+    occupied_lines = [
+        '# HELP parking_slots_occupied Number of occupied parking slots.',
+        '# TYPE parking_slots_occupied gauge',
+    ]
+    counters = models.ParkingOccupancy.objects.order_by('mall_parking', 'parking_slot_size').values_list(
+        'mall_parking', 'parking_slot_size__name', 'total_slots', 'occupied_slots'
+    )
+    for mall_parking_id, parking_slot_size_name, total_slots, occupied_slots in counters:
+        labels = _format_labels([('mall_parking', mall_parking_id), ('parking_slot_size', parking_slot_size_name)])
+        lines.append('parking_slots%s %d' % (labels, total_slots))
+        occupied_lines.append('parking_slots_occupied%s %d' % (labels, occupied_slots))
+    return lines + occupied_lines
+
+# returns every metric in the Prometheus text format
+def render():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += _occupancy_lines()
+    return '\n'.join(lines) + '\n'
+
+def metrics_view(request):
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0007_parkingslot_vehicle_parking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingSlotDistance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_index', models.IntegerField()),
+                ('distance', models.IntegerField()),
+                ('size_value', models.IntegerField()),
+                ('mall_parking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='parking.mallparking')),
+                ('parking_slot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_distances', to='parking.parkingslot')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mall_parking', 'entry_index', 'distance', 'size_value'], name='parking_slot_distance_rank')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='parkingslotdistance',
+            constraint=models.UniqueConstraint(fields=('parking_slot', 'entry_index'), name='unique_parking_slot_entry_distance'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+import json
+
+from django.db import migrations
+
+def populate_slot_distances(apps, schema_editor):
+    ParkingSlot = apps.get_model('parking', 'ParkingSlot')
+    ParkingSlotDistance = apps.get_model('parking', 'ParkingSlotDistance')
+
+    parking_slots = ParkingSlot.objects.values_list('pk', 'mall_parking_id', 'parking_slot_size__value', 'distances')
+    slot_distances = []
+    for pk, mall_parking_id, size_value, distances in parking_slots.iterator():
+        for entry_index, distance in enumerate(json.loads(distances)):
+            slot_distances.append(ParkingSlotDistance(
+                parking_slot_id=pk,
+                mall_parking_id=mall_parking_id,
+                entry_index=entry_index,
+                distance=distance,
+                size_value=size_value
+            ))
+        if len(slot_distances) >= 1000:
+            ParkingSlotDistance.objects.bulk_create(slot_distances)
+            slot_distances = []
+    ParkingSlotDistance.objects.bulk_create(slot_distances)
+
+def clear_slot_distances(apps, schema_editor):
+    ParkingSlotDistance = apps.get_model('parking', 'ParkingSlotDistance')
+    ParkingSlotDistance.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0008_parkingslotdistance'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_slot_distances, clear_slot_distances),
+    ]
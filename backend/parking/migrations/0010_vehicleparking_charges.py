@@ -0,0 +1,23 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0009_populate_parkingslotdistance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicleparking',
+            name='is_fixed_starting_rate',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+        migrations.AddField(
+            model_name='vehicleparking',
+            name='total_charge',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0010_vehicleparking_charges'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehicleparking',
+            index=models.Index(fields=['-entry_datetime', '-id'], name='vehicle_parking_entry_key'),
+        ),
+    ]
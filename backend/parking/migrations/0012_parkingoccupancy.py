@@ -0,0 +1,28 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0011_vehicleparking_entry_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_slots', models.IntegerField(default=0)),
+                ('occupied_slots', models.IntegerField(default=0)),
+                ('mall_parking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='parking.mallparking')),
+                ('parking_slot_size', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='parking.parkingslotsize')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='parkingoccupancy',
+            constraint=models.UniqueConstraint(fields=('mall_parking', 'parking_slot_size'), name='unique_mall_parking_slot_size_occupancy'),
+        ),
+    ]
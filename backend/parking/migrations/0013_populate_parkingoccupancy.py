@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count, Q
+
+def populate_occupancy(apps, schema_editor):
+    ParkingSlot = apps.get_model('parking', 'ParkingSlot')
+    ParkingOccupancy = apps.get_model('parking', 'ParkingOccupancy')
+
+    counts = ParkingSlot.objects.values('mall_parking', 'parking_slot_size').annotate(
+        total_slots=Count('pk'),
+        occupied_slots=Count('pk', filter=Q(vehicle_parking__isnull=False))
+    )
+    ParkingOccupancy.objects.bulk_create([
+        ParkingOccupancy(
+            mall_parking_id=count['mall_parking'],
+            parking_slot_size_id=count['parking_slot_size'],
+            total_slots=count['total_slots'],
+            occupied_slots=count['occupied_slots']
+        )
+        for count in counts
+    ])
+
+def clear_occupancy(apps, schema_editor):
+    ParkingOccupancy = apps.get_model('parking', 'ParkingOccupancy')
+    ParkingOccupancy.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0012_parkingoccupancy'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_occupancy, clear_occupancy),
+    ]
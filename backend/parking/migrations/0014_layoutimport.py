@@ -0,0 +1,32 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0013_populate_parkingoccupancy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LayoutImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('file_name', models.CharField(blank=True, max_length=255)),
+                ('file_format', models.CharField(max_length=10)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('failed', 'Failed'), ('completed', 'Completed')], default='running', max_length=10)),
+                ('rows_imported', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('mall_parking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='parking.mallparking')),
+            ],
+            options={
+                'ordering': ['-updated_at', '-created_at'],
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+# fills the latest exit of every vehicle from its parking history
+def populate_last_exit(apps, schema_editor):
+    Vehicle = apps.get_model('parking', 'Vehicle')
+    VehicleParking = apps.get_model('parking', 'VehicleParking')
+
+    latest_parkings = VehicleParking.objects.filter(
+        vehicle=OuterRef('pk'),
+        exit_datetime__isnull=False
+    ).order_by('-exit_datetime')
+    Vehicle.objects.update(
+        last_exit_datetime=Subquery(latest_parkings.values('exit_datetime')[:1]),
+        last_exit_mall_parking=Subquery(latest_parkings.values('parking_slot__mall_parking')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0014_layoutimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='last_exit_datetime',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='last_exit_mall_parking',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='parking.mallparking'),
+        ),
+        migrations.RunPython(populate_last_exit, migrations.RunPython.noop),
+    ]
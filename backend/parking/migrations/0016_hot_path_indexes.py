@@ -0,0 +1,77 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:18
+
+from django.db import migrations, models
+from django.db.models import Count, F
+import django.db.models.deletion
+
+# Closes the extra open parkings of the vehicles that have more than one, which the unique constraint would reject.
+# The parking that holds a slot is kept, or the latest one when none does, and the others are closed when the kept one
+# entered, without a charge since the vehicle never exited them. Their slots are freed and no longer counted.
+def close_duplicate_open_parkings(apps, schema_editor):
+    VehicleParking = apps.get_model('parking', 'VehicleParking')
+    ParkingSlot = apps.get_model('parking', 'ParkingSlot')
+    ParkingOccupancy = apps.get_model('parking', 'ParkingOccupancy')
+
+    open_parkings = VehicleParking.objects.filter(exit_datetime__isnull=True)
+    vehicle_ids = open_parkings.order_by().values('vehicle').annotate(count=Count('pk')).filter(count__gt=1).values_list(
+        'vehicle', flat=True
+    )
+    for vehicle_id in list(vehicle_ids):
+        vehicle_parkings = list(open_parkings.filter(vehicle_id=vehicle_id).order_by('-entry_datetime', '-pk'))
+        parking_slots = {
+            parking_slot.vehicle_parking_id: parking_slot
+            for parking_slot in ParkingSlot.objects.filter(vehicle_parking__in=vehicle_parkings)
+        }
+        kept = next(
+            (vehicle_parking for vehicle_parking in vehicle_parkings if vehicle_parking.pk in parking_slots), vehicle_parkings[0]
+        )
+
+        for vehicle_parking in vehicle_parkings:
+            if vehicle_parking.pk == kept.pk:
+                continue
+            VehicleParking.objects.filter(pk=vehicle_parking.pk).update(
+                exit_datetime=max(kept.entry_datetime, vehicle_parking.entry_datetime), total_charge=0
+            )
+            parking_slot = parking_slots.get(vehicle_parking.pk)
+            if parking_slot is not None:
+                ParkingSlot.objects.filter(pk=parking_slot.pk).update(vehicle_parking=None)
+                ParkingOccupancy.objects.filter(
+                    mall_parking_id=parking_slot.mall_parking_id, parking_slot_size_id=parking_slot.parking_slot_size_id
+                ).update(occupied_slots=F('occupied_slots') - 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0015_vehicle_last_exit'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='parkingslot',
+            name='vehicle_parking',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='parking.vehicleparking'),
+        ),
+        migrations.AlterField(
+            model_name='vehicleparking',
+            name='vehicle',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='parking.vehicle'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingslot',
+            index=models.Index(condition=models.Q(('vehicle_parking__isnull', True)), fields=['mall_parking', 'parking_slot_size'], name='parking_slot_free'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingslot',
+            index=models.Index(condition=models.Q(('vehicle_parking__isnull', False)), fields=['vehicle_parking'], name='parking_slot_occupied'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicleparking',
+            index=models.Index(fields=['vehicle', 'exit_datetime'], name='vehicle_parking_exit_key'),
+        ),
+        migrations.RunPython(close_duplicate_open_parkings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vehicleparking',
+            constraint=models.UniqueConstraint(condition=models.Q(('exit_datetime__isnull', True)), fields=('vehicle',), name='unique_active_vehicle_parking'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:20
+
+from django.db import migrations, models
+import json
+
+# the parkings that are open before the journal starts are stored as the first snapshot
+def snapshot_open_parkings(apps, schema_editor):
+    ParkingSlot = apps.get_model('parking', 'ParkingSlot')
+    ParkingJournalSnapshot = apps.get_model('parking', 'ParkingJournalSnapshot')
+
+    occupied_slots = ParkingSlot.objects.exclude(vehicle_parking=None).values_list(
+        'vehicle_parking', 'pk', 'mall_parking', 'vehicle_parking__vehicle'
+    )
+    ParkingJournalSnapshot.objects.create(last_event_id=0, open_parkings=json.dumps({
+        vehicle_parking_id: [parking_slot_id, mall_parking_id, plate_number]
+        for vehicle_parking_id, parking_slot_id, mall_parking_id, plate_number in occupied_slots
+    }))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0016_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.SmallIntegerField(choices=[(0, 'Park'), (1, 'Unpark')])),
+                ('occurred_at', models.DateTimeField()),
+                ('vehicle_parking_id', models.BigIntegerField()),
+                ('parking_slot_id', models.BigIntegerField()),
+                ('mall_parking_id', models.BigIntegerField()),
+                ('plate_number', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ParkingJournalSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_event_id', models.BigIntegerField()),
+                ('open_parkings', models.TextField()),
+            ],
+            options={
+                'ordering': ['-last_event_id'],
+            },
+        ),
+        migrations.RunPython(snapshot_open_parkings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0017_parking_event_journal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedVehicleParking',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('entry_index', models.IntegerField()),
+                ('entry_datetime', models.DateTimeField()),
+                ('exit_datetime', models.DateTimeField()),
+                ('plate_number', models.CharField(max_length=255)),
+                ('vehicle_type', models.IntegerField(choices=[(0, 'S'), (1, 'M'), (2, 'L')])),
+                ('mall_parking_id', models.BigIntegerField()),
+                ('parking_slot_id', models.BigIntegerField()),
+                ('parking_slot_size_id', models.BigIntegerField()),
+                ('is_fixed_starting_rate', models.BooleanField()),
+                ('total_charge', models.IntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-entry_datetime', '-id'], name='archived_parking_entry_key')],
+            },
+        ),
+    ]
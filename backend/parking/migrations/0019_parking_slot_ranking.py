@@ -0,0 +1,53 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+import struct
+
+# builds the rankings of the existing malls like ParkingSlotRanking.rebuild()
+def build_rankings(apps, schema_editor):
+    ParkingSlot = apps.get_model('parking', 'ParkingSlot')
+    ParkingSlotRanking = apps.get_model('parking', 'ParkingSlotRanking')
+    record = struct.Struct('<iiq')
+
+    rankings = {}
+    for pk, mall_parking_id, size_value, distances in ParkingSlot.objects.values_list(
+        'pk', 'mall_parking', 'parking_slot_size__value', 'distances'
+    ).order_by().iterator():
+        for entry_index, distance in enumerate(json.loads(distances)):
+            rankings.setdefault((mall_parking_id, entry_index), []).append((distance, size_value, pk))
+
+    ParkingSlotRanking.objects.bulk_create([
+        ParkingSlotRanking(
+            mall_parking_id=mall_parking_id,
+            entry_index=entry_index,
+            version=1,
+            slots=b''.join(record.pack(*slot) for slot in sorted(slots))
+        )
+        for (mall_parking_id, entry_index), slots in rankings.items()
+    ], batch_size=100)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0018_archivedvehicleparking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingSlotRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_index', models.IntegerField()),
+                ('version', models.IntegerField(default=0)),
+                ('slots', models.BinaryField()),
+                ('mall_parking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='parking.mallparking')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='parkingslotranking',
+            constraint=models.UniqueConstraint(fields=('mall_parking', 'entry_index'), name='unique_mall_parking_entry_ranking'),
+        ),
+        migrations.RunPython(build_rankings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 08:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0019_parking_slot_ranking'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='parkingslotdistance',
+            name='mall_parking',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='parking.mallparking'),
+        ),
+        migrations.AlterField(
+            model_name='parkingslotdistance',
+            name='parking_slot',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='slot_distances', to='parking.parkingslot'),
+        ),
+    ]
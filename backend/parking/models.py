@@ -1,5 +1,12 @@
 from django.db import models
-import math
+from django.db.models import Q
+from django.utils import timezone
+import heapq
+import json
+import struct
+
+from . import bulk
+from . import fares
 
 # base information for every entry in the database to determine when things were added and updated
 class BaseInfo(models.Model):
@@ -29,10 +36,28 @@ class Vehicle(BaseInfo):
         L = 2
     plate_number = models.CharField(max_length=255, primary_key=True)
     type = models.IntegerField(choices=VehicleType.choices)
+    # latest exit of the vehicle for checking if it is returning, kept up to date on every exit so the check does not
+    # have to search the parking history
+    last_exit_datetime = models.DateTimeField(blank=True, null=True)
+    last_exit_mall_parking = models.ForeignKey(
+        MallParking, on_delete=models.SET_NULL, blank=True, null=True, related_name='+'
+    )
 
     def __str__(self):
         return self.plate_number + " - " + str(self.type)
 
+    # stores the exit as the latest exit of the vehicles unless they already have a later one, returns the number of
+    # updated vehicles
+    @classmethod
+    def record_exit(cls, plate_numbers, exit_datetime, mall_parking_id):
+        return cls.objects.filter(pk__in=plate_numbers).filter(
+            Q(last_exit_datetime__isnull=True) | Q(last_exit_datetime__lt=exit_datetime)
+        ).update(
+            last_exit_datetime=exit_datetime,
+            last_exit_mall_parking_id=mall_parking_id,
+            updated_at=timezone.now()
+        )
+
 # Parking slot size was created as a class to allow for other parking slot sizes to be added in the future
 class ParkingSlotSize(BaseInfo):
     name = models.CharField(max_length=255) # default values SP, MP, and LP
@@ -50,68 +75,469 @@ class ParkingSlot(BaseInfo):
     mall_parking = models.ForeignKey(MallParking, on_delete=models.CASCADE)
     parking_slot_size = models.ForeignKey(ParkingSlotSize, on_delete=models.CASCADE)
     distances = models.TextField() # array of integers in JSON format
-    vehicle_parking = models.ForeignKey('VehicleParking', null=True, blank=True, on_delete=models.SET_NULL)
+    # indexed by the partial indexes below instead of the default foreign key index
+    vehicle_parking = models.ForeignKey('VehicleParking', null=True, blank=True, on_delete=models.SET_NULL, db_index=False)
+
+    class Meta(BaseInfo.Meta):
+        indexes = [
+            # free slots by mall and size, read when allocating and counting the free slots
+            models.Index(
+                fields=['mall_parking', 'parking_slot_size'],
+                condition=Q(vehicle_parking__isnull=True),
+                name='parking_slot_free'
+            ),
+            # occupied slots by parking, read when looking up the slot of a parked vehicle
+            models.Index(fields=['vehicle_parking'], condition=Q(vehicle_parking__isnull=False), name='parking_slot_occupied'),
+        ]
 
     def __str__(self) -> str:
         return str(self.pk) + " - " + self.parking_slot_size.__str__()
 
+    # Occupies the parking slot with a conditional update so that only one vehicle parking can claim a free slot.
+    # Returns False if the slot was already claimed by another entry.
+    def claim(self, vehicle_parking):
+        updated_at = timezone.now()
+        claimed = ParkingSlot.objects.filter(pk=self.pk, vehicle_parking=None).update(
+            vehicle_parking=vehicle_parking,
+            updated_at=updated_at
+        )
+        if claimed:
+            self.vehicle_parking = vehicle_parking
+            self.updated_at = updated_at
+        return claimed == 1
+
+    # frees the parking slot if it is still occupied by the vehicle parking, returns False otherwise
+    def release(self, vehicle_parking):
+        updated_at = timezone.now()
+        released = ParkingSlot.objects.filter(pk=self.pk, vehicle_parking=vehicle_parking).update(
+            vehicle_parking=None,
+            updated_at=updated_at
+        )
+        if released:
+            self.vehicle_parking = None
+            self.updated_at = updated_at
+        return released == 1
+
+    # key of the occupancy counters that count this parking slot
+    def occupancy_key(self):
+        return (self.mall_parking_id, self.parking_slot_size_id)
+
+    # returns the distances array from the JSON format
+    def get_distances(self):
+        return json.loads(self.distances)
+
+    # creates the normalized distance rows for this parking slot without saving them
+    def build_slot_distances(self):
+        return [
+            ParkingSlotDistance(
+                parking_slot=self,
+                mall_parking_id=self.mall_parking_id,
+                entry_index=entry_index,
+                distance=distance,
+                size_value=self.parking_slot_size.value
+            )
+            for entry_index, distance in enumerate(self.get_distances())
+        ]
+
+    # replaces the normalized distance rows with the current distances of the parking slot
+    def sync_slot_distances(self):
+        self.slot_distances.all().delete()
+        ParkingSlotDistance.objects.bulk_create(self.build_slot_distances())
+
+    # Inserts the parking slots of the mall from (parking slot size, distances) rows along with their normalized distance
+    # rows and occupancy counters, in chunks of plain inserts (see bulk.insert_rows()) instead of saving every slot.
+    # The save signals are not sent, so the callers have to update the allocator. With rank, the new slots are merged
+    # into the rankings of the mall from the rows in memory, otherwise the callers that insert the slots in several
+    # calls rebuild the rankings once all the slots are inserted (see ParkingSlotRanking.rebuild()).
+    # Returns the number of slots.
+    @classmethod
+    def provision(cls, mall_parking, parking_slot_rows, batch_size=5000, rank=False):
+        # the new slots are the ones after the last slot of the mall
+        last_pk = cls.objects.filter(mall_parking=mall_parking).aggregate(last_pk=models.Max('pk'))['last_pk'] or 0
+
+        mall_parking_pk = mall_parking.pk
+        now = bulk.adapt_value(cls, 'created_at', timezone.now())
+        num_slots = bulk.insert_rows(
+            cls,
+            ['created_at', 'updated_at', 'mall_parking', 'parking_slot_size', 'distances'],
+            (
+                (now, now, mall_parking_pk, parking_slot_size.pk, json.dumps(distances))
+                for parking_slot_size, distances in parking_slot_rows
+            ),
+            batch_size=batch_size
+        )
+
+        # the primary keys are increasing, so they follow the order in which the slots were inserted
+        parking_slot_pks = list(
+            cls.objects.filter(mall_parking=mall_parking, pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)
+        )
+        bulk.insert_rows(
+            ParkingSlotDistance,
+            ['parking_slot', 'mall_parking', 'entry_index', 'distance', 'size_value'],
+            (
+                (parking_slot_pk, mall_parking_pk, entry_index, distance, parking_slot_size.value)
+                for parking_slot_pk, (parking_slot_size, distances) in zip(parking_slot_pks, parking_slot_rows)
+                for entry_index, distance in enumerate(distances)
+            ),
+            batch_size=batch_size
+        )
+
+        total_slots = {}
+        for parking_slot_size, _ in parking_slot_rows:
+            key = (mall_parking_pk, parking_slot_size.pk)
+            total_slots[key] = total_slots.get(key, 0) + 1
+        ParkingOccupancy.adjust(total_slots=total_slots)
+
+        if rank:
+            records = {}
+            for parking_slot_pk, (parking_slot_size, distances) in zip(parking_slot_pks, parking_slot_rows):
+                for entry_index, distance in enumerate(distances):
+                    records.setdefault(entry_index, []).append((distance, parking_slot_size.value, parking_slot_pk))
+            ParkingSlotRanking.add_slots(mall_parking_pk, records)
+
+        return num_slots
+
+# Distance of a parking slot from one of the entries of the mall.
+# This is a normalized copy of ParkingSlot.distances so that the database can rank the free slots for an entry.
+class ParkingSlotDistance(models.Model):
+    # indexed by the unique (parking slot, entry index) constraint and the ranking index instead of the default foreign
+    # key indexes, every index of this table is written for every entry of every provisioned slot
+    parking_slot = models.ForeignKey(ParkingSlot, on_delete=models.CASCADE, related_name='slot_distances', db_index=False)
+    mall_parking = models.ForeignKey(MallParking, on_delete=models.CASCADE, db_index=False)
+    entry_index = models.IntegerField()
+    distance = models.IntegerField()
+    size_value = models.IntegerField() # copy of the parking slot size value used as the tie breaker when ranking slots
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['mall_parking', 'entry_index', 'distance', 'size_value'], name='parking_slot_distance_rank'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['parking_slot', 'entry_index'], name='unique_parking_slot_entry_distance'),
+        ]
+
+    def __str__(self):
+        return str(self.parking_slot_id) + " - " + str(self.entry_index) + ": " + str(self.distance)
+
+# Slots of a mall ranked for one of its entries, the order in which the ranked allocator looks for a free slot.
+# The slots are stored as packed (distance, size value, slot pk) records sorted by distance, then by size value so the
+# smaller slots come first, then by pk. The rankings of a mall are built once its slots are provisioned or imported,
+# and the records of a single slot are moved when it is created, edited or deleted, every change bumping the version of
+# the ranking.
+class ParkingSlotRanking(models.Model):
+    RECORD = struct.Struct('<iiq')
+
+    mall_parking = models.ForeignKey(MallParking, on_delete=models.CASCADE)
+    entry_index = models.IntegerField()
+    version = models.IntegerField(default=0)
+    slots = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mall_parking', 'entry_index'], name='unique_mall_parking_entry_ranking'),
+        ]
+
+    def __str__(self):
+        return str(self.mall_parking_id) + " - " + str(self.entry_index)
+
+    @classmethod
+    def pack(cls, records):
+        return b''.join(cls.RECORD.pack(*record) for record in records)
+
+    @classmethod
+    def unpack(cls, slots):
+        return list(cls.RECORD.iter_unpack(slots))
+
+    # Builds the rankings of every entry of the mall from its slots again. Used after the slots of a mall were
+    # provisioned and when the size values changed.
+    @classmethod
+    def rebuild(cls, mall_parking_id):
+        # the records are read from the normalized distances, which do not have to be decoded from JSON
+        rankings = {}
+        for entry_index, distance, size_value, pk in ParkingSlotDistance.objects.filter(mall_parking_id=mall_parking_id).values_list(
+            'entry_index', 'distance', 'size_value', 'parking_slot'
+        ).order_by().iterator(chunk_size=10000):
+            rankings.setdefault(entry_index, []).append((distance, size_value, pk))
+
+        for records in rankings.values():
+            records.sort()
+        cls._replace(mall_parking_id, rankings)
+
+    # merges the (distance, size value, slot pk) records of new slots of the mall, by entry index, into its rankings
+    @classmethod
+    def add_slots(cls, mall_parking_id, records_by_entry):
+        current = {
+            entry_index: slots
+            for entry_index, slots in cls.objects.filter(mall_parking_id=mall_parking_id).values_list('entry_index', 'slots')
+        }
+        rankings = {}
+        for entry_index in set(current) | set(records_by_entry):
+            records = sorted(records_by_entry.get(entry_index, ()))
+            slots = current.get(entry_index)
+            rankings[entry_index] = list(heapq.merge(cls.RECORD.iter_unpack(slots), records)) if slots else records
+        cls._replace(mall_parking_id, rankings)
+
+    # replaces the rankings of the mall with the sorted records by entry index, bumping their versions
+    @classmethod
+    def _replace(cls, mall_parking_id, rankings):
+        versions = dict(cls.objects.filter(mall_parking_id=mall_parking_id).values_list('entry_index', 'version'))
+        cls.objects.filter(mall_parking_id=mall_parking_id).delete()
+        cls.objects.bulk_create([
+            cls(
+                mall_parking_id=mall_parking_id,
+                entry_index=entry_index,
+                version=versions.get(entry_index, 0) + 1,
+                slots=cls.pack(records)
+            )
+            for entry_index, records in rankings.items()
+        ])
+
+    # returns the index of the first record of the packed slots that is not less than the record, by binary search
+    @classmethod
+    def _bisect(cls, slots, record):
+        low, high = 0, len(slots) // cls.RECORD.size
+        while low < high:
+            middle = (low + high) // 2
+            if cls.RECORD.unpack_from(slots, middle * cls.RECORD.size) < record:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # returns the packed slots without the record of the slot, the record is found by binary search when it is given
+    # and by reading every record otherwise (e.g. when the slot size was deleted)
+    @classmethod
+    def _without(cls, slots, parking_slot_pk, record=None):
+        size = cls.RECORD.size
+        if record is not None:
+            index = cls._bisect(slots, record)
+            if index * size < len(slots) and cls.RECORD.unpack_from(slots, index * size) == record:
+                return slots[:index * size] + slots[(index + 1) * size:]
+        for index, (_, _, pk) in enumerate(cls.RECORD.iter_unpack(slots)):
+            if pk == parking_slot_pk:
+                return slots[:index * size] + slots[(index + 1) * size:]
+        return slots
+
+    # returns the packed slots with the record inserted at its rank
+    @classmethod
+    def _with(cls, slots, record):
+        offset = cls._bisect(slots, record) * cls.RECORD.size
+        return slots[:offset] + cls.RECORD.pack(*record) + slots[offset:]
+
+    # Moves the records of a created or edited parking slot to its current distances and size. previous is the
+    # (mall parking pk, size value, distances) of an edited slot before the edit, its records are removed from the
+    # rankings of that mall. The records are found and inserted by binary search in the packed slots.
+    @classmethod
+    def update_slot(cls, parking_slot, previous=None):
+        if previous is not None and previous[0] != parking_slot.mall_parking_id:
+            cls.remove_slot(parking_slot.pk, *previous)
+            previous = None
+
+        distances = parking_slot.get_distances()
+        rankings = list(cls.objects.filter(mall_parking_id=parking_slot.mall_parking_id).order_by('entry_index'))
+        if len(rankings) != len(distances):
+            # the rankings of the mall are missing or do not match its number of entries
+            cls.rebuild(parking_slot.mall_parking_id)
+            return
+
+        size_value = parking_slot.parking_slot_size.value
+        for ranking, distance in zip(rankings, distances):
+            slots = cls._without(
+                bytes(ranking.slots), parking_slot.pk,
+                None if previous is None else (previous[2][ranking.entry_index], previous[1], parking_slot.pk)
+            )
+            ranking.slots = cls._with(slots, (distance, size_value, parking_slot.pk))
+            ranking.version += 1
+        cls.objects.bulk_update(rankings, ['slots', 'version'])
+
+    # removes the records of a deleted parking slot from the rankings of its mall, the records are found by binary search
+    # when the size value and the distances of the slot are given
+    @classmethod
+    def remove_slot(cls, parking_slot_pk, mall_parking_id, size_value=None, distances=None):
+        rankings = list(cls.objects.filter(mall_parking_id=mall_parking_id))
+        for ranking in rankings:
+            known = size_value is not None and distances is not None and ranking.entry_index < len(distances)
+            ranking.slots = cls._without(
+                bytes(ranking.slots), parking_slot_pk,
+                (distances[ranking.entry_index], size_value, parking_slot_pk) if known else None
+            )
+            ranking.version += 1
+        cls.objects.bulk_update(rankings, ['slots', 'version'])
+
+# Live number of slots and occupied slots for every slot size of a mall.
+# The counters are updated incrementally by the entry, exit and provisioning paths so reading them costs one small query.
+class ParkingOccupancy(models.Model):
+    mall_parking = models.ForeignKey(MallParking, on_delete=models.CASCADE)
+    parking_slot_size = models.ForeignKey(ParkingSlotSize, on_delete=models.CASCADE)
+    total_slots = models.IntegerField(default=0)
+    occupied_slots = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mall_parking', 'parking_slot_size'], name='unique_mall_parking_slot_size_occupancy'),
+        ]
+
+    def __str__(self):
+        return str(self.mall_parking_id) + " - " + str(self.parking_slot_size_id) + ": " + str(self.occupied_slots) + "/" + str(self.total_slots)
+
+    # adds the differences to the counters, the keys of the dictionaries are (mall parking pk, parking slot size pk).
+    # the missing counters are created unless create is False, e.g. when they may have been deleted along with their mall.
+    # A missing counter is created empty on its unique key and then updated like the others, so concurrent first
+    # adjustments of the same counter add up instead of one of them failing or being lost.
+    @classmethod
+    def adjust(cls, total_slots=None, occupied_slots=None, create=True):
+        total_slots = total_slots or {}
+        occupied_slots = occupied_slots or {}
+        for key in set(total_slots) | set(occupied_slots):
+            total_difference = total_slots.get(key, 0)
+            occupied_difference = occupied_slots.get(key, 0)
+            if total_difference == 0 and occupied_difference == 0:
+                continue
+
+            mall_parking_id, parking_slot_size_id = key
+            counter = cls.objects.filter(mall_parking_id=mall_parking_id, parking_slot_size_id=parking_slot_size_id)
+            differences = {
+                'total_slots': models.F('total_slots') + total_difference,
+                'occupied_slots': models.F('occupied_slots') + occupied_difference,
+            }
+            if not counter.update(**differences) and create:
+                cls.objects.get_or_create(mall_parking_id=mall_parking_id, parking_slot_size_id=parking_slot_size_id)
+                counter.update(**differences)
+
 class VehicleParking(BaseInfo):
     entry_index = models.IntegerField() # index of the entry point
     entry_datetime = models.DateTimeField(auto_now=False, auto_now_add=True)
     exit_datetime = models.DateTimeField(blank=True, null=True)
     parking_slot = models.ForeignKey(ParkingSlot, on_delete=models.CASCADE)
-    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE)
-
-    # checks if the starting rate is fixed rate or not
-    @property
-    def is_fixed_starting_rate(self):
-        if self.exit_datetime is not None:
-            # get the mall parking instance to see the threshold for a returning car
-            mall_parking = MallParking.objects.get(id=self.parking_slot.mall_parking.pk)
-
-            # get the latest vehicle parking instance from the same vehicle
-            try:
-                latest_parking = VehicleParking.objects.filter(vehicle__pk=self.vehicle.pk).exclude(pk=self.pk).latest('exit_datetime')
-
-                # return False if the difference between the last parking and the current entry is less than the return duration threshold
-                if latest_parking.exit_datetime.timestamp() - self.entry_datetime.timestamp() <= mall_parking.return_duration:
-                    return False
-            except VehicleParking.DoesNotExist:
-                # handle the case where there is no pre-existing parking records
-                return True
-        # return True otherwise
-        return True
-
-    # computes the total charge for the parking, returns 0 if the vehicle has not exited yet.
-    @property
-    def total_charge(self):
-        total_fee = 0
-        if self.exit_datetime is not None:
-            # get the mall parking instance to see the corresponding rates for the parking fee
-            mall_parking = MallParking.objects.get(id=self.parking_slot.mall_parking.pk)
-            
-            # get the hourly rate from the parking slot depending on the size
-            slot_rate = self.parking_slot.parking_slot_size.continuous_rate
-
-            parking_duration = self.exit_datetime.timestamp() - self.entry_datetime.timestamp()
-            if self.is_fixed_starting_rate:
-                # compute the duration that is not covered by the fixed rate
-                non_fixed_rate_duration = parking_duration - mall_parking.flatRate_duration
-
-                # add the fixed rate to the total fee
-                total_fee += mall_parking.flat_rate
-
-                # handle the case when the duration exceeds the flat rate duration
-                if non_fixed_rate_duration > 0:
-                    # add the fee based on the continuous rate to be applied on a per second basis
-                    total_fee += non_fixed_rate_duration * float(slot_rate) / (60 * 60)
-            else:
-                # add the fee based on the continuous rate to be applied on a per second basis
-                total_fee += parking_duration * float(slot_rate) / (60 * 60)
-            
-            # add the penalty for exceeding 24 hours
-            if parking_duration >= mall_parking.exceed_duration:
-                total_fee += mall_parking.exceed_rate
-
-        # return the rounded up value
-        return math.ceil(total_fee)
\ No newline at end of file
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, db_index=False) # indexed by vehicle_parking_exit_key
+    # the charges are computed when the vehicle exits, see set_charges()
+    is_fixed_starting_rate = models.BooleanField(default=True, db_index=True)
+    total_charge = models.IntegerField(default=0, db_index=True) # 0 while the vehicle has not exited yet
+
+    class Meta(BaseInfo.Meta):
+        indexes = [
+            # key of the parking history pagination and export
+            models.Index(fields=['-entry_datetime', '-id'], name='vehicle_parking_entry_key'),
+            # parkings of a vehicle ordered by exit, read by the return check and the charges backfill
+            models.Index(fields=['vehicle', 'exit_datetime'], name='vehicle_parking_exit_key'),
+        ]
+        constraints = [
+            # a vehicle can only have one parking that has not exited yet
+            models.UniqueConstraint(
+                fields=['vehicle'], condition=Q(exit_datetime__isnull=True), name='unique_active_vehicle_parking'
+            ),
+        ]
+
+    # computes and stores if the starting rate is fixed rate and the total charge for the parking once the vehicle has exited
+    def set_charges(self, mall_parking, slot_rate, latest_exit_datetime):
+        self.is_fixed_starting_rate = fares.is_fixed_starting_rate(
+            self.entry_datetime,
+            latest_exit_datetime,
+            mall_parking.return_duration
+        )
+        self.set_total_charge(mall_parking, slot_rate)
+
+    # computes and stores the total charge for the parking with the stored starting rate
+    def set_total_charge(self, mall_parking, slot_rate):
+        self.total_charge = fares.total_charge(
+            fares.parking_duration(self.entry_datetime, self.exit_datetime),
+            slot_rate,
+            self.is_fixed_starting_rate,
+            mall_parking
+        )
+
+# Closed parkings that were moved out of VehicleParking by the archive job (see archive.py).
+# The rows keep the primary key of the parking and copy the values of the vehicle and the parking slot that the history
+# shows, so the table has no foreign keys and only the index used by the history endpoints.
+class ArchivedVehicleParking(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    entry_index = models.IntegerField()
+    entry_datetime = models.DateTimeField()
+    exit_datetime = models.DateTimeField()
+    plate_number = models.CharField(max_length=255)
+    vehicle_type = models.IntegerField(choices=Vehicle.VehicleType.choices)
+    mall_parking_id = models.BigIntegerField()
+    parking_slot_id = models.BigIntegerField()
+    parking_slot_size_id = models.BigIntegerField()
+    is_fixed_starting_rate = models.BooleanField()
+    total_charge = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-entry_datetime', '-id'], name='archived_parking_entry_key'),
+        ]
+
+    def __str__(self):
+        return str(self.pk) + " - " + self.plate_number
+
+    # returns an unsaved vehicle parking with the values of the archived parking, used for showing it in the history
+    def to_vehicle_parking(self, parking_slot):
+        return VehicleParking(
+            id=self.pk,
+            entry_index=self.entry_index,
+            entry_datetime=self.entry_datetime,
+            exit_datetime=self.exit_datetime,
+            parking_slot=parking_slot,
+            vehicle=Vehicle(plate_number=self.plate_number, type=self.vehicle_type),
+            is_fixed_starting_rate=self.is_fixed_starting_rate,
+            total_charge=self.total_charge
+        )
+
+# Progress of a layout import (see layout_import.py).
+# The number of imported rows is saved in the same transaction as every batch of slots, so an import that failed or was
+# interrupted can be resumed from the first row that was not imported.
+class LayoutImport(BaseInfo):
+    class Status(models.TextChoices):
+        RUNNING = 'running'
+        FAILED = 'failed'
+        COMPLETED = 'completed'
+    mall_parking = models.ForeignKey(MallParking, on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255, blank=True)
+    file_format = models.CharField(max_length=10) # csv or ndjson
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.RUNNING)
+    rows_imported = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return str(self.mall_parking_id) + " - " + self.file_name + ": " + str(self.rows_imported) + " rows " + self.status
+
+# Append-only journal of the entries and exits.
+# The events are only ever inserted, in the transaction of the entry or exit, and have no indexes besides the primary
+# key so that writing them is a cheap sequential insert. The ids are plain values instead of foreign keys so the
+# journal is kept when the parkings or the slots are deleted. See journal.py for replaying the events.
+class ParkingEvent(models.Model):
+    class Kind(models.IntegerChoices):
+        PARK = 0
+        UNPARK = 1
+    id = models.BigAutoField(primary_key=True)
+    kind = models.SmallIntegerField(choices=Kind.choices)
+    occurred_at = models.DateTimeField()
+    vehicle_parking_id = models.BigIntegerField()
+    parking_slot_id = models.BigIntegerField()
+    mall_parking_id = models.BigIntegerField()
+    plate_number = models.CharField(max_length=255)
+
+    def __str__(self):
+        return str(self.pk) + " - " + self.get_kind_display() + " " + self.plate_number
+
+    # Appends an event for every parking with one insert, the parkings are given as
+    # (datetime, vehicle parking pk, parking slot pk, mall parking pk, plate number).
+    @classmethod
+    def record(cls, kind, parkings):
+        return bulk.insert_rows(
+            cls,
+            ['kind', 'occurred_at', 'vehicle_parking_id', 'parking_slot_id', 'mall_parking_id', 'plate_number'],
+            ((kind, bulk.adapt_value(cls, 'occurred_at', parking[0])) + tuple(parking[1:]) for parking in parkings)
+        )
+
+# state of the journal up to an event, so a replay only has to read the events after it
+class ParkingJournalSnapshot(models.Model):
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_event_id = models.BigIntegerField() # 0 when the snapshot was taken before the first event
+    open_parkings = models.TextField() # object of vehicle parking ids to [parking slot id, mall parking id, plate number] in JSON format
+
+    class Meta:
+        ordering = ['-last_event_id']
+
+    def __str__(self):
+        return str(self.last_event_id) + ": " + str(len(json.loads(self.open_parkings))) + " open parkings"
@@ -0,0 +1,79 @@
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+
+from app.db_backends import read_only_atomic
+
+from . import models
+
+# returns the live occupancy of the mall from the counters and the nearest free slot distance of every entry
+def mall_occupancy(mall_parking):
+    counters = models.ParkingOccupancy.objects.filter(
+        mall_parking=mall_parking
+    ).select_related('parking_slot_size').order_by('parking_slot_size__value')
+
+    # the nearest free slot of every entry is the first free row of the distance index, the rows of every entry are read
+    # by a subquery that stops at that row, all in one query
+    nearest_free = models.MallParking.objects.filter(pk=mall_parking.pk).values(**{
+        'entry_%d' % entry_index: Subquery(models.ParkingSlotDistance.objects.filter(
+            mall_parking=OuterRef('pk'),
+            entry_index=entry_index,
+            parking_slot__vehicle_parking=None
+        ).order_by('distance').values('distance')[:1])
+        for entry_index in range(mall_parking.num_entries)
+    }).get()
+    nearest_free_distances = [
+        {'entry_index': entry_index, 'distance': nearest_free['entry_%d' % entry_index]}
+        for entry_index in range(mall_parking.num_entries)
+    ]
+
+    return {
+        'mall_parking': mall_parking.pk,
+        'total_slots': sum(counter.total_slots for counter in counters),
+        'occupied_slots': sum(counter.occupied_slots for counter in counters),
+        'parking_slot_sizes': [
+            {
+                'parking_slot_size': counter.parking_slot_size_id,
+                'name': counter.parking_slot_size.name,
+                'total_slots': counter.total_slots,
+                'occupied_slots': counter.occupied_slots,
+                'free_slots': counter.total_slots - counter.occupied_slots,
+            }
+            for counter in counters
+        ],
+        'nearest_free_distances': nearest_free_distances,
+    }
+
+# Compares the counters with the parking slots table and returns the counters that are off as
+# (mall parking pk, parking slot size pk, counted (total, occupied), actual (total, occupied)).
+# When fix is True, the counters are replaced with the actual values.
+def reconcile(fix=False):
+    # the write lock is only taken when the mismatches are fixed
+    with transaction.atomic() if fix else read_only_atomic():
+        actual = {
+            (count['mall_parking'], count['parking_slot_size']): (count['total_slots'], count['occupied_slots'])
+            for count in models.ParkingSlot.objects.values('mall_parking', 'parking_slot_size').annotate(
+                total_slots=Count('pk'),
+                occupied_slots=Count('pk', filter=Q(vehicle_parking__isnull=False))
+            )
+        }
+        counted = {
+            (counter.mall_parking_id, counter.parking_slot_size_id): counter
+            for counter in models.ParkingOccupancy.objects.all()
+        }
+
+        mismatches = []
+        for key in sorted(set(actual) | set(counted)):
+            counter = counted.get(key)
+            counted_values = (0, 0) if counter is None else (counter.total_slots, counter.occupied_slots)
+            actual_values = actual.get(key, (0, 0))
+            if counted_values == actual_values:
+                continue
+            mismatches.append(key + (counted_values, actual_values))
+
+            if fix:
+                if counter is None:
+                    counter = models.ParkingOccupancy(mall_parking_id=key[0], parking_slot_size_id=key[1])
+                counter.total_slots, counter.occupied_slots = actual_values
+                counter.save()
+
+    return mismatches
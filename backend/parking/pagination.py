@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+# Keyset pagination for the parking history, ordered by the indexed (entry datetime, id) key.
+# Unlike page numbers, the cost of a page does not grow with how far the client has scrolled.
+class VehicleParkingCursorPagination(CursorPagination):
+    ordering = ('-entry_datetime', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -1,12 +1,22 @@
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Case, IntegerField, Value, When
 from rest_framework import serializers
+import codecs
 import json
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 # we use the rest framework for our frontend and backend communications
 
+from . import allocator
+from . import analytics
+from .config_cache import config_cache
+from . import fares
+from . import layout_import
+from . import metrics
 from . import models
 
-class MallParkingSerializer(serializers.ModelSerializer):
+class MallParkingSerializer(metrics.TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = models.MallParking
         fields = ['id', 'name', 'num_entries', 'flat_rate', 'exceed_rate', 'flatRate_duration', 'exceed_duration', 'return_duration']
@@ -17,19 +27,19 @@ class MallParkingSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('The number of entries cannot be less than 3.')
         return data
 
-class VehicleSerializer(serializers.ModelSerializer):
+class VehicleSerializer(metrics.TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Vehicle
         fields = ['plate_number', 'type']
 
 # added to account for new sizes in the future
-class ParkingSlotSizeSerializer(serializers.ModelSerializer):
+class ParkingSlotSizeSerializer(metrics.TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = models.ParkingSlotSize
         fields = ['id', 'name', 'continuous_rate']
         read_only_fields = ['id']
 
-class ParkingSlotSerializer(serializers.ModelSerializer):
+class ParkingSlotSerializer(metrics.TimedSerializerMixin, serializers.ModelSerializer):
     mall_parking = MallParkingSerializer()
     parking_slot_size = ParkingSlotSizeSerializer()
     distances = serializers.ListField(
@@ -42,29 +52,72 @@ class ParkingSlotSerializer(serializers.ModelSerializer):
         fields = ['id', 'mall_parking', 'parking_slot_size', 'distances', 'vehicle_parking']
         read_only_fields = ['id', 'vehicle_parking']
 
-    def validate(self, data):
-        # make sure that the instances exist in the database
-        mall_parking = models.MallParking.objects.get(id=data['mall_parking']['id'])
-        parking_slot_size = models.ParkingSlotSize.objects.get(id=data['parking_slot_size']['id'])
+    # returns the id of the nested object in the request, the ids are read only on the nested serializers
+    def _nested_id(self, field_name):
+        nested_data = self.initial_data.get(field_name)
+        return nested_data.get('id') if isinstance(nested_data, dict) else None
 
-        print("ASDADADASDAS")
-        print(mall_parking)
-        print(parking_slot_size)
+    def validate(self, data):
+        # make sure that the instances exist in the database, a partial update keeps the ones of the parking slot
+        mall_parking_id = self._nested_id('mall_parking')
+        parking_slot_size_id = self._nested_id('parking_slot_size')
+        if self.instance is None and (mall_parking_id is None or parking_slot_size_id is None):
+            raise serializers.ValidationError('The ids of the mall parking and the parking slot size are required.')
+
+        try:
+            mall_parking = self.instance.mall_parking if mall_parking_id is None else config_cache.get_mall_parking(mall_parking_id)
+        except (models.MallParking.DoesNotExist, ValueError, TypeError):
+            raise serializers.ValidationError('Unknown mall parking.')
+        try:
+            parking_slot_size = self.instance.parking_slot_size if parking_slot_size_id is None else config_cache.get_parking_slot_size(parking_slot_size_id)
+        except models.ParkingSlotSize.DoesNotExist:
+            raise serializers.ValidationError('Unknown parking slot size.')
 
         data['mall_parking'] = mall_parking
         data['parking_slot_size'] = parking_slot_size
 
         # make sure that the number of distance inputs match the number of mall entries
-        if(len(data['distances']) != mall_parking.num_entries):
+        distances = data['distances'] if 'distances' in data else self.instance.get_distances()
+        if(len(distances) != mall_parking.num_entries):
             raise serializers.ValidationError('The number of distances must match the number of entries in the mall.')
         
         # save the integer array for distances as a string in JSON format
-        distances_json = json.dumps(data['distances'])
-        data['distances'] = distances_json
+        if 'distances' in data:
+            distances_json = json.dumps(data['distances'])
+            data['distances'] = distances_json
 
         return data
 
-class VehicleParkingSerializer(serializers.ModelSerializer):
+    def create(self, validated_data):
+        parking_slot = models.ParkingSlot.objects.create(**validated_data)
+        parking_slot.sync_slot_distances()
+        models.ParkingSlotRanking.update_slot(parking_slot)
+        models.ParkingOccupancy.adjust(total_slots={parking_slot.occupancy_key(): 1})
+        return parking_slot
+
+    def update(self, instance, validated_data):
+        previous_occupancy_key = instance.occupancy_key()
+        previous_ranking = (
+            instance.mall_parking_id,
+            config_cache.get_parking_slot_size(instance.parking_slot_size_id).value,
+            instance.get_distances()
+        )
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save()
+        instance.sync_slot_distances()
+        models.ParkingSlotRanking.update_slot(instance, previous=previous_ranking)
+
+        # move the slot to the counters of its new mall or size
+        if instance.occupancy_key() != previous_occupancy_key:
+            occupied = 0 if instance.vehicle_parking_id is None else 1
+            models.ParkingOccupancy.adjust(
+                total_slots={previous_occupancy_key: -1, instance.occupancy_key(): 1},
+                occupied_slots={previous_occupancy_key: -occupied, instance.occupancy_key(): occupied}
+            )
+        return instance
+
+class VehicleParkingSerializer(metrics.TimedSerializerMixin, serializers.ModelSerializer):
     parking_slot = ParkingSlotSerializer(read_only=True)
     vehicle = VehicleSerializer(read_only=True)
     plate_number = serializers.CharField(max_length=255, write_only=True)
@@ -116,106 +169,503 @@ class VehicleParkingSerializer(serializers.ModelSerializer):
         return data
 
     def update(self, instance, validated_data):
-        # set the exit datetime of the vehicle parking instance
-        instance.exit_datetime = validated_data['exit_datetime']
-        instance.save()
-        
-        # remove the parking details from the parking slot
-        parking_slot = self.validated_data['parking_slot']
-        parking_slot.vehicle_parking = None
-        parking_slot.save()
+        with transaction.atomic():
+            # set the exit datetime and the charges of the vehicle parking instance
+            parking_slot = self.validated_data['parking_slot']
+            vehicle = validated_data['vehicle']
+            mall_parking = config_cache.get_mall_parking(parking_slot.mall_parking_id)
+            slot_rate = config_cache.get_parking_slot_size(parking_slot.parking_slot_size_id).continuous_rate
+            already_exited = instance.exit_datetime is not None
+            instance.exit_datetime = validated_data['exit_datetime']
+            if already_exited:
+                # the starting rate of a parking that already exited was set from the exit before it and is stored as its
+                # fixed starting rate flag, so only the total charge is computed again
+                instance.set_total_charge(mall_parking, slot_rate)
+            else:
+                # the latest exit stored on the vehicle is the previous exit
+                instance.set_charges(mall_parking, slot_rate, vehicle.last_exit_datetime)
+            instance.save()
+            models.Vehicle.record_exit([vehicle.pk], instance.exit_datetime, parking_slot.mall_parking_id)
+
+            # remove the parking details from the parking slot
+            if parking_slot.release(instance):
+                models.ParkingEvent.record(models.ParkingEvent.Kind.UNPARK, [
+                    (instance.exit_datetime, instance.pk, parking_slot.pk, parking_slot.mall_parking_id, instance.vehicle_id)
+                ])
+                models.ParkingOccupancy.adjust(occupied_slots={parking_slot.occupancy_key(): -1})
+                allocator.update_on_commit(parking_slot)
+        metrics.EXITS.inc()
 
         return instance
 
+# Checks that the mall parking of an entry exists and has the entry index, the mall is read from the config cache.
+# Entries without a mall parking are assigned a slot of any mall.
+def validate_entry_mall_parking(data):
+    if data.get('mall_parking') is None:
+        return
+    try:
+        mall_parking = config_cache.get_mall_parking(data['mall_parking'])
+    except models.MallParking.DoesNotExist:
+        raise serializers.ValidationError('Unknown mall parking.')
+    if data['entry_index'] >= mall_parking.num_entries:
+        raise serializers.ValidationError('The mall parking only has ' + str(mall_parking.num_entries) + ' entries.')
+
 # special serializer for assigning a parking slot to vehicles
-class VehicleParkingEntrySerializer(serializers.ModelSerializer):
+class VehicleParkingEntrySerializer(metrics.TimedSerializerMixin, serializers.ModelSerializer):
     plate_number = serializers.CharField(max_length=255)
     type = serializers.ChoiceField(choices=models.Vehicle.VehicleType)
+    mall_parking = serializers.IntegerField(required=False) # mall the vehicle is entering, recommended with several malls
     class Meta:
         model = models.VehicleParking
-        fields = ['id', 'entry_index', 'entry_datetime', 'plate_number', 'type']
+        fields = ['id', 'entry_index', 'entry_datetime', 'plate_number', 'type', 'mall_parking']
         read_only_fields = ['id']
 
     def validate(self, data):
+        validate_entry_mall_parking(data)
+
         # check if the vehicle is already parked
         if models.ParkingSlot.objects.filter(vehicle_parking__vehicle__pk=data['plate_number']).exists():
             raise serializers.ValidationError('A vehicle with the same plate number is already parked.')
-            
-        vehicle = models.Vehicle(
-            plate_number=data['plate_number'],
-            type=data['type']
-        )
-        entry_index = data['entry_index']
 
-        # Get all parking slots that are unoccupied and fits the size of the vehicle
-        free_parking_slots = models.ParkingSlot.objects.filter(vehicle_parking=None, parking_slot_size__value__gte=data['type'])
+        # get the nearest unoccupied parking slot of the mall that fits the size of the vehicle
+        with metrics.timer('allocator'):
+            parking_slot = allocator.get_allocator().allocate(
+                data['type'], data['entry_index'], mall_parking_id=data.get('mall_parking')
+            )
 
-        # use the first free parking slot as the initial value
-        parking_slot = free_parking_slots.first()
+        return self._validated_entry(data, parking_slot)
 
-        if parking_slot is None:
-            raise serializers.ValidationError('No available parking slots.')
+    # same as validate() with the async ORM, used by the async entry view
+    async def avalidate(self, data):
+        await sync_to_async(validate_entry_mall_parking)(data)
 
-        min_distance = json.loads(parking_slot.distances)[entry_index]
-        for free_parking_slot in free_parking_slots:
-            # distances array is saved as a string in json format
-            distances_arr = json.loads(free_parking_slot.distances)
+        if await models.ParkingSlot.objects.filter(vehicle_parking__vehicle__pk=data['plate_number']).aexists():
+            raise serializers.ValidationError('A vehicle with the same plate number is already parked.')
+
+        with metrics.timer('allocator'):
+            parking_slot = await allocator.get_allocator().aallocate(
+                data['type'], data['entry_index'], mall_parking_id=data.get('mall_parking')
+            )
 
-            # set the minimum as the new parking slot and update the current minimum distance
-            if min_distance > distances_arr[entry_index]:
-                parking_slot = free_parking_slot
-                min_distance = json.loads(parking_slot.distances)[entry_index]
-            # if the distances are equal, prioritize assigning small parking slots
-            elif min_distance == distances_arr[entry_index] and parking_slot.parking_slot_size.value > free_parking_slot.parking_slot_size.value:
-                parking_slot = free_parking_slot
-                min_distance = json.loads(parking_slot.distances)[entry_index]
+        return self._validated_entry(data, parking_slot)
+
+    def _validated_entry(self, data, parking_slot):
+        if parking_slot is None:
+            metrics.ALLOCATION_FAILURES.inc()
+            raise serializers.ValidationError('No available parking slots.')
 
         data['parking_slot'] = parking_slot
-        data['vehicle'] = vehicle
+        data['vehicle'] = models.Vehicle(
+            plate_number=data['plate_number'],
+            type=data['type']
+        )
 
         return data
 
+    # async version of is_valid(), the fields are validated the same way and validate() is replaced by avalidate()
+    async def ais_valid(self):
+        try:
+            self._validated_data = await self.avalidate(self.to_internal_value(self.initial_data))
+        except serializers.ValidationError as exc:
+            self._validated_data = {}
+            self._errors = serializers.as_serializer_error(exc)
+        else:
+            self._errors = {}
+        return not self._errors
+
     def save(self):
-        # save the vehicle if it does not exist yet
+        entry_index = self.validated_data['entry_index']
         vehicle_data = self.validated_data['vehicle']
-        vehicle, _ = models.Vehicle.objects.get_or_create(
-            plate_number = vehicle_data.plate_number,
-            type = vehicle_data.type
-        )
-
-        # create the vehicle parking instance
         parking_slot = self.validated_data['parking_slot']
-        vehicle_parking = models.VehicleParking(
-            entry_index = self.validated_data['entry_index'],
-            parking_slot = parking_slot,
-            vehicle = vehicle
-        )
-        vehicle_parking.save()
 
-        # save the vehicle parking instance in the parking slot
-        parking_slot.vehicle_parking = vehicle_parking
-        parking_slot.save()
+        try:
+            vehicle_parking, parking_slot = self._park(entry_index, vehicle_data, parking_slot)
+        except IntegrityError:
+            # another entry of the same vehicle was saved after the validation, see unique_active_vehicle_parking
+            if models.VehicleParking.objects.filter(vehicle__pk=vehicle_data.plate_number, exit_datetime=None).exists():
+                raise serializers.ValidationError('A vehicle with the same plate number is already parked.')
+            raise
+        metrics.ENTRIES.inc()
 
         return {
             "vehicle_parking": vehicle_parking,
             "message": "The vehicle has been parked."
         }
 
-class MallParkingSlotsSerializer(serializers.Serializer):
+    def _park(self, entry_index, vehicle_data, parking_slot):
+        with transaction.atomic():
+            # save the vehicle if it does not exist yet
+            vehicle, _ = models.Vehicle.objects.get_or_create(
+                plate_number = vehicle_data.plate_number,
+                type = vehicle_data.type
+            )
+
+            # create the vehicle parking instance
+            vehicle_parking = models.VehicleParking(
+                entry_index = entry_index,
+                parking_slot = parking_slot,
+                vehicle = vehicle
+            )
+            vehicle_parking.save()
+
+            # Claim the parking slot for the vehicle parking instance. When another entry claimed the same slot first,
+            # the vehicle is assigned to the next nearest slot instead of locking the other entries out.
+            claimed_slot_pks = []
+            while not parking_slot.claim(vehicle_parking):
+                claimed_slot_pks.append(parking_slot.pk)
+                with metrics.timer('allocator'):
+                    parking_slot = allocator.get_allocator().allocate(
+                        vehicle.type, entry_index, exclude=claimed_slot_pks, mall_parking_id=self.validated_data.get('mall_parking')
+                    )
+                if parking_slot is None:
+                    metrics.ALLOCATION_FAILURES.inc()
+                    raise serializers.ValidationError('No available parking slots.')
+
+                vehicle_parking.parking_slot = parking_slot
+                vehicle_parking.save(update_fields=['parking_slot', 'updated_at'])
+
+            models.ParkingEvent.record(models.ParkingEvent.Kind.PARK, [
+                (vehicle_parking.entry_datetime, vehicle_parking.pk, parking_slot.pk, parking_slot.mall_parking_id, vehicle.pk)
+            ])
+            models.ParkingOccupancy.adjust(occupied_slots={parking_slot.occupancy_key(): 1})
+            allocator.update_on_commit(parking_slot)
+
+        return vehicle_parking, parking_slot
+
+# raised when another entry claimed one of the slots assigned to a batch of vehicles
+class SlotClaimConflict(Exception):
+    pass
+
+# validates a single vehicle of a bulk entry request
+class VehicleParkingEntryItemSerializer(serializers.Serializer):
+    plate_number = serializers.CharField(max_length=255)
+    type = serializers.ChoiceField(choices=models.Vehicle.VehicleType)
+    entry_index = serializers.IntegerField(min_value=0)
+    mall_parking = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        validate_entry_mall_parking(data)
+        return data
+
+# special serializer for assigning parking slots to a batch of vehicles in one transaction
+class VehicleParkingBulkEntrySerializer(serializers.Serializer):
+    vehicles = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    # number of times the batch is assigned again when another entry claimed one of its slots first
+    MAX_ATTEMPTS = 3
+
+    def save(self):
+        vehicles = self.validated_data['vehicles']
+
+        # validate every vehicle on its own so that one invalid record does not reject the whole batch
+        results = [None] * len(vehicles)
+        entries = []
+        for index, vehicle_data in enumerate(vehicles):
+            item_serializer = VehicleParkingEntryItemSerializer(data=vehicle_data)
+            if item_serializer.is_valid():
+                entries.append((index, item_serializer.validated_data))
+            else:
+                results[index] = {'index': index, 'plate_number': vehicle_data.get('plate_number'), 'errors': item_serializer.errors}
+
+        for attempt in range(self.MAX_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    parked_results = self._park(entries)
+                break
+            except SlotClaimConflict:
+                if attempt + 1 == self.MAX_ATTEMPTS:
+                    raise serializers.ValidationError('The parking slots are being claimed by other entries, please try again.')
+
+        for result in parked_results:
+            results[result['index']] = result
+            if 'errors' not in result:
+                metrics.ENTRIES.inc()
+            elif result['errors'] == ['No available parking slots.']:
+                metrics.ALLOCATION_FAILURES.inc()
+        return results
+
+    def _park(self, entries):
+        plate_numbers = {entry['plate_number'] for _, entry in entries}
+
+        # vehicles that are already parked and vehicles that were already registered
+        parked_plate_numbers = set(models.ParkingSlot.objects.filter(
+            vehicle_parking__vehicle__pk__in=plate_numbers
+        ).values_list('vehicle_parking__vehicle__pk', flat=True))
+        existing_vehicles = models.Vehicle.objects.in_bulk(plate_numbers)
+
+        # Rank the free slots in memory, loaded once for the whole batch: every free slot of the malls that are given, and
+        # for the vehicles without a mall only the slots nearest to their entry, as many as there are vehicles since the
+        # others cannot take more than that.
+        mall_parking_ids = {entry['mall_parking'] for _, entry in entries if entry.get('mall_parking') is not None}
+        unscoped = {(entry['type'], entry['entry_index']) for _, entry in entries if entry.get('mall_parking') is None}
+        slot_allocator = allocator.HeapSlotAllocator()
+        with metrics.timer('allocator'):
+            free_slots = {}
+            if mall_parking_ids:
+                for free_slot in allocator.HeapSlotAllocator.free_slot_values(models.ParkingSlot.objects.filter(mall_parking__in=mall_parking_ids)):
+                    free_slots[free_slot[0]] = free_slot
+            for vehicle_type, entry_index in unscoped:
+                for free_slot in allocator.HeapSlotAllocator.nearest_free_slot_values(vehicle_type, entry_index, len(entries)):
+                    free_slots.setdefault(free_slot[0], free_slot)
+            # the given malls are loaded whole and the other malls only matter for the vehicles without a mall
+            slot_allocator.load(free_slots.values(), mall_parking_ids=None if unscoped else mall_parking_ids)
+
+        results = []
+        new_vehicles = {}
+        vehicle_parkings = []
+        for index, entry in entries:
+            plate_number = entry['plate_number']
+            result = {'index': index, 'plate_number': plate_number}
+            results.append(result)
+
+            if plate_number in parked_plate_numbers:
+                result['errors'] = ['A vehicle with the same plate number is already parked.']
+                continue
+
+            with metrics.timer('allocator'):
+                parking_slot_pk = slot_allocator.take(entry['type'], entry['entry_index'], mall_parking_id=entry.get('mall_parking'))
+            if parking_slot_pk is None:
+                result['errors'] = ['No available parking slots.']
+                continue
+            parked_plate_numbers.add(plate_number)
+
+            vehicle = existing_vehicles.get(plate_number)
+            if vehicle is None:
+                vehicle = models.Vehicle(plate_number=plate_number, type=entry['type'])
+                new_vehicles[plate_number] = vehicle
+
+            vehicle_parking = models.VehicleParking(
+                entry_index=entry['entry_index'],
+                parking_slot_id=parking_slot_pk,
+                vehicle=vehicle
+            )
+            vehicle_parkings.append(vehicle_parking)
+            result['vehicle_parking'] = vehicle_parking
+
+        models.Vehicle.objects.bulk_create(new_vehicles.values(), ignore_conflicts=True)
+        try:
+            models.VehicleParking.objects.bulk_create(vehicle_parkings)
+        except IntegrityError:
+            # another entry parked one of the vehicles after they were checked, the next attempt reports it
+            raise SlotClaimConflict()
+
+        # claim all the assigned slots with one conditional update
+        if vehicle_parkings:
+            claimed = models.ParkingSlot.objects.filter(
+                pk__in=[vehicle_parking.parking_slot_id for vehicle_parking in vehicle_parkings],
+                vehicle_parking=None
+            ).update(
+                vehicle_parking=Case(
+                    *[When(pk=vehicle_parking.parking_slot_id, then=Value(vehicle_parking.pk)) for vehicle_parking in vehicle_parkings],
+                    output_field=IntegerField()
+                ),
+                updated_at=datetime.now(timezone.utc)
+            )
+            if claimed != len(vehicle_parkings):
+                raise SlotClaimConflict()
+
+            claimed_slots = {
+                parking_slot_pk: (mall_parking_id, parking_slot_size_id)
+                for parking_slot_pk, mall_parking_id, parking_slot_size_id in models.ParkingSlot.objects.filter(
+                    pk__in=[vehicle_parking.parking_slot_id for vehicle_parking in vehicle_parkings]
+                ).values_list('pk', 'mall_parking', 'parking_slot_size')
+            }
+            occupied_slots = {}
+            for occupancy_key in claimed_slots.values():
+                occupied_slots[occupancy_key] = occupied_slots.get(occupancy_key, 0) + 1
+            models.ParkingOccupancy.adjust(occupied_slots=occupied_slots)
+            models.ParkingEvent.record(models.ParkingEvent.Kind.PARK, [
+                (vehicle_parking.entry_datetime, vehicle_parking.pk, vehicle_parking.parking_slot_id,
+                 claimed_slots[vehicle_parking.parking_slot_id][0], vehicle_parking.vehicle_id)
+                for vehicle_parking in vehicle_parkings
+            ])
+            allocator.remove_on_commit([
+                (vehicle_parking.parking_slot_id, claimed_slots[vehicle_parking.parking_slot_id][0])
+                for vehicle_parking in vehicle_parkings
+            ])
+
+        for result in results:
+            vehicle_parking = result.pop('vehicle_parking', None)
+            if vehicle_parking is not None:
+                result['vehicle_parking'] = vehicle_parking.pk
+                result['parking_slot'] = vehicle_parking.parking_slot_id
+                result['entry_datetime'] = vehicle_parking.entry_datetime
+        return results
+
+# special serializer for removing a batch of vehicles from their parking slots in one transaction
+class VehicleParkingBulkExitSerializer(serializers.Serializer):
+    plate_numbers = serializers.ListField(child=serializers.CharField(max_length=255), allow_empty=False)
+
+    def save(self):
+        plate_numbers = list(dict.fromkeys(self.validated_data['plate_numbers']))
+        exit_datetime = datetime.now(timezone.utc)
+
+        with transaction.atomic():
+            # load the occupied slots together with their parkings, the rates are read from the config cache
+            parking_slots = models.ParkingSlot.objects.filter(
+                vehicle_parking__vehicle__pk__in=plate_numbers
+            ).select_related('vehicle_parking__vehicle').select_for_update(of=('self',))
+            parking_slots = {parking_slot.vehicle_parking.vehicle_id: parking_slot for parking_slot in parking_slots}
+
+            results = []
+            vehicle_parkings = []
+            for plate_number in plate_numbers:
+                parking_slot = parking_slots.get(plate_number)
+                if parking_slot is None:
+                    results.append({'plate_number': plate_number, 'errors': ['Unknown plate number.']})
+                    continue
+
+                vehicle_parking = parking_slot.vehicle_parking
+                vehicle_parking.exit_datetime = exit_datetime
+                vehicle_parking.updated_at = exit_datetime
+                vehicle_parkings.append(vehicle_parking)
+
+                vehicle_parking.set_charges(
+                    config_cache.get_mall_parking(parking_slot.mall_parking_id),
+                    config_cache.get_parking_slot_size(parking_slot.parking_slot_size_id).continuous_rate,
+                    vehicle_parking.vehicle.last_exit_datetime
+                )
+                results.append({
+                    'plate_number': plate_number,
+                    'vehicle_parking': vehicle_parking.pk,
+                    'parking_slot': parking_slot.pk,
+                    'entry_datetime': vehicle_parking.entry_datetime,
+                    'exit_datetime': exit_datetime,
+                    'is_fixed_starting_rate': vehicle_parking.is_fixed_starting_rate,
+                    'total_charge': vehicle_parking.total_charge,
+                })
+
+            models.VehicleParking.objects.bulk_update(
+                vehicle_parkings,
+                ['exit_datetime', 'updated_at', 'is_fixed_starting_rate', 'total_charge']
+            )
+
+            # free all the parking slots with one update
+            models.ParkingSlot.objects.filter(
+                vehicle_parking__in=vehicle_parkings
+            ).update(vehicle_parking=None, updated_at=exit_datetime)
+            # store the exit as the latest exit of the vehicles, one update for every mall parking
+            plate_numbers_by_mall_parking = {}
+            for plate_number, parking_slot in parking_slots.items():
+                plate_numbers_by_mall_parking.setdefault(parking_slot.mall_parking_id, []).append(plate_number)
+            for mall_parking_id, mall_plate_numbers in plate_numbers_by_mall_parking.items():
+                models.Vehicle.record_exit(mall_plate_numbers, exit_datetime, mall_parking_id)
+
+            occupied_slots = {}
+            for parking_slot in parking_slots.values():
+                parking_slot.vehicle_parking = None
+                parking_slot.updated_at = exit_datetime
+                occupied_slots[parking_slot.occupancy_key()] = occupied_slots.get(parking_slot.occupancy_key(), 0) - 1
+                allocator.update_on_commit(parking_slot)
+            models.ParkingOccupancy.adjust(occupied_slots=occupied_slots)
+            models.ParkingEvent.record(models.ParkingEvent.Kind.UNPARK, [
+                (exit_datetime, vehicle_parking.pk, vehicle_parking.parking_slot_id,
+                 parking_slots[vehicle_parking.vehicle_id].mall_parking_id, vehicle_parking.vehicle_id)
+                for vehicle_parking in vehicle_parkings
+            ])
+        metrics.EXITS.inc(len(vehicle_parkings))
+
+        return results
+
+# query parameters of the parking history export
+class VehicleParkingExportSerializer(serializers.Serializer):
+    file_format = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+    start = serializers.DateTimeField(required=False) # inclusive entry datetime
+    end = serializers.DateTimeField(required=False) # exclusive entry datetime
+    mall_parking = serializers.IntegerField(required=False)
+
+# query parameters of the revenue and utilization analytics
+class AnalyticsSerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=False) # inclusive exit datetime, 30 days before the end by default
+    end = serializers.DateTimeField(required=False) # exclusive exit datetime, now by default
+    group_by = serializers.ListField(child=serializers.ChoiceField(choices=analytics.GROUP_BY_CHOICES), required=False)
+    mall_parking = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        data['end'] = data.get('end') or datetime.now(timezone.utc)
+        data['start'] = data.get('start') or data['end'] - timedelta(days=30)
+        if data['start'] >= data['end']:
+            raise serializers.ValidationError('The start must be before the end.')
+
+        data['group_by'] = list(dict.fromkeys(data.get('group_by', [])))
+        if 'hour' in data['group_by'] and 'day' in data['group_by']:
+            raise serializers.ValidationError('The parkings can be grouped by hour or by day, not both.')
+        return data
+
+class WhatIfSerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=False) # inclusive exit datetime, 30 days before the end by default
+    end = serializers.DateTimeField(required=False) # exclusive exit datetime, now by default
+    mall_parking = serializers.IntegerField(required=False)
+    # what-if tariff parameters of the mall parkings, the current ones are used for the parameters that are not given
+    flat_rate = serializers.DecimalField(max_digits=19, decimal_places=10, min_value=0, required=False)
+    exceed_rate = serializers.DecimalField(max_digits=19, decimal_places=10, min_value=0, required=False)
+    flatRate_duration = serializers.IntegerField(min_value=0, required=False)
+    exceed_duration = serializers.IntegerField(min_value=0, required=False)
+    # what-if continuous rates by parking slot size pk
+    slot_rates = serializers.DictField(
+        child=serializers.DecimalField(max_digits=19, decimal_places=10, min_value=0), required=False
+    )
+
+    def validate(self, data):
+        data['end'] = data.get('end') or datetime.now(timezone.utc)
+        data['start'] = data.get('start') or data['end'] - timedelta(days=30)
+        if data['start'] >= data['end']:
+            raise serializers.ValidationError('The start must be before the end.')
+
+        # check that the parking slot sizes of the rates exist
+        slot_rates = {}
+        parking_slot_sizes = config_cache.get_parking_slot_sizes()
+        for parking_slot_size_id, rate in data.get('slot_rates', {}).items():
+            if not str(parking_slot_size_id).isdigit() or int(parking_slot_size_id) not in parking_slot_sizes:
+                raise serializers.ValidationError('The parking slot size {} does not exist.'.format(parking_slot_size_id))
+            slot_rates[int(parking_slot_size_id)] = rate
+        data['slot_rates'] = slot_rates
+
+        data['tariff'] = {field: data.pop(field) for field in fares.Tariff.FIELDS if field in data}
+        return data
+
+# List field for the layouts of hundreds of thousands of slots. Running the child fields on every value takes seconds,
+# so the lists of plain integers that pass the checks of the child fields are accepted in one pass, and the other lists
+# go through the child fields, which convert their values or report their errors.
+class BulkListField(serializers.ListField):
+    def _is_valid_plain(self, field, value):
+        if isinstance(field, serializers.ListField):
+            return (
+                type(value) is list
+                and (field.min_length is None or len(value) >= field.min_length)
+                and (field.max_length is None or len(value) <= field.max_length)
+                and all(self._is_valid_plain(field.child, item) for item in value)
+            )
+        # bool is a subclass of int that the integer field treats differently
+        return (
+            type(value) is int
+            and (field.min_value is None or value >= field.min_value)
+            and (field.max_value is None or value <= field.max_value)
+        )
+
+    def to_internal_value(self, data):
+        if type(data) is list and all(self._is_valid_plain(self.child, item) for item in data):
+            return data
+        return super().to_internal_value(data)
+
+class MallParkingSlotsSerializer(metrics.TimedSerializerMixin, serializers.Serializer):
     mall_parking = MallParkingSerializer()
     parking_slots = ParkingSlotSerializer(read_only=True, many=True)
-    parking_slot_distance_list = serializers.ListField(
+    parking_slot_distance_list = BulkListField(
         child = serializers.ListField(
             child = serializers.IntegerField(min_value=0),
             min_length = 3 # minimum number entries is 3, therefore the number of distances must be greater than 3
         ),
         write_only=True
     )
-    parking_slot_size_list = serializers.ListField(
+    parking_slot_size_list = BulkListField(
         child = serializers.IntegerField(),
         write_only=True
     )
 
+    # number of rows inserted per query when provisioning the parking slots
+    BATCH_SIZE = 5000
+
     def validate(self, data):
         # check that the parking slot lists have the same size
         if(len(data['parking_slot_distance_list']) != len(data['parking_slot_size_list'])):
@@ -224,28 +674,89 @@ class MallParkingSlotsSerializer(serializers.Serializer):
         mall_parking = models.MallParking(**data['mall_parking'])
         data['mall_parking'] = mall_parking
 
-        parking_slots = []
-        for i in range(0, len(data['parking_slot_distance_list'])):
+        # all the parking slot sizes are resolved at once from the config cache
+        parking_slot_sizes = config_cache.get_parking_slot_sizes()
+
+        # validate the distances and the sizes of every slot in one pass
+        parking_slot_rows = []
+        for distances, parking_slot_size_id in zip(data['parking_slot_distance_list'], data['parking_slot_size_list']):
             # check that the number of distance matches the number of entries in the mall
-            if len(data['parking_slot_distance_list'][i]) != mall_parking.num_entries:
+            if len(distances) != mall_parking.num_entries:
                 raise serializers.ValidationError('Invalid parking slot distances input.')
-            
-            parking_slot_size = models.ParkingSlotSize.objects.get(id=data['parking_slot_size_list'][i])
-            parking_slot_instance = models.ParkingSlot(
-                mall_parking = mall_parking,
-                parking_slot_size = parking_slot_size,
-                distances = data['parking_slot_distance_list'][i]
-            )
-            parking_slots.append(parking_slot_instance)
-        data['parking_slots'] = parking_slots
+
+            parking_slot_size = parking_slot_sizes.get(parking_slot_size_id)
+            if parking_slot_size is None:
+                raise serializers.ValidationError('Unknown parking slot size ' + str(parking_slot_size_id) + '.')
+
+            parking_slot_rows.append((parking_slot_size, distances))
+        data['parking_slot_rows'] = parking_slot_rows
 
         return data
 
     def save(self):
         mall_parking = self.validated_data['mall_parking']
-        mall_parking.save()
+        parking_slot_rows = self.validated_data['parking_slot_rows']
+
+        with transaction.atomic():
+            mall_parking.save()
+            models.ParkingSlot.provision(mall_parking, parking_slot_rows, batch_size=self.BATCH_SIZE, rank=True)
 
-        for i in range(0, len(self.validated_data['parking_slots'])):
-            self.validated_data['parking_slots'][i].save()
+            # bulk inserts do not send the save signals, so the allocator is loaded again
+            allocator.reset_on_commit()
+
+        # the created slots are returned in the response
+        self.validated_data['parking_slots'] = models.ParkingSlot.objects.filter(
+            mall_parking=mall_parking
+        ).select_related('mall_parking', 'parking_slot_size').order_by('pk')
 
         return True
+
+class LayoutImportSerializer(metrics.TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = models.LayoutImport
+        fields = ['id', 'mall_parking', 'file_name', 'file_format', 'status', 'rows_imported', 'error', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+# multipart upload of a layout file, the slots are added to an existing mall, to a new mall, or to the mall of the
+# layout import that is resumed
+class LayoutImportUploadSerializer(serializers.Serializer):
+    file = serializers.FileField(write_only=True)
+    file_format = serializers.ChoiceField(choices=layout_import.FILE_FORMATS, required=False)
+    mall_parking = serializers.PrimaryKeyRelatedField(queryset=models.MallParking.objects.all(), required=False)
+    name = serializers.CharField(max_length=255, required=False)
+    num_entries = serializers.IntegerField(min_value=3, default=3)
+    layout_import = serializers.PrimaryKeyRelatedField(queryset=models.LayoutImport.objects.all(), required=False)
+
+    def validate(self, data):
+        if 'layout_import' in data:
+            return data
+        if 'mall_parking' not in data and 'name' not in data:
+            raise serializers.ValidationError('Either the mall parking, the name of a new mall or the layout import to resume is required.')
+        if 'file_format' not in data:
+            data['file_format'] = layout_import.file_format_from_name(data['file'].name)
+            if data['file_format'] is None:
+                raise serializers.ValidationError('Unknown file format.')
+        return data
+
+    # runs the import and returns the layout import, which holds the error when a row was invalid
+    def save(self):
+        import_record = self.validated_data.get('layout_import')
+        if import_record is None:
+            mall_parking = self.validated_data.get('mall_parking')
+            if mall_parking is None:
+                mall_parking = models.MallParking.objects.create(
+                    name=self.validated_data['name'],
+                    num_entries=self.validated_data['num_entries']
+                )
+            import_record = models.LayoutImport.objects.create(
+                mall_parking=mall_parking,
+                file_name=self.validated_data['file'].name,
+                file_format=self.validated_data['file_format']
+            )
+
+        # the uploaded file is read line by line, large uploads are kept in a temporary file by the upload handlers
+        try:
+            layout_import.run(import_record, codecs.iterdecode(self.validated_data['file'], 'utf-8'))
+        except layout_import.LayoutImportError:
+            pass
+        return import_record
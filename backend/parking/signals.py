@@ -0,0 +1,82 @@
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import allocator
+from .config_cache import config_cache
+from . import metrics
+from . import models
+
+# keep the slot allocator in sync with the parking slots once the changes are committed to the database
+
+@receiver(post_save, sender=models.ParkingSlot)
+def update_allocated_parking_slot(sender, instance, **kwargs):
+    allocator.update_on_commit(instance)
+
+@receiver(post_delete, sender=models.ParkingSlot)
+def remove_allocated_parking_slot(sender, instance, **kwargs):
+    parking_slot_pk = instance.pk
+    mall_parking_id = instance.mall_parking_id
+    transaction.on_commit(lambda: allocator.get_allocator().remove(parking_slot_pk, mall_parking_id))
+
+# a deleted slot is no longer counted, its counter may already be deleted when its mall or its size is deleted
+@receiver(post_delete, sender=models.ParkingSlot)
+def remove_parking_slot_occupancy(sender, instance, **kwargs):
+    occupancy_key = instance.occupancy_key()
+    models.ParkingOccupancy.adjust(
+        total_slots={occupancy_key: -1},
+        occupied_slots={occupancy_key: 0 if instance.vehicle_parking_id is None else -1},
+        create=False
+    )
+
+# the archived parkings of a deleted slot are deleted like the parkings that are not archived yet
+@receiver(post_delete, sender=models.ParkingSlot)
+def delete_archived_parkings(sender, instance, **kwargs):
+    models.ArchivedVehicleParking.objects.filter(parking_slot_id=instance.pk).delete()
+
+# the rankings of the mall no longer contain a deleted slot
+@receiver(post_delete, sender=models.ParkingSlot)
+def remove_ranked_parking_slot(sender, instance, **kwargs):
+    try:
+        size_value = config_cache.get_parking_slot_size(instance.parking_slot_size_id).value
+    except models.ParkingSlotSize.DoesNotExist:
+        # the slot is deleted along with its size, its records are looked up by pk
+        size_value = None
+    models.ParkingSlotRanking.remove_slot(instance.pk, instance.mall_parking_id, size_value, instance.get_distances())
+
+# keep the copy of the size value in the distance table and the rankings up to date
+@receiver(post_save, sender=models.ParkingSlotSize)
+def update_slot_distance_size_value(sender, instance, **kwargs):
+    updated = models.ParkingSlotDistance.objects.filter(
+        parking_slot__parking_slot_size=instance
+    ).exclude(size_value=instance.value).update(size_value=instance.value)
+    if updated:
+        for mall_parking_id in models.ParkingSlot.objects.filter(parking_slot_size=instance).values_list('mall_parking', flat=True).order_by().distinct():
+            models.ParkingSlotRanking.rebuild(mall_parking_id)
+
+# the size values are used as the keys of the allocator, so it is loaded again when they change
+@receiver(post_save, sender=models.ParkingSlotSize)
+@receiver(post_delete, sender=models.ParkingSlotSize)
+def reset_slot_allocator(sender, **kwargs):
+    transaction.on_commit(lambda: allocator.get_allocator().reset())
+
+# drop the cached configuration right away in this process and bump the shared version once the change is committed
+@receiver(post_save, sender=models.MallParking)
+@receiver(post_delete, sender=models.MallParking)
+@receiver(post_save, sender=models.ParkingSlotSize)
+@receiver(post_delete, sender=models.ParkingSlotSize)
+def invalidate_config_cache(sender, **kwargs):
+    config_cache.invalidate()
+    transaction.on_commit(config_cache.invalidate)
+
+@receiver(setting_changed)
+def reset_slot_allocator_setting(setting, **kwargs):
+    if setting == 'PARKING_SLOT_ALLOCATOR':
+        allocator.reset_allocator()
+
+# time the queries of the requests for the metrics
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    metrics.instrument_connection(connection)
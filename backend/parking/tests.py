@@ -1,3 +1,1485 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+import contextlib
+import csv
+import importlib
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
 
-# Create your tests here.
+from app import db_profiles
+
+from . import allocator
+from . import analytics
+from . import archive
+from . import benchmarking
+from . import config_cache as config_cache_module
+from . import fares
+from . import idempotency
+from . import journal
+from . import metrics
+from . import models
+from . import occupancy
+from . import serializers
+from .config_cache import config_cache
+
+# base test case with the default parking slot sizes and helpers for calling the parking endpoints
+class ParkingTestCase(TestCase):
+    fixtures = ['parking_sizes']
+
+    def setUp(self):
+        self.client = APIClient()
+        allocator.get_allocator().reset()
+        config_cache.invalidate()
+        idempotency.idempotency_cache.reset()
+
+    def create_mall(self, distances, sizes, num_entries=3):
+        response = self.client.post('/parking/mall_parking_slots/', {
+            'mall_parking': {'name': 'Mall', 'num_entries': num_entries},
+            'parking_slot_distance_list': distances,
+            'parking_slot_size_list': sizes
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return models.MallParking.objects.get(pk=response.data['mall_parking']['id'])
+
+    def park(self, plate_number, vehicle_type, entry_index):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/parking/mall_parking_slots/entry', {
+                'entry_index': entry_index,
+                'plate_number': plate_number,
+                'type': vehicle_type
+            }, format='json')
+
+    def unpark(self, plate_number):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch('/parking/mall_parking_slots/exit', {'plate_number': plate_number}, format='json')
+
+    def parked_slot(self, plate_number):
+        return models.ParkingSlot.objects.get(vehicle_parking__vehicle__pk=plate_number)
+
+class SlotAllocatorTests(ParkingTestCase):
+    def test_nearest_slot_and_smaller_size_tie_break(self):
+        self.create_mall([[1, 5, 5], [1, 5, 5], [2, 1, 5]], [2, 1, 0])
+
+        self.assertEqual(self.park('A', 0, 0).status_code, 201)
+        self.assertEqual(self.parked_slot('A').parking_slot_size.value, 1)
+
+        self.assertEqual(self.park('B', 0, 0).status_code, 201)
+        self.assertEqual(self.parked_slot('B').parking_slot_size.value, 2)
+
+        self.assertEqual(self.park('C', 2, 0).status_code, 400)
+
+    # parks and unparks vehicles through the endpoints and checks the assigned slots against the original scan
+    def assert_allocator_matches_scan_allocator(self, allocator_class):
+        self.assertIsInstance(allocator.get_allocator(), allocator_class)
+        rng = random.Random(7)
+        self.create_mall(
+            [[rng.randint(0, 5) for _ in range(3)] for _ in range(40)],
+            [rng.randint(0, 2) for _ in range(40)]
+        )
+        scan_allocator = allocator.ScanSlotAllocator()
+
+        parked = []
+        for i in range(200):
+            if parked and rng.random() < 0.4:
+                self.assertEqual(self.unpark(parked.pop(rng.randrange(len(parked)))).status_code, 200)
+                continue
+
+            vehicle_type = rng.randint(0, 2)
+            entry_index = rng.randint(0, 2)
+            expected = scan_allocator.allocate(vehicle_type, entry_index)
+
+            response = self.park(str(i), vehicle_type, entry_index)
+            if expected is None:
+                self.assertEqual(response.status_code, 400)
+            else:
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(self.parked_slot(str(i)), expected)
+                parked.append(str(i))
+
+    @override_settings(PARKING_SLOT_ALLOCATOR='parking.allocator.HeapSlotAllocator')
+    def test_heap_allocator_matches_scan_allocator(self):
+        self.assert_allocator_matches_scan_allocator(allocator.HeapSlotAllocator)
+
+    @override_settings(PARKING_SLOT_ALLOCATOR='parking.allocator.DistanceTableSlotAllocator')
+    def test_distance_table_allocator_matches_scan_allocator(self):
+        self.assert_allocator_matches_scan_allocator(allocator.DistanceTableSlotAllocator)
+
+    @override_settings(PARKING_SLOT_ALLOCATOR='parking.allocator.RankedSlotAllocator')
+    def test_ranked_allocator_matches_scan_allocator(self):
+        self.assert_allocator_matches_scan_allocator(allocator.RankedSlotAllocator)
+
+    @override_settings(PARKING_SLOT_ALLOCATOR='parking.allocator.RankedSlotAllocator')
+    def test_rankings_follow_layout_edits(self):
+        mall_parking = self.create_mall([[1, 2, 3], [2, 2, 1], [3, 1, 2]], [2, 0, 1])
+
+        def rankings():
+            return [
+                [record[2] for record in models.ParkingSlotRanking.unpack(slots)]
+                for slots in models.ParkingSlotRanking.objects.filter(mall_parking=mall_parking).order_by('entry_index').values_list('slots', flat=True)
+            ]
+
+        first, second, third = models.ParkingSlot.objects.filter(mall_parking=mall_parking).order_by('pk')
+        # the smaller slot comes first when the distances are equal
+        self.assertEqual(rankings(), [[first.pk, second.pk, third.pk], [third.pk, second.pk, first.pk], [second.pk, third.pk, first.pk]])
+
+        response = self.client.post('/parking/parking_slots/', {
+            'mall_parking': {'id': mall_parking.pk, 'name': mall_parking.name},
+            'parking_slot_size': {'id': 0, 'name': 'SP', 'continuous_rate': 20},
+            'distances': [0, 9, 9]
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        fourth = response.data['id']
+
+        response = self.client.put('/parking/parking_slots/%d/' % third.pk, {
+            'mall_parking': {'id': mall_parking.pk, 'name': mall_parking.name},
+            'parking_slot_size': {'id': 1, 'name': 'MP', 'continuous_rate': 60},
+            'distances': [5, 0, 5]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        first.delete()
+
+        expected = [[fourth, second.pk, third.pk], [third.pk, second.pk, fourth], [second.pk, third.pk, fourth]]
+        self.assertEqual(rankings(), expected)
+        models.ParkingSlotRanking.rebuild(mall_parking.pk)
+        self.assertEqual(rankings(), expected)
+
+        self.assertEqual(self.park('A', 0, 1).status_code, 201)
+        self.assertEqual(self.parked_slot('A').pk, third.pk)
+        self.assertEqual(self.park('B', 0, 1).status_code, 201)
+        self.assertEqual(self.parked_slot('B').pk, second.pk)
+        self.assertEqual(self.park('C', 1, 1).status_code, 400)
+
+    @override_settings(PARKING_SLOT_ALLOCATOR='parking.allocator.ScanSlotAllocator')
+    def test_allocator_setting(self):
+        self.assertIsInstance(allocator.get_allocator(), allocator.ScanSlotAllocator)
+
+    @override_settings(PARKING_SLOT_ALLOCATOR='parking.allocator.HeapSlotAllocator')
+    def test_heap_allocator_follows_slots_moved_between_malls(self):
+        mall_a = self.create_mall([[1, 1, 1], [2, 2, 2]], [0, 0])
+        mall_b = self.create_mall([[3, 3, 3]], [0])
+        heap_allocator = allocator.get_allocator()
+        near, far = models.ParkingSlot.objects.filter(mall_parking=mall_a).order_by('pk')
+        self.assertEqual(heap_allocator.allocate(0, 0, mall_parking_id=mall_a.pk), near)
+        self.assertEqual(heap_allocator.allocate(0, 0, mall_parking_id=mall_b.pk).get_distances(), [3, 3, 3])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            near.mall_parking = mall_b
+            near.save()
+        self.assertNotIn(near.pk, heap_allocator._malls[mall_a.pk].free_slots)
+        self.assertEqual(heap_allocator.allocate(0, 0, mall_parking_id=mall_a.pk), far)
+        self.assertEqual(heap_allocator.allocate(0, 0, mall_parking_id=mall_b.pk), near)
+
+    @override_settings(PARKING_CONFIG_CACHE_CHECK_INTERVAL=0)
+    def test_heap_allocator_applies_changes_of_another_process(self):
+        mall_parking = self.create_mall([[1, 1, 1], [2, 2, 2]], [0, 0])
+        self.assertEqual(self.park('A', 0, 0).status_code, 201)
+        near = self.parked_slot('A')
+
+        heap_allocator = allocator.HeapSlotAllocator()
+        self.assertNotEqual(heap_allocator.allocate(0, 0, mall_parking_id=mall_parking.pk), near)
+        mall_heaps = heap_allocator._malls[mall_parking.pk]
+
+        # the slot is freed by another process, which records the change for the mall
+        self.assertEqual(self.unpark('A').status_code, 200)
+        near.refresh_from_db()
+        allocator.HeapSlotAllocator().update(near)
+        self.assertEqual(heap_allocator.allocate(0, 0, mall_parking_id=mall_parking.pk), near)
+        # the change was applied to the heaps, which were not loaded again
+        self.assertIs(heap_allocator._malls[mall_parking.pk], mall_heaps)
+
+        # the heaps are loaded again when the changes can no longer be replayed
+        with mock.patch.object(allocator.HeapSlotAllocator, 'MAX_REPLAYED_CHANGES', 1):
+            other_allocator = allocator.HeapSlotAllocator()
+            other_allocator.update(near)
+            other_allocator.remove(near.pk, mall_parking.pk)
+            self.assertEqual(heap_allocator.allocate(0, 0, mall_parking_id=mall_parking.pk), near)
+        self.assertIsNot(heap_allocator._malls[mall_parking.pk], mall_heaps)
+
+        # and every mall is loaded again when another process resets the allocator
+        mall_heaps = heap_allocator._malls[mall_parking.pk]
+        allocator.HeapSlotAllocator().reset()
+        self.assertEqual(heap_allocator.allocate(0, 0, mall_parking_id=mall_parking.pk), near)
+        self.assertIsNot(heap_allocator._malls[mall_parking.pk], mall_heaps)
+
+    def test_heap_allocator_warm_up(self):
+        mall_a = self.create_mall([[1, 1, 1]], [0])
+        mall_b = self.create_mall([[2, 2, 2]], [0])
+        heap_allocator = allocator.HeapSlotAllocator()
+        heap_allocator.warm_up()
+        self.assertTrue(heap_allocator._all_loaded)
+        self.assertEqual(sorted(heap_allocator._malls), [mall_a.pk, mall_b.pk])
+        with self.assertNumQueries(1):
+            self.assertEqual(heap_allocator.allocate(0, 0, mall_parking_id=mall_b.pk).get_distances(), [2, 2, 2])
+
+        # the application warms up the configured allocator, unless the tables are not migrated yet
+        with override_settings(PARKING_SLOT_ALLOCATOR='parking.allocator.HeapSlotAllocator'):
+            allocator.warm_up()
+            self.assertEqual(len(allocator.get_allocator()._malls), 2)
+            with mock.patch.object(models.MallParking.objects, 'values_list', side_effect=OperationalError):
+                allocator.reset_allocator()
+                allocator.warm_up()
+
+    def test_slot_distances_are_kept_in_sync(self):
+        mall_parking = self.create_mall([[1, 2, 3], [4, 5, 6]], [0, 2])
+        self.assertEqual(
+            list(models.ParkingSlotDistance.objects.order_by('distance').values_list('distance', 'size_value')),
+            [(1, 0), (2, 0), (3, 0), (4, 2), (5, 2), (6, 2)]
+        )
+
+        response = self.client.post('/parking/parking_slots/', {
+            'mall_parking': {'id': mall_parking.pk, 'name': mall_parking.name},
+            'parking_slot_size': {'id': 1, 'name': 'MP', 'continuous_rate': 60},
+            'distances': [0, 7, 8]
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            list(models.ParkingSlotDistance.objects.filter(parking_slot=response.data['id']).values_list('entry_index', 'distance', 'size_value')),
+            [(0, 0, 1), (1, 7, 1), (2, 8, 1)]
+        )
+
+    def test_partial_update_of_parking_slot(self):
+        mall_parking = self.create_mall([[1, 2, 3], [4, 5, 6]], [0, 2])
+        other_mall_parking = self.create_mall([[1, 2, 3, 4]], [0], num_entries=4)
+        parking_slot = models.ParkingSlot.objects.filter(mall_parking=mall_parking).order_by('pk').first()
+        url = '/parking/parking_slots/%d/' % parking_slot.pk
+
+        response = self.client.patch(url, {'distances': [7, 8, 9]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(url, {'parking_slot_size': {'id': 1, 'name': 'MP', 'continuous_rate': 60}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        parking_slot.refresh_from_db()
+        self.assertEqual((parking_slot.mall_parking, parking_slot.parking_slot_size_id, parking_slot.get_distances()), (mall_parking, 1, [7, 8, 9]))
+        self.assertEqual(
+            list(models.ParkingSlotDistance.objects.filter(parking_slot=parking_slot).values_list('distance', 'size_value')),
+            [(7, 1), (8, 1), (9, 1)]
+        )
+
+        # the distances of the slot do not match the entries of the other mall
+        response = self.client.patch(url, {'mall_parking': {'id': other_mall_parking.pk}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(url, {'mall_parking': {'id': 999}}, format='json')
+        self.assertEqual(response.data['non_field_errors'], ['Unknown mall parking.'])
+        response = self.client.patch(url, {'parking_slot_size': {'id': 9, 'name': 'XP', 'continuous_rate': 1}}, format='json')
+        self.assertEqual(response.data['non_field_errors'], ['Unknown parking slot size.'])
+
+class BulkEntryTests(ParkingTestCase):
+    def bulk_park(self, vehicles):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/parking/mall_parking_slots/entry/bulk', {'vehicles': vehicles}, format='json')
+
+    def test_bulk_entry_matches_single_entries(self):
+        rng = random.Random(3)
+        distances = [[rng.randint(0, 9) for _ in range(3)] for _ in range(30)]
+        sizes = [rng.randint(0, 2) for _ in range(30)]
+        vehicles = [
+            {'plate_number': str(i), 'type': rng.randint(0, 2), 'entry_index': rng.randint(0, 2)}
+            for i in range(40)
+        ]
+
+        self.create_mall(distances, sizes)
+        for vehicle in vehicles:
+            self.park(vehicle['plate_number'], vehicle['type'], vehicle['entry_index'])
+        expected = {
+            vehicle_parking.vehicle_id: vehicle_parking.parking_slot.get_distances()
+            for vehicle_parking in models.VehicleParking.objects.all()
+        }
+
+        models.MallParking.objects.all().delete()
+        models.Vehicle.objects.all().delete()
+        self.create_mall(distances, sizes)
+        response = self.bulk_park(vehicles)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(
+            {result['plate_number']: models.ParkingSlot.objects.get(pk=result['parking_slot']).get_distances() for result in response.data if 'errors' not in result},
+            expected
+        )
+        self.assertEqual(models.ParkingSlot.objects.exclude(vehicle_parking=None).count(), len(expected))
+
+    def test_bulk_entry_reports_item_errors(self):
+        self.create_mall([[1, 2, 3]], [1])
+        self.park('A', 0, 0)
+
+        response = self.bulk_park([
+            {'plate_number': 'A', 'type': 0, 'entry_index': 0},
+            {'plate_number': 'B', 'type': 5, 'entry_index': 0},
+            {'plate_number': 'C', 'type': 0, 'entry_index': 0},
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([sorted(result) for result in response.data], [
+            ['errors', 'index', 'plate_number'],
+            ['errors', 'index', 'plate_number'],
+            ['errors', 'index', 'plate_number'],
+        ])
+
+    def test_bulk_entry_query_count_does_not_depend_on_batch_size(self):
+        self.create_mall([[i, i, i] for i in range(100)], [2] * 100)
+        for batch, plate_prefix in ((10, 'A'), (100, 'B')):
+            models.ParkingSlot.objects.update(vehicle_parking=None)
+            vehicles = [{'plate_number': plate_prefix + str(i), 'type': 0, 'entry_index': 0} for i in range(batch)]
+            # savepoint, parked vehicles, vehicles, malls, free slots, vehicle insert, parking insert, slot update,
+            # claimed slots, counter update, journal insert and release
+            with self.assertNumQueries(12):
+                self.assertEqual(self.bulk_park(vehicles).status_code, 201)
+
+    def test_bulk_entry_does_not_load_unrelated_malls(self):
+        mall_parking = self.create_mall([[5, 5, 5], [6, 6, 6]], [0, 0])
+        self.create_mall([[1, 1, 1], [2, 2, 2]], [0, 0])
+        unrelated = self.create_mall([[i, i, i] for i in range(10, 60)], [2] * 50)
+
+        loaded = []
+        load = allocator.HeapSlotAllocator.load
+        def record_load(slot_allocator, free_slots, mall_parking_ids=None):
+            free_slots = list(free_slots)
+            loaded.extend(free_slot[0] for free_slot in free_slots)
+            return load(slot_allocator, free_slots, mall_parking_ids)
+
+        with mock.patch.object(allocator.HeapSlotAllocator, 'load', record_load):
+            response = self.bulk_park([
+                {'plate_number': 'A', 'type': 0, 'entry_index': 0, 'mall_parking': mall_parking.pk},
+                {'plate_number': 'B', 'type': 0, 'entry_index': 0},
+                {'plate_number': 'C', 'type': 0, 'entry_index': 1},
+            ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.parked_slot('A').mall_parking, mall_parking)
+        self.assertEqual(self.parked_slot('B').get_distances(), [1, 1, 1])
+        self.assertEqual(self.parked_slot('C').get_distances(), [2, 2, 2])
+        self.assertFalse(models.ParkingSlot.objects.filter(pk__in=loaded, mall_parking=unrelated).exists())
+
+class BulkExitTests(ParkingTestCase):
+    def bulk_unpark(self, plate_numbers):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch('/parking/mall_parking_slots/exit/bulk', {'plate_numbers': plate_numbers}, format='json')
+
+    def test_bulk_exit_charges_match_parking_properties(self):
+        self.create_mall([[i, i, i] for i in range(6)], [0, 1, 2, 0, 1, 2])
+        # the durations are 1 hour, 5 hours, 25 hours and 2 hours after returning 1 hour after the last exit
+        for plate_number, vehicle_type, hours in (('A', 0, 1), ('B', 1, 5), ('C', 2, 25), ('D', 0, 2)):
+            self.park(plate_number, vehicle_type, 0)
+            models.VehicleParking.objects.filter(vehicle=plate_number).update(
+                entry_datetime=datetime.now(timezone.utc) - timedelta(hours=hours)
+            )
+        # an earlier exit of D that is recorded on the vehicle like the exits of the endpoints
+        previous_parking = models.VehicleParking.objects.create(
+            entry_index=0,
+            exit_datetime=datetime.now(timezone.utc) - timedelta(hours=3),
+            parking_slot=models.ParkingSlot.objects.filter(vehicle_parking=None).first(),
+            vehicle=models.Vehicle.objects.get(pk='D')
+        )
+        models.Vehicle.record_exit(['D'], previous_parking.exit_datetime, previous_parking.parking_slot.mall_parking_id)
+
+        response = self.bulk_unpark(['A', 'B', 'C', 'D', 'E'])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data[-1], {'plate_number': 'E', 'errors': ['Unknown plate number.']})
+        self.assertFalse(models.ParkingSlot.objects.exclude(vehicle_parking=None).exists())
+
+        # the backfill command computes the same charges that were stored at exit
+        models.VehicleParking.objects.update(is_fixed_starting_rate=True, total_charge=0)
+        call_command('backfill_parking_charges', stdout=StringIO())
+        for result in response.data[:-1]:
+            vehicle_parking = models.VehicleParking.objects.get(pk=result['vehicle_parking'])
+            self.assertEqual(
+                (vehicle_parking.is_fixed_starting_rate, vehicle_parking.total_charge),
+                (result['is_fixed_starting_rate'], result['total_charge'])
+            )
+
+        # the charges are rounded up, so a few milliseconds over the hour add one to the continuous rate
+        charges = {result['plate_number']: result['total_charge'] for result in response.data[:-1]}
+        self.assertEqual(charges['A'], 40)
+        self.assertIn(charges['B'], (40 + 2 * 60, 40 + 2 * 60 + 1))
+        self.assertIn(charges['C'], (5000 + 40 + 22 * 100, 5000 + 40 + 22 * 100 + 1))
+        # D returned after the return duration of 30 minutes, so it starts with the flat rate again
+        self.assertTrue(response.data[3]['is_fixed_starting_rate'])
+        self.assertEqual(charges['D'], 40)
+
+class ReturnVisitTests(ParkingTestCase):
+    def test_exit_is_recorded_on_the_vehicle(self):
+        mall_parking = self.create_mall([[1, 2, 3], [2, 3, 4]], [0, 1])
+        self.park('A', 0, 0)
+        response = self.unpark('A')
+
+        vehicle = models.Vehicle.objects.get(pk='A')
+        self.assertEqual(vehicle.last_exit_datetime, models.VehicleParking.objects.get(pk=response.data['id']).exit_datetime)
+        self.assertEqual(vehicle.last_exit_mall_parking, mall_parking)
+
+        # an older exit does not replace the latest one
+        self.assertEqual(models.Vehicle.record_exit(['A'], vehicle.last_exit_datetime - timedelta(hours=1), None), 0)
+        self.assertEqual(models.Vehicle.objects.get(pk='A').last_exit_mall_parking, mall_parking)
+
+    def test_returning_vehicle_without_history_queries(self):
+        self.create_mall([[1, 2, 3], [2, 3, 4]], [0, 1])
+        for i in range(5):
+            self.park('A', 0, 0)
+            self.unpark('A')
+        self.park('A', 0, 0)
+        self.park('B', 0, 0)
+        models.VehicleParking.objects.filter(vehicle='B').update(
+            entry_datetime=datetime.now(timezone.utc) - timedelta(hours=4)
+        )
+
+        # the previous exits are read from the vehicles instead of the parking history
+        with CaptureQueriesContext(connection) as queries:
+            response = self.unpark('A')
+        self.assertFalse(any('MAX(' in query['sql'] or '"exit_datetime" IS NOT NULL' in query['sql'] for query in queries))
+        self.assertFalse(response.data['is_fixed_starting_rate'])
+
+        response = self.unpark('B')
+        self.assertTrue(response.data['is_fixed_starting_rate'])
+        # B is given the medium slot because A is parked in the small one
+        self.assertIn(response.data['total_charge'], (40 + 60, 40 + 60 + 1))
+
+    def test_exited_parking_keeps_its_starting_rate(self):
+        self.create_mall([[1, 2, 3]], [0])
+        self.park('A', 0, 0)
+        self.unpark('A')
+        self.park('A', 0, 0)
+        vehicle_parking = models.VehicleParking.objects.get(pk=self.unpark('A').data['id'])
+        self.assertFalse(vehicle_parking.is_fixed_starting_rate)
+        total_charge = vehicle_parking.total_charge
+        # later parkings of the vehicle do not change the charges
+        models.Vehicle.objects.filter(pk='A').update(last_exit_datetime=None)
+
+        # updating the parking again computes the same charges without reading the history of the vehicle
+        serializer = serializers.VehicleParkingSerializer(instance=vehicle_parking, data={'plate_number': 'A'})
+        self.assertTrue(serializer.is_valid())
+        with CaptureQueriesContext(connection) as queries:
+            serializer.save()
+        self.assertFalse(any('"exit_datetime" IS NOT NULL' in query['sql'] for query in queries))
+        vehicle_parking.refresh_from_db()
+        self.assertEqual((vehicle_parking.is_fixed_starting_rate, vehicle_parking.total_charge), (False, total_charge))
+
+    # parks the vehicle again the given time after its last exit and returns the exit response
+    def return_after(self, plate_number, delay):
+        self.park(plate_number, 0, 0)
+        self.unpark(plate_number)
+        models.Vehicle.objects.filter(pk=plate_number).update(last_exit_datetime=F('last_exit_datetime') - delay)
+        self.park(plate_number, 0, 0)
+        return self.unpark(plate_number)
+
+    def test_return_within_return_duration_continues_the_rate(self):
+        self.create_mall([[1, 2, 3]], [0])
+        response = self.return_after('A', timedelta(minutes=20))
+        self.assertFalse(response.data['is_fixed_starting_rate'])
+
+    def test_return_after_return_duration_starts_a_fixed_rate(self):
+        self.create_mall([[1, 2, 3]], [0])
+        response = self.return_after('A', timedelta(minutes=40))
+        self.assertTrue(response.data['is_fixed_starting_rate'])
+        self.assertEqual(response.data['total_charge'], 40)
+
+class MigrationTests(ParkingTestCase):
+    # the constraint is dropped inside the test transaction so the duplicates can be inserted, the DDL is rolled back
+    @skipUnless(connection.vendor == 'sqlite', 'the constraint is dropped with SQLite')
+    def test_duplicate_open_parkings_are_closed(self):
+        self.create_mall([[1, 1, 1], [2, 2, 2], [3, 3, 3]], [0, 0, 0])
+        self.park('A', 0, 0)
+        self.park('B', 0, 0)
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX "unique_active_vehicle_parking"')
+
+        # A entered twice more without getting a slot, B entered again into the free slot
+        held = models.VehicleParking.objects.get(vehicle='A')
+        duplicates = [
+            models.VehicleParking.objects.create(entry_index=0, parking_slot_id=held.parking_slot_id, vehicle_id='A')
+            for _ in range(2)
+        ]
+        replaced = models.VehicleParking.objects.get(vehicle='B')
+        free_slot = models.ParkingSlot.objects.get(vehicle_parking=None)
+        held_by_b = models.VehicleParking.objects.create(entry_index=0, parking_slot=free_slot, vehicle_id='B')
+        models.ParkingSlot.objects.filter(pk=free_slot.pk).update(vehicle_parking=held_by_b)
+        models.ParkingOccupancy.adjust(occupied_slots={free_slot.occupancy_key(): 1})
+        self.assertEqual(occupancy.reconcile(), [])
+
+        migration = importlib.import_module('parking.migrations.0016_hot_path_indexes')
+        migration.close_duplicate_open_parkings(django_apps, None)
+
+        self.assertEqual(
+            sorted(models.VehicleParking.objects.filter(exit_datetime=None).values_list('pk', flat=True)),
+            [held.pk, held_by_b.pk]
+        )
+        # the parkings that do not hold a slot are closed at their entry, after the kept parking of A entered
+        for duplicate in duplicates:
+            duplicate.refresh_from_db()
+            self.assertEqual((duplicate.exit_datetime, duplicate.total_charge), (duplicate.entry_datetime, 0))
+        # the earlier parking of B is closed when the later one entered, and its slot is freed
+        replaced.refresh_from_db()
+        self.assertEqual((replaced.exit_datetime, replaced.total_charge), (held_by_b.entry_datetime, 0))
+        self.assertEqual(models.ParkingSlot.objects.get(pk=replaced.parking_slot_id).vehicle_parking, None)
+        self.assertEqual(occupancy.reconcile(), [])
+
+class IndexTests(ParkingTestCase):
+    # checks the query plans of the hot queries, the plan format is specific to SQLite
+    @skipUnless(connection.vendor == 'sqlite', 'the query plans are checked with SQLite')
+    def test_hot_queries_use_indexes(self):
+        mall_parking = self.create_mall([[i, i, i] for i in range(6)], [0, 1, 2, 0, 1, 2])
+        self.park('A', 0, 0)
+        self.unpark('A')
+        self.park('A', 0, 0)
+
+        queries = {
+            'parking_slot_free': [
+                models.ParkingSlot.objects.filter(vehicle_parking=None, parking_slot_size__value__gte=1),
+                models.ParkingSlot.objects.filter(
+                    vehicle_parking=None, parking_slot_size__value__gte=1, mall_parking=mall_parking
+                ),
+            ],
+            'parking_slot_occupied': [
+                models.ParkingSlot.objects.filter(vehicle_parking__vehicle__pk='A'),
+                models.ParkingSlot.objects.filter(vehicle_parking__vehicle__pk__in=['A', 'B']),
+            ],
+            'vehicle_parking_exit_key': [
+                models.VehicleParking.objects.filter(vehicle__pk='A', exit_datetime=None),
+                models.VehicleParking.objects.filter(vehicle__pk='A', exit_datetime__isnull=False).order_by('-exit_datetime'),
+                models.VehicleParking.objects.filter(exit_datetime__isnull=False).order_by('vehicle_id', 'exit_datetime', 'pk'),
+            ],
+        }
+        for index_name, querysets in queries.items():
+            for queryset in querysets:
+                self.assertIn('INDEX %s' % index_name, queryset.explain(), str(queryset.query))
+
+        # the nearest free slot is the first free row of the ranking index, only the ties are sorted
+        queryset = allocator.DistanceTableSlotAllocator()._ranked_slot_distances(1, 0, (), mall_parking.pk)[:1]
+        plan = queryset.explain()
+        self.assertIn('INDEX parking_slot_distance_rank ', plan, str(queryset.query))
+        self.assertEqual([line for line in plan.splitlines() if 'TEMP B-TREE' in line and 'RIGHT PART' not in line], [])
+
+    def test_one_active_parking_per_vehicle(self):
+        self.create_mall([[1, 2, 3], [2, 3, 4]], [0, 1])
+        self.park('A', 0, 0)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            models.VehicleParking.objects.create(
+                entry_index=0,
+                parking_slot=models.ParkingSlot.objects.filter(vehicle_parking=None).first(),
+                vehicle=models.Vehicle.objects.get(pk='A')
+            )
+
+        # an entry that passed the validation before the other entry was saved is rejected
+        serializer = serializers.VehicleParkingEntrySerializer(data={'entry_index': 0, 'plate_number': 'B', 'type': 0})
+        self.assertTrue(serializer.is_valid())
+        self.park('B', 0, 0)
+        with self.assertRaisesMessage(ValidationError, 'already parked'):
+            serializer.save()
+        self.assertEqual(models.VehicleParking.objects.filter(vehicle='B').count(), 1)
+
+class JournalTests(ParkingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_mall([[i, i, i] for i in range(6)], [0, 1, 2, 0, 1, 2])
+        self.park('A', 0, 0)
+        self.park('B', 1, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/parking/mall_parking_slots/entry/bulk', {'vehicles': [
+                {'plate_number': 'C', 'type': 0, 'entry_index': 1},
+                {'plate_number': 'D', 'type': 2, 'entry_index': 2},
+            ]}, format='json')
+        self.unpark('A')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/parking/mall_parking_slots/exit/bulk', {'plate_numbers': ['C']}, format='json')
+
+    def open_parkings(self):
+        return {
+            vehicle_parking.pk: (vehicle_parking.parking_slot_id, vehicle_parking.parking_slot.mall_parking_id, vehicle_parking.vehicle_id)
+            for vehicle_parking in models.VehicleParking.objects.filter(exit_datetime=None).select_related('parking_slot')
+        }
+
+    def test_replay_rebuilds_open_parkings(self):
+        self.assertEqual(
+            list(models.ParkingEvent.objects.order_by('pk').values_list('kind', 'plate_number')),
+            [(0, 'A'), (0, 'B'), (0, 'C'), (0, 'D'), (1, 'A'), (1, 'C')]
+        )
+        state = journal.replay(from_snapshot=False)
+        self.assertEqual(state.events_replayed, 6)
+        self.assertEqual(state.open_parkings, self.open_parkings())
+        self.assertEqual(journal.verify(state), [])
+
+    def test_snapshot_and_restore(self):
+        snapshot, _ = journal.take_snapshot()
+        self.park('E', 0, 1)
+
+        # only the events after the snapshot are replayed
+        state = journal.replay()
+        self.assertEqual(state.events_replayed, 1)
+        self.assertEqual(state.last_event_id, snapshot.last_event_id + 1)
+        self.assertEqual(state.open_parkings, self.open_parkings())
+
+        # a slot that was freed without an exit is occupied again from the journal
+        parking_slot = self.parked_slot('B')
+        models.ParkingSlot.objects.filter(pk=parking_slot.pk).update(vehicle_parking=None)
+        occupancy.reconcile(fix=True)
+        mismatches = journal.verify(state)
+        self.assertEqual(mismatches, [(parking_slot.pk, parking_slot.vehicle_parking_id, None)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            journal.verify(state, fix=True)
+        self.assertEqual(self.parked_slot('B'), parking_slot)
+        self.assertEqual(occupancy.reconcile(), [])
+        self.assertEqual(journal.verify(journal.replay()), [])
+
+class QueryBudgetTests(ParkingTestCase):
+    # number of queries allowed for every endpoint, regardless of the number of rows
+    QUERY_BUDGETS = {
+        '/parking/vehicle_parkings/': 2, # the parkings and the archived parkings
+        '/parking/mall_parking_slots/view': 2, # the parkings and the archived parkings
+        '/parking/parking_slots/': 1,
+        '/parking/mall_parkings/': 1,
+        '/parking/vehicles/': 1,
+    }
+
+    def add_parkings(self, num_parkings):
+        self.create_mall([[i, i, i] for i in range(num_parkings)], [2] * num_parkings)
+        for i in range(num_parkings):
+            self.park('%d-%d' % (num_parkings, i), i % 3, 0)
+            if i % 2:
+                self.unpark('%d-%d' % (num_parkings, i))
+
+    def assert_query_budgets(self):
+        for url, budget in self.QUERY_BUDGETS.items():
+            with self.subTest(url=url), self.assertNumQueries(budget):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_list_query_budgets(self):
+        self.add_parkings(2)
+        self.assert_query_budgets()
+        self.add_parkings(20)
+        self.assert_query_budgets()
+
+    def test_retrieve_query_budgets(self):
+        self.add_parkings(4)
+        vehicle_parking = models.VehicleParking.objects.exclude(exit_datetime=None).first()
+        for url in (
+            '/parking/vehicle_parkings/%d/' % vehicle_parking.pk,
+            '/parking/mall_parking_slots/view/%d' % vehicle_parking.pk,
+            '/parking/parking_slots/%d/' % vehicle_parking.parking_slot_id,
+        ):
+            with self.subTest(url=url), self.assertNumQueries(1):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+class HistoryTests(ParkingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mall_parking = self.create_mall([[i, i, i] for i in range(12)], [2] * 12)
+        for i in range(12):
+            self.park(str(i), 0, 0)
+            if i % 3:
+                self.unpark(str(i))
+
+    def test_cursor_pagination_returns_every_parking_once(self):
+        ids = []
+        url = '/parking/mall_parking_slots/view?page_size=5'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [vehicle_parking['id'] for vehicle_parking in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(ids, list(models.VehicleParking.objects.order_by('-entry_datetime', '-id').values_list('id', flat=True)))
+
+    def test_export_ndjson(self):
+        response = self.client.get('/parking/mall_parking_slots/export', {'mall_parking': self.mall_parking.pk})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['plate_number'] for row in rows], [str(i) for i in range(12)])
+        self.assertEqual(sum(row['exit_datetime'] is not None for row in rows), 8)
+
+        response = self.client.get('/parking/mall_parking_slots/export', {'mall_parking': self.mall_parking.pk + 1})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_export_csv(self):
+        start = models.VehicleParking.objects.get(vehicle='6').entry_datetime
+        response = self.client.get('/parking/mall_parking_slots/export', {'file_format': 'csv', 'start': start.isoformat()})
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:2], ['id', 'plate_number'])
+        self.assertEqual([row[1] for row in rows[1:]], [str(i) for i in range(6, 12)])
+
+    def test_history_reads_archived_parkings(self):
+        # the parkings of 1, 2 and 4 exited 100 days ago, 2 entered before the other parkings
+        for plate_number, entry_days in (('1', 100), ('2', 101), ('4', 100)):
+            models.VehicleParking.objects.filter(vehicle=plate_number).update(
+                entry_datetime=F('entry_datetime') - timedelta(days=entry_days),
+                exit_datetime=F('exit_datetime') - timedelta(days=100)
+            )
+
+        def history():
+            results = []
+            url = '/parking/mall_parking_slots/view?page_size=2'
+            while url:
+                response = self.client.get(url)
+                results += response.data['results']
+                url = response.data['next']
+            return results
+
+        def export():
+            response = self.client.get('/parking/mall_parking_slots/export')
+            return b''.join(response.streaming_content).decode().splitlines()
+
+        results, rows = history(), export()
+        call_command('archive_parkings', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(
+            sorted(models.ArchivedVehicleParking.objects.values_list('plate_number', flat=True)), ['1', '2', '4']
+        )
+        self.assertFalse(models.VehicleParking.objects.filter(vehicle__in=['1', '2', '4']).exists())
+
+        # the archived parkings are read like the other parkings
+        self.assertEqual(history(), results)
+        self.assertEqual(export(), rows)
+        archived_result = next(result for result in results if result['vehicle']['plate_number'] == '2')
+        self.assertEqual(self.client.get('/parking/mall_parking_slots/view/%d' % archived_result['id']).data, archived_result)
+        self.assertEqual(self.client.get('/parking/mall_parking_slots/view/0').status_code, 404)
+
+class AnalyticsTests(ParkingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mall_parking = self.create_mall([[i, i, i] for i in range(8)], [0, 1, 2, 0, 1, 2, 0, 1])
+        # parkings of 1 to 7 hours from different entries, and one vehicle that is still parked
+        for i in range(6):
+            self.park(str(i), i % 3, i % 3)
+            models.VehicleParking.objects.filter(vehicle=str(i)).update(
+                entry_datetime=datetime.now(timezone.utc) - timedelta(hours=i + 1)
+            )
+            self.unpark(str(i))
+        self.park('parked', 0, 0)
+
+    def analytics(self, **params):
+        response = self.client.get('/parking/mall_parking_slots/analytics', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_totals_match_the_stored_charges(self):
+        closed_parkings = models.VehicleParking.objects.exclude(exit_datetime=None)
+        durations = [
+            (vehicle_parking.exit_datetime - vehicle_parking.entry_datetime).total_seconds() for vehicle_parking in closed_parkings
+        ]
+        [totals] = self.analytics(start=(datetime.now(timezone.utc) - timedelta(days=1)).isoformat())
+        self.assertEqual(totals['revenue'], sum(vehicle_parking.total_charge for vehicle_parking in closed_parkings))
+        self.assertEqual(totals['parkings'], 6)
+        self.assertAlmostEqual(totals['average_duration'], sum(durations) / 6, places=3)
+        self.assertAlmostEqual(totals['occupancy_rate'], sum(durations) / (8 * 86400), places=6)
+
+        # the groups add up to the totals and the archived parkings are still counted
+        models.VehicleParking.objects.filter(vehicle='5').update(
+            entry_datetime=F('entry_datetime') - timedelta(days=100), exit_datetime=F('exit_datetime') - timedelta(days=100)
+        )
+        archive.archive_parkings(archive.archive_horizon())
+        groups = self.analytics(group_by=['mall_parking', 'parking_slot_size', 'entry_index'], start='2000-01-01T00:00:00Z')
+        self.assertEqual(sum(group['revenue'] for group in groups), totals['revenue'])
+        self.assertEqual(
+            [(group['parking_slot_size'], group['entry_index'], group['parkings']) for group in groups],
+            [
+                (size_pk, entry_index, 2)
+                for size_pk, entry_index in zip(
+                    models.ParkingSlotSize.objects.order_by('value').values_list('pk', flat=True), range(3)
+                )
+            ]
+        )
+
+    def test_time_groups(self):
+        [day] = self.analytics(group_by=['day'])
+        self.assertEqual(day['parkings'], 6)
+        hours = self.analytics(group_by=['hour'])
+        self.assertEqual(sum(hour['parkings'] for hour in hours), 6)
+        self.assertEqual(
+            self.client.get('/parking/mall_parking_slots/analytics', {'group_by': ['hour', 'day']}).status_code, 400
+        )
+
+    # random durations along with the durations at the flat rate and the exceed limits, with the charges of total_charge
+    def batch_fare_columns(self):
+        tariffs = [
+            fares.Tariff(self.mall_parking),
+            fares.Tariff(self.mall_parking, flat_rate=Decimal('12.5'), flatRate_duration=3600, exceed_rate=Decimal('0.3')),
+        ]
+        rng = random.Random(22)
+        parking_durations = [rng.uniform(0, 200000) for _ in range(2000)] + [0.0, 3600.0, 10800.0, 86400.0, 86399.999999]
+        slot_rates = [float(rng.choice([20, 60, 100, Decimal('33.3333333333')])) for _ in parking_durations]
+        is_fixed_starting_rates = [rng.random() < 0.7 for _ in parking_durations]
+        tariff_indexes = [rng.randrange(2) for _ in parking_durations]
+        charges = [
+            fares.total_charge(parking_duration, slot_rate, is_fixed_starting_rate, tariffs[tariff_index])
+            for parking_duration, slot_rate, is_fixed_starting_rate, tariff_index
+            in zip(parking_durations, slot_rates, is_fixed_starting_rates, tariff_indexes)
+        ]
+        return (parking_durations, slot_rates, is_fixed_starting_rates, tariffs, tariff_indexes), charges
+
+    def test_batch_fares_match_total_charge(self):
+        columns, charges = self.batch_fare_columns()
+        with mock.patch.object(fares, 'numpy', None):
+            self.assertEqual(fares.total_charges(*columns), charges)
+
+    @skipUnless(fares.numpy, 'numpy is not installed')
+    def test_vectorized_batch_fares_match_total_charge(self):
+        columns, charges = self.batch_fare_columns()
+        vectorized_charges = fares.total_charges(*columns)
+        self.assertIsInstance(vectorized_charges, fares.numpy.ndarray)
+        self.assertEqual(vectorized_charges.tolist(), charges)
+
+    @skipUnless(fares.numpy, 'numpy is not installed')
+    def test_vectorized_sums_by_index(self):
+        columns, charges = self.batch_fare_columns()
+        tariff_indexes = columns[4]
+        vectorized_sums = analytics._sums_by_index(fares.total_charges(*columns), tariff_indexes, 3)
+        with mock.patch.object(fares, 'numpy', None):
+            sums = analytics._sums_by_index(charges, tariff_indexes, 3)
+        self.assertEqual(vectorized_sums, sums)
+        self.assertEqual(sum(sums), sum(charges))
+        self.assertEqual(sums[2], 0)
+
+    def test_what_if_revenue(self):
+        def what_if(**data):
+            response = self.client.post('/parking/mall_parking_slots/analytics/what_if', data, format='json')
+            self.assertEqual(response.status_code, 200)
+            return response.data['results']
+
+        closed_parkings = list(models.VehicleParking.objects.exclude(exit_datetime=None).select_related('parking_slot'))
+        stored_revenue = sum(vehicle_parking.total_charge for vehicle_parking in closed_parkings)
+        [row] = what_if()
+        self.assertEqual(
+            (row['mall_parking'], row['parkings'], row['stored_revenue'], row['current_revenue'], row['what_if_revenue']),
+            (self.mall_parking.pk, 6, stored_revenue, stored_revenue, stored_revenue)
+        )
+
+        # the what-if tariffs, with one parking in the archive
+        small_pk = models.ParkingSlotSize.objects.get(name='SP').pk
+        archive.archive_parkings(datetime.now(timezone.utc) + timedelta(seconds=1), batch_size=4)
+        [row] = what_if(flat_rate='100', flatRate_duration=7200, slot_rates={str(small_pk): '25.5'})
+        tariff = fares.Tariff(self.mall_parking, flat_rate=Decimal(100), flatRate_duration=7200)
+        self.assertEqual(row['current_revenue'], stored_revenue)
+        self.assertEqual(row['what_if_revenue'], sum(
+            fares.total_charge(
+                fares.parking_duration(vehicle_parking.entry_datetime, vehicle_parking.exit_datetime),
+                Decimal('25.5') if vehicle_parking.parking_slot.parking_slot_size_id == small_pk else vehicle_parking.parking_slot.parking_slot_size.continuous_rate,
+                vehicle_parking.is_fixed_starting_rate,
+                tariff
+            )
+            for vehicle_parking in closed_parkings
+        ))
+
+        response = self.client.post('/parking/mall_parking_slots/analytics/what_if', {'slot_rates': {'9': '1'}}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+class OccupancyTests(ParkingTestCase):
+    def test_counters_follow_entries_and_exits(self):
+        mall_parking = self.create_mall([[1, 5, 9], [2, 4, 9], [3, 3, 9], [4, 2, 8]], [0, 0, 1, 2])
+        self.park('A', 0, 0)
+        self.park('B', 1, 1)
+        self.client.post('/parking/mall_parking_slots/entry/bulk', {'vehicles': [
+            {'plate_number': 'C', 'type': 0, 'entry_index': 0},
+            {'plate_number': 'D', 'type': 0, 'entry_index': 2},
+        ]}, format='json')
+        self.unpark('A')
+        self.client.patch('/parking/mall_parking_slots/exit/bulk', {'plate_numbers': ['D']}, format='json')
+
+        response = self.client.get('/parking/mall_parking_slots/occupancy/%d' % mall_parking.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_slots'], 4)
+        self.assertEqual(response.data['occupied_slots'], 2)
+        self.assertEqual(
+            [(size['name'], size['free_slots']) for size in response.data['parking_slot_sizes']],
+            [('SP', 1), ('MP', 1), ('LP', 0)]
+        )
+        self.assertEqual([entry['distance'] for entry in response.data['nearest_free_distances']], [1, 3, 9])
+        self.assertEqual(occupancy.reconcile(), [])
+
+    def test_nearest_free_distances_in_one_query(self):
+        mall_parking = self.create_mall([[i, 10 - i, 5, 7, 9 - i] for i in range(1, 9)], [0, 1] * 4, num_entries=5)
+        self.park('A', 0, 0)
+        # the counters and the nearest free slot of every entry
+        with self.assertNumQueries(2):
+            result = occupancy.mall_occupancy(mall_parking)
+        self.assertEqual([entry['distance'] for entry in result['nearest_free_distances']], [2, 2, 5, 7, 1])
+
+    def test_first_adjustments_of_a_counter_add_up(self):
+        mall_parking = self.create_mall([[1, 2, 3]], [0])
+        models.ParkingOccupancy.objects.all().delete()
+
+        # another transaction creates and updates the counter between the update and the creation of this one
+        get_or_create = models.ParkingOccupancy.objects.get_or_create
+        def concurrent_get_or_create(**kwargs):
+            models.ParkingOccupancy.objects.create(total_slots=1, occupied_slots=1, **kwargs)
+            return get_or_create(**kwargs)
+        with mock.patch.object(models.ParkingOccupancy.objects, 'get_or_create', side_effect=concurrent_get_or_create):
+            models.ParkingOccupancy.adjust(total_slots={(mall_parking.pk, 0): 2}, occupied_slots={(mall_parking.pk, 0): 1})
+        self.assertEqual(
+            list(models.ParkingOccupancy.objects.values_list('total_slots', 'occupied_slots')), [(3, 2)]
+        )
+
+    def test_reconcile_fixes_counters(self):
+        self.create_mall([[1, 2, 3], [2, 3, 4]], [0, 1])
+        self.park('A', 0, 0)
+        models.ParkingOccupancy.objects.update(occupied_slots=5)
+
+        self.assertEqual(len(occupancy.reconcile(fix=True)), 2)
+        self.assertEqual(occupancy.reconcile(), [])
+        self.assertEqual(sum(models.ParkingOccupancy.objects.values_list('occupied_slots', flat=True)), 1)
+
+    def test_deleted_slots_are_no_longer_counted(self):
+        mall_parking = self.create_mall([[1, 2, 3], [2, 3, 4], [3, 4, 5]], [0, 0, 1])
+        self.park('A', 0, 0)
+        self.parked_slot('A').delete()
+        models.ParkingSlot.objects.filter(mall_parking=mall_parking, parking_slot_size=1).get().delete()
+
+        self.assertEqual(
+            sorted(models.ParkingOccupancy.objects.values_list('parking_slot_size', 'total_slots', 'occupied_slots')),
+            [(0, 1, 0), (1, 0, 0)]
+        )
+        self.assertEqual(occupancy.reconcile(), [])
+
+        # the counters are deleted along with the mall before or after its slots
+        mall_parking.delete()
+        self.assertFalse(models.ParkingOccupancy.objects.exists())
+
+class ConfigCacheTests(ParkingTestCase):
+    def test_exit_reads_tariffs_from_cache(self):
+        mall_parking = self.create_mall([[1, 2, 3], [2, 3, 4]], [0, 1])
+        self.park('A', 0, 0)
+        self.park('B', 0, 0)
+        self.unpark('A')
+
+        hits = config_cache.stats()['hits']
+        response = self.unpark('B')
+        self.assertEqual(response.data['total_charge'], 40)
+        self.assertGreater(config_cache.stats()['hits'], hits)
+
+        # a tariff change is seen by the next exit
+        mall_parking.flat_rate = 50
+        mall_parking.save()
+        self.park('C', 0, 0)
+        self.assertEqual(self.unpark('C').data['total_charge'], 50)
+
+    def test_other_process_changes_are_seen_after_the_check_interval(self):
+        mall_parking = self.create_mall([[1, 2, 3]], [0])
+        self.assertEqual(config_cache.get_mall_parking(mall_parking.pk).flat_rate, 40)
+
+        # simulate another process changing the tariff without the signals of this process
+        models.MallParking.objects.filter(pk=mall_parking.pk).update(flat_rate=70)
+        config_cache._shared_cache().incr(config_cache_module.VERSION_KEY)
+        with override_settings(PARKING_CONFIG_CACHE_CHECK_INTERVAL=0):
+            self.assertEqual(config_cache.get_mall_parking(mall_parking.pk).flat_rate, 70)
+
+    def test_stats_endpoint(self):
+        response = self.client.get('/parking/mall_parking_slots/config_cache')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hit_rate', response.data)
+
+class IdempotencyTests(ParkingTestCase):
+    def request(self, method, url, data, key):
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retries_get_the_original_response(self):
+        self.create_mall([[1, 2, 3], [2, 3, 4]], [0, 1])
+        entry = {'plate_number': 'A', 'type': 0, 'entry_index': 0}
+        first = self.request('post', '/parking/mall_parking_slots/entry', entry, 'gate-1')
+        self.assertEqual(first.status_code, 201)
+
+        # the retry does not query the database
+        with self.assertNumQueries(0):
+            retry = self.request('post', '/parking/mall_parking_slots/entry', entry, 'gate-1')
+        self.assertEqual((retry.status_code, retry.data, retry['Idempotent-Replayed']), (201, first.data, 'true'))
+        self.assertEqual(models.VehicleParking.objects.count(), 1)
+
+        # a new key is a new request, and a key cannot be reused for another request
+        self.assertEqual(self.request('post', '/parking/mall_parking_slots/entry', entry, 'gate-2').status_code, 400)
+        self.assertEqual(self.request('post', '/parking/mall_parking_slots/entry', dict(entry, plate_number='B'), 'gate-1').status_code, 422)
+
+        exit = self.request('patch', '/parking/mall_parking_slots/exit', {'plate_number': 'A'}, 'gate-3')
+        self.assertEqual(exit.status_code, 200)
+        self.assertEqual(self.request('patch', '/parking/mall_parking_slots/exit', {'plate_number': 'A'}, 'gate-3').data, exit.data)
+
+        response = self.client.get('/parking/mall_parking_slots/idempotency_cache')
+        self.assertEqual((response.data['hits'], response.data['misses'], response.data['size']), (2, 3, 3))
+        self.assertIn('parking_idempotency_lookups_total{result="hit"}', self.client.get('/metrics').content.decode())
+
+    def test_async_retries_get_the_original_response(self):
+        self.create_mall([[1, 2, 3]], [0])
+
+        async def entry():
+            return await self.async_client.post(
+                '/parking/mall_parking_slots/async/entry', {'plate_number': 'A', 'type': 0, 'entry_index': 0},
+                content_type='application/json', headers={'Idempotency-Key': 'gate-1'}
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            first = async_to_sync(entry)()
+        retry = async_to_sync(entry)()
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.json(), first.json())
+
+    def test_expiry_and_eviction(self):
+        cache = idempotency.IdempotencyCache(max_size=2, ttl=10)
+        with mock.patch('parking.idempotency.time.monotonic', return_value=100):
+            for key in ['a', 'b']:
+                self.assertEqual(cache.begin(key, 'body'), (idempotency.NEW, None))
+                cache.finish(key, 201, {'key': key})
+            self.assertEqual(cache.begin('a', 'body'), (idempotency.REPLAY, (201, {'key': 'a'})))
+            # 'b' is the least recently used response
+            cache.begin('c', 'body')
+            self.assertEqual(cache.begin('b', 'body')[0], idempotency.NEW)
+            self.assertEqual(cache.begin('b', 'body')[0], idempotency.IN_PROGRESS)
+            cache.finish('b', 500, {})
+            # 'a' is evicted in turn to make room for 'b'
+            self.assertEqual(cache.begin('a', 'body')[0], idempotency.NEW)
+        with mock.patch('parking.idempotency.time.monotonic', return_value=111):
+            self.assertEqual(cache.begin('c', 'body')[0], idempotency.NEW)
+        self.assertEqual((cache.evictions, cache.expirations), (2, 1))
+
+class ProvisioningTests(ParkingTestCase):
+    def test_provisioned_slots_match_input(self):
+        rng = random.Random(11)
+        distances = [[rng.randint(1, 50) for _ in range(3)] for _ in range(25)]
+        sizes = [rng.randint(0, 2) for _ in range(25)]
+
+        # a small batch size makes the slots and the distances span several insert queries
+        with mock.patch.object(serializers.MallParkingSlotsSerializer, 'BATCH_SIZE', 7):
+            mall_parking = self.create_mall(distances, sizes)
+
+        parking_slots = list(models.ParkingSlot.objects.filter(mall_parking=mall_parking).order_by('pk'))
+        self.assertEqual([json.loads(parking_slot.distances) for parking_slot in parking_slots], distances)
+        self.assertEqual([parking_slot.parking_slot_size_id for parking_slot in parking_slots], sizes)
+        for parking_slot in parking_slots:
+            self.assertEqual(
+                list(parking_slot.slot_distances.order_by('entry_index').values_list('distance', 'size_value')),
+                [(distance, parking_slot.parking_slot_size.value) for distance in json.loads(parking_slot.distances)]
+            )
+        self.assertEqual(occupancy.reconcile(), [])
+
+        # the provisioned slots are available to the allocator
+        self.assertEqual(self.park('A', 0, 0).status_code, 201)
+        self.assertEqual(json.loads(self.parked_slot('A').distances)[0], min(distance[0] for distance in distances))
+
+    def test_rankings_merge_provisioned_slots(self):
+        rng = random.Random(12)
+        mall_parking = self.create_mall([[rng.randint(1, 20) for _ in range(3)] for _ in range(10)], [0, 1, 2] * 3 + [1])
+        parking_slot_sizes = list(models.ParkingSlotSize.objects.order_by('pk'))
+        models.ParkingSlot.provision(mall_parking, [
+            (parking_slot_sizes[rng.randint(0, 2)], [rng.randint(1, 20) for _ in range(3)]) for _ in range(10)
+        ], rank=True)
+
+        # the slots merged from memory are ranked as if the rankings were built from the database
+        merged = {
+            ranking.entry_index: (ranking.version, models.ParkingSlotRanking.unpack(ranking.slots))
+            for ranking in models.ParkingSlotRanking.objects.filter(mall_parking=mall_parking)
+        }
+        models.ParkingSlotRanking.rebuild(mall_parking.pk)
+        for ranking in models.ParkingSlotRanking.objects.filter(mall_parking=mall_parking):
+            version, records = merged[ranking.entry_index]
+            self.assertEqual(records, models.ParkingSlotRanking.unpack(ranking.slots))
+            self.assertEqual(len(records), 20)
+            self.assertEqual(ranking.version, version + 1)
+
+    def test_benchmark_fails_over_target(self):
+        # the test database already isolates the benchmark
+        self.enterContext(mock.patch.object(benchmarking, 'isolated_database', contextlib.nullcontext))
+        out = StringIO()
+        call_command('benchmark_provisioning', '--slots', '50', '--max-seconds', '60', stdout=out)
+        self.assertIn('target: 60.00s', out.getvalue())
+        with self.assertRaisesMessage(CommandError, 'over the target'):
+            call_command('benchmark_provisioning', '--slots', '50', '--max-seconds', '0', stdout=StringIO())
+
+    def test_unknown_size_creates_nothing(self):
+        response = self.client.post('/parking/mall_parking_slots/', {
+            'mall_parking': {'name': 'Mall', 'num_entries': 3},
+            'parking_slot_distance_list': [[1, 2, 3], [4, 5, 6]],
+            'parking_slot_size_list': [0, 9]
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.MallParking.objects.exists())
+        self.assertFalse(models.ParkingSlot.objects.exists())
+
+class LayoutImportTests(ParkingTestCase):
+    def write_layout(self, content, suffix='.csv'):
+        layout_file = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False)
+        layout_file.write(content)
+        layout_file.close()
+        self.addCleanup(os.remove, layout_file.name)
+        return layout_file.name
+
+    def imported_slots(self, mall_parking_id):
+        return [
+            (parking_slot.parking_slot_size_id, json.loads(parking_slot.distances))
+            for parking_slot in models.ParkingSlot.objects.filter(mall_parking_id=mall_parking_id).order_by('pk')
+        ]
+
+    def test_import_command_in_batches(self):
+        path = self.write_layout('size,entry_1,entry_2,entry_3\n0,1,2,3\n1,4,5,6\n\n2,7,8,9\n')
+        out = StringIO()
+        call_command('import_layout', path, '--name', 'Mall', '--batch-size', '2', stdout=out)
+
+        layout_import = models.LayoutImport.objects.get()
+        self.assertEqual(layout_import.status, 'completed')
+        self.assertEqual(layout_import.rows_imported, 3)
+        self.assertIn('Imported 2 rows.', out.getvalue())
+        self.assertEqual(self.imported_slots(layout_import.mall_parking_id), [(0, [1, 2, 3]), (1, [4, 5, 6]), (2, [7, 8, 9])])
+        self.assertEqual(models.ParkingSlotDistance.objects.count(), 9)
+        self.assertEqual(occupancy.reconcile(), [])
+
+    def test_rankings_are_built_once_per_import(self):
+        path = self.write_layout('\n'.join('%d,%d,%d,%d' % (i % 3, i, 30 - i, i % 5) for i in range(30)))
+
+        # the queries on the rankings do not depend on the number of batches
+        ranking_queries = []
+        for batch_size in ['30', '3']:
+            with CaptureQueriesContext(connection) as queries:
+                call_command('import_layout', path, '--name', 'Mall ' + batch_size, '--batch-size', batch_size, stdout=StringIO())
+            ranking_queries.append(sum('parkingslotranking' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(ranking_queries[0], ranking_queries[1])
+
+        mall_parking_id = models.LayoutImport.objects.latest('pk').mall_parking_id
+        self.assertEqual(
+            [record[2] for record in models.ParkingSlotRanking.unpack(
+                models.ParkingSlotRanking.objects.get(mall_parking_id=mall_parking_id, entry_index=0).slots
+            )],
+            list(models.ParkingSlot.objects.filter(mall_parking_id=mall_parking_id).order_by('pk').values_list('pk', flat=True))
+        )
+
+    def test_failed_import_resumes_from_checkpoint(self):
+        rows = ['0,1,2,3', '1,4,5,6', '2,7,8,9', '0,1,2', '1,3,3,3']
+        path = self.write_layout('\n'.join(rows))
+        mall_parking = self.create_mall([[9, 9, 9]], [2])
+
+        with self.assertRaisesMessage(CommandError, 'Line 4: expected 3 distances, got 2.'):
+            call_command('import_layout', path, '--mall-parking', str(mall_parking.pk), '--batch-size', '2', stdout=StringIO())
+        layout_import = models.LayoutImport.objects.get()
+        self.assertEqual(layout_import.status, 'failed')
+        self.assertEqual(layout_import.rows_imported, 2)
+
+        # the rows that were already imported are skipped when resuming with the fixed file
+        rows[3] = '0,1,2,4'
+        with open(path, 'w') as layout_file:
+            layout_file.write('\n'.join(rows))
+        call_command('import_layout', path, '--resume', str(layout_import.pk), '--batch-size', '2', stdout=StringIO())
+
+        layout_import.refresh_from_db()
+        self.assertEqual(layout_import.status, 'completed')
+        self.assertEqual(layout_import.rows_imported, 5)
+        self.assertEqual(
+            self.imported_slots(mall_parking.pk),
+            [(2, [9, 9, 9]), (0, [1, 2, 3]), (1, [4, 5, 6]), (2, [7, 8, 9]), (0, [1, 2, 4]), (1, [3, 3, 3])]
+        )
+        self.assertEqual(occupancy.reconcile(), [])
+
+    def test_upload_endpoint(self):
+        content = '{"size": 0, "distances": [1, 2, 3]}\n{"size": 1, "distances": [3, 2, 1]}\n'
+        response = self.client.post('/parking/mall_parking_slots/imports', {
+            'file': SimpleUploadedFile('layout.ndjson', content.encode()),
+            'name': 'Mall'
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['rows_imported'], 2)
+        self.assertEqual(self.imported_slots(response.data['mall_parking']), [(0, [1, 2, 3]), (1, [3, 2, 1])])
+
+        # the allocator sees the imported slots
+        self.assertEqual(self.park('A', 1, 2).status_code, 201)
+        self.assertEqual(json.loads(self.parked_slot('A').distances), [3, 2, 1])
+
+        response = self.client.post('/parking/mall_parking_slots/imports', {
+            'file': SimpleUploadedFile('layout.ndjson', b'{"size": 7, "distances": [1, 2, 3]}\n'),
+            'mall_parking': response.data['mall_parking']
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Line 1: unknown parking slot size 7.')
+
+        response = self.client.get('/parking/mall_parking_slots/imports/%d' % response.data['id'])
+        self.assertEqual(response.data['status'], 'failed')
+
+class BenchmarkTests(ParkingTestCase):
+    def test_suite_runs_on_a_small_mall(self):
+        results = benchmarking.run_suite(self.client, random.Random(0), num_slots=20, num_entries=3, num_history=30, num_requests=5)
+        self.assertEqual(set(results), {'mall_creation', 'entry', 'exit', 'history_list', 'analytics'})
+        self.assertEqual(results['analytics']['queries_max'], 3)
+        self.assertEqual(results['entry']['count'], 5)
+        self.assertEqual(results['history_list']['queries_max'], 2) # the parkings and the archived parkings
+        self.assertEqual(models.VehicleParking.objects.filter(exit_datetime__isnull=False).count(), 35)
+
+    def test_compare_flags_regressions(self):
+        def report(p95_ms, queries_max):
+            return {'results': {'1000x3': {'entry': {'p95_ms': p95_ms, 'queries_max': queries_max}}}}
+
+        self.assertEqual(benchmarking.compare(report(10, 5), report(11.5, 5)), [])
+        self.assertEqual(benchmarking.compare(report(0.5, 5), report(1.2, 5)), []) # below the noise floor
+        self.assertEqual(len(benchmarking.compare(report(10, 5), report(13, 5))), 1)
+        self.assertEqual(benchmarking.compare(report(10, 5), report(10, 6)), ['1000x3 entry: queries per request 5 -> 6'])
+        self.assertEqual(benchmarking.compare({'results': {}}, report(10, 5)), [])
+
+    def test_compare_ignores_noise_between_identical_runs(self):
+        def report(p95_runs_ms):
+            runs = [{'entry': {'count': 5, 'p50_ms': p95_ms / 2, 'p95_ms': p95_ms, 'p99_ms': p95_ms, 'max_ms': p95_ms,
+                               'queries_mean': 5, 'queries_max': 5}} for p95_ms in p95_runs_ms]
+            return {'results': {'1000x3': benchmarking.combine_runs(runs)}}
+
+        baseline = report([10.1, 12.0, 9.8, 10.4, 10.0])
+        self.assertEqual(baseline['results']['1000x3']['entry']['p95_ms'], 10.1)
+        self.assertEqual(baseline['results']['1000x3']['entry']['count'], 25)
+        # a rerun of the same code with a slow run, which alone would be a +37% regression
+        self.assertEqual(benchmarking.compare(baseline, report([10.3, 13.7, 9.9, 10.2, 10.6])), [])
+        # a slow p95 of a single run is not a regression against a spread out baseline either
+        self.assertEqual(benchmarking.compare(baseline, {'results': {'1000x3': {'entry': {'p95_ms': 11.9, 'queries_max': 5}}}}), [])
+        # every run is slower
+        self.assertEqual(benchmarking.compare(baseline, report([13.5, 14.0, 12.8, 13.1, 15.0])), [
+            '1000x3 entry: p95 latency 10.10ms -> 13.50ms (+34%, 5 runs)'
+        ])
+
+class MetricsTests(ParkingTestCase):
+    def test_server_timing_and_metrics(self):
+        self.create_mall([[1, 2, 3]], [0], num_entries=3)
+        entries = metrics.ENTRIES.value()
+        failures = metrics.ALLOCATION_FAILURES.value()
+        route = '/parking/mall_parking_slots/entry'
+        requests = metrics.REQUEST_DURATION.count(method='POST', route=route, status=201)
+
+        response = self.park('A', 0, 0)
+        self.assertEqual(response.status_code, 201)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[0-9.]+;desc="\d+ queries", serializer;dur=[0-9.]+, allocator;dur=[0-9.]+, total;dur=[0-9.]+$')
+        self.assertEqual(self.park('B', 0, 0).status_code, 400)
+
+        self.assertEqual(metrics.ENTRIES.value(), entries + 1)
+        self.assertEqual(metrics.ALLOCATION_FAILURES.value(), failures + 1)
+        self.assertEqual(metrics.REQUEST_DURATION.count(method='POST', route=route, status=201), requests + 1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode()
+        self.assertIn('# TYPE parking_http_request_duration_seconds histogram', content)
+        self.assertIn('parking_http_request_duration_seconds_bucket{method="POST",route="%s",status="201",le="+Inf"}' % route, content)
+        self.assertIn('parking_entries_total %d' % (entries + 1), content)
+        self.assertIn('parking_slots_occupied{mall_parking="%d",parking_slot_size="SP"} 1' % models.MallParking.objects.get().pk, content)
+
+class AsyncEndpointTests(ParkingTestCase):
+    DISTANCES = [[1, 5, 9], [2, 4, 9], [3, 3, 9], [4, 2, 8], [4, 2, 8], [6, 6, 1]]
+    SIZES = [0, 0, 1, 2, 1, 0]
+    VEHICLES = [('A', 0, 0), ('B', 1, 1), ('C', 0, 1), ('D', 2, 2), ('E', 0, 2), ('F', 1, 0), ('G', 0, 0)]
+
+    # parks and unparks the vehicles through the given endpoints and returns what the responses and the database look like
+    def run_flow(self, entry_url, exit_url):
+        mall_parking = self.create_mall(self.DISTANCES, self.SIZES)
+        slots = list(models.ParkingSlot.objects.filter(mall_parking=mall_parking).order_by('pk').values_list('pk', flat=True))
+
+        outcome = []
+        for plate_number, vehicle_type, entry_index in self.VEHICLES:
+            response = self.post_json(entry_url, {'plate_number': plate_number, 'type': vehicle_type, 'entry_index': entry_index})
+            parking_slot = models.ParkingSlot.objects.filter(vehicle_parking__vehicle__pk=plate_number).first()
+            outcome.append((response.status_code, response.json(), parking_slot and slots.index(parking_slot.pk)))
+        outcome.append(self.post_json(entry_url, {'plate_number': 'A', 'type': 0, 'entry_index': 0}).json())
+
+        for plate_number in ['B', 'D', 'Z']:
+            response = self.patch_json(exit_url, {'plate_number': plate_number})
+            content = response.json()
+            if response.status_code == 200:
+                content = (content['is_fixed_starting_rate'], content['total_charge'], content['parking_slot']['id'] - slots[0])
+            outcome.append((response.status_code, content))
+
+        # start over with the same layout
+        models.MallParking.objects.all().delete()
+        models.Vehicle.objects.all().delete()
+        allocator.get_allocator().reset()
+        return outcome
+
+    def post_json(self, url, data):
+        return self.request_json('post', url, data)
+
+    def patch_json(self, url, data):
+        return self.request_json('patch', url, data)
+
+    def request_json(self, method, url, data):
+        async def async_request():
+            return await getattr(self.async_client, method)(url, data, content_type='application/json')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            if url.startswith('/parking/mall_parking_slots/async/'):
+                return async_to_sync(async_request)()
+            return getattr(self.client, method)(url, data, format='json')
+
+    def test_async_endpoints_match_sync_endpoints(self):
+        for allocator_path in ['parking.allocator.DistanceTableSlotAllocator', 'parking.allocator.HeapSlotAllocator']:
+            with self.settings(PARKING_SLOT_ALLOCATOR=allocator_path):
+                sync_outcome = self.run_flow('/parking/mall_parking_slots/entry', '/parking/mall_parking_slots/exit')
+                async_outcome = self.run_flow('/parking/mall_parking_slots/async/entry', '/parking/mall_parking_slots/async/exit')
+            self.assertEqual(async_outcome, sync_outcome)
+            self.assertEqual(sum(1 for item in sync_outcome[:7] if item[0] == 201), 6)
+
+    def test_async_entry_is_instrumented(self):
+        self.create_mall([[1, 2, 3]], [0])
+        response = self.post_json('/parking/mall_parking_slots/async/entry', {'plate_number': 'A', 'type': 0, 'entry_index': 0})
+        self.assertEqual(response.status_code, 201)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[0-9.]+;desc="[1-9]\d* queries", serializer;dur=[0-9.]+, allocator;dur=')
+
+class MallScopedEntryTests(ParkingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mall_a = self.create_mall([[5, 5, 5], [6, 6, 6]], [0, 1])
+        self.mall_b = self.create_mall([[1, 1, 1], [2, 2, 2]], [0, 2])
+
+    def park_in(self, mall_parking, plate_number, vehicle_type, entry_index):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/parking/mall_parking_slots/entry', {
+                'entry_index': entry_index,
+                'plate_number': plate_number,
+                'type': vehicle_type,
+                'mall_parking': mall_parking.pk
+            }, format='json')
+
+    def assert_scoped_allocation(self):
+        # the nearest slots are in the other mall
+        self.assertEqual(self.park_in(self.mall_a, 'A', 0, 0).status_code, 201)
+        self.assertEqual(self.parked_slot('A').mall_parking, self.mall_a)
+        self.assertEqual(self.park_in(self.mall_a, 'B', 0, 1).status_code, 201)
+        self.assertEqual(self.parked_slot('B').mall_parking, self.mall_a)
+        self.assertEqual(self.park_in(self.mall_a, 'C', 0, 2).status_code, 400)
+
+        self.assertEqual(self.park_in(self.mall_b, 'C', 2, 0).status_code, 201)
+        self.assertEqual(self.parked_slot('C').get_distances(), [2, 2, 2])
+        self.unpark('A')
+        self.assertEqual(self.park_in(self.mall_a, 'D', 0, 0).status_code, 201)
+        self.assertEqual(self.parked_slot('D').get_distances(), [5, 5, 5])
+
+        # entries without a mall parking can still be given a slot of any mall
+        self.assertEqual(self.park('E', 0, 0).status_code, 201)
+        self.assertEqual(self.parked_slot('E').get_distances(), [1, 1, 1])
+
+    def test_distance_table_allocator(self):
+        self.assert_scoped_allocation()
+
+    @override_settings(PARKING_SLOT_ALLOCATOR='parking.allocator.HeapSlotAllocator')
+    def test_heap_allocator(self):
+        self.assert_scoped_allocation()
+
+    @override_settings(PARKING_SLOT_ALLOCATOR='parking.allocator.ScanSlotAllocator')
+    def test_scan_allocator(self):
+        self.assert_scoped_allocation()
+
+    def test_heap_allocator_only_loads_the_mall_of_the_entry(self):
+        heap_allocator = allocator.HeapSlotAllocator()
+        parking_slot = heap_allocator.allocate(0, 0, mall_parking_id=self.mall_a.pk)
+        self.assertEqual(parking_slot.mall_parking, self.mall_a)
+        self.assertEqual(list(heap_allocator._malls), [self.mall_a.pk])
+
+    def test_invalid_mall_parking(self):
+        response = self.client.post('/parking/mall_parking_slots/entry', {
+            'entry_index': 3, 'plate_number': 'A', 'type': 0, 'mall_parking': self.mall_a.pk
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['non_field_errors'], ['The mall parking only has 3 entries.'])
+
+        response = self.client.post('/parking/mall_parking_slots/entry', {
+            'entry_index': 0, 'plate_number': 'A', 'type': 0, 'mall_parking': 999
+        }, format='json')
+        self.assertEqual(response.data['non_field_errors'], ['Unknown mall parking.'])
+
+    def test_bulk_entry(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/parking/mall_parking_slots/entry/bulk', {'vehicles': [
+                {'plate_number': 'A', 'type': 0, 'entry_index': 0, 'mall_parking': self.mall_a.pk},
+                {'plate_number': 'B', 'type': 1, 'entry_index': 0, 'mall_parking': self.mall_a.pk},
+                {'plate_number': 'C', 'type': 0, 'entry_index': 0, 'mall_parking': self.mall_a.pk},
+                {'plate_number': 'D', 'type': 0, 'entry_index': 0, 'mall_parking': 999},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(self.parked_slot('A').get_distances(), [5, 5, 5])
+        self.assertEqual(self.parked_slot('B').get_distances(), [6, 6, 6])
+        self.assertEqual(response.data[2]['errors'], ['No available parking slots.'])
+        self.assertEqual(response.data[3]['errors'], {'non_field_errors': ['Unknown mall parking.']})
+
+class DatabaseProfileTests(TestCase):
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            pragmas = [cursor.execute('PRAGMA %s' % name).fetchone()[0] for name in ['journal_mode', 'synchronous', 'busy_timeout']]
+        self.assertEqual(pragmas, ['wal', 1, db_profiles.SQLITE_BUSY_TIMEOUT * 1000])
+
+    def test_profiles(self):
+        postgres = db_profiles.database('postgres', Path('/app'), {'POSTGRES_HOST': 'db', 'PARKING_CONN_MAX_AGE': '30'})
+        self.assertEqual(
+            (postgres['ENGINE'], postgres['HOST'], postgres['CONN_MAX_AGE'], postgres['CONN_HEALTH_CHECKS']),
+            ('django.db.backends.postgresql', 'db', 30, True)
+        )
+        basic = db_profiles.database('sqlite-basic', Path('/app'), {'PARKING_DATABASE_NAME': '/tmp/parking.sqlite3'})
+        self.assertEqual(basic['NAME'], '/tmp/parking.sqlite3')
+        self.assertNotIn('OPTIONS', basic)
+        with self.assertRaises(ValueError):
+            db_profiles.database('mysql', Path('/app'), {})
+
+class ConcurrentEntryTests(TransactionTestCase):
+    fixtures = ['parking_sizes']
+
+    def setUp(self):
+        allocator.get_allocator().reset()
+        config_cache.invalidate()
+
+    def test_concurrent_entries_never_share_a_slot(self):
+        num_slots = 20
+        num_vehicles = 60
+        APIClient().post('/parking/mall_parking_slots/', {
+            'mall_parking': {'name': 'Mall', 'num_entries': 3},
+            'parking_slot_distance_list': [[i % 4, i % 3, i % 2] for i in range(num_slots)],
+            'parking_slot_size_list': [2] * num_slots
+        }, format='json')
+
+        barrier = threading.Barrier(num_vehicles)
+        status_codes = []
+
+        def enter(plate_number):
+            try:
+                client = APIClient()
+                barrier.wait()
+                response = client.post('/parking/mall_parking_slots/entry', {
+                    'entry_index': 0,
+                    'plate_number': plate_number,
+                    'type': 0
+                }, format='json')
+                status_codes.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=enter, args=(str(i),)) for i in range(num_vehicles)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(status_codes.count(201), num_slots)
+        self.assertEqual(status_codes.count(400), num_vehicles - num_slots)
+
+        # every parking refers to a different slot and every slot refers back to its parking
+        vehicle_parkings = models.VehicleParking.objects.all()
+        self.assertEqual(len(vehicle_parkings), num_slots)
+        self.assertEqual(len({vehicle_parking.parking_slot_id for vehicle_parking in vehicle_parkings}), num_slots)
+        for vehicle_parking in vehicle_parkings:
+            self.assertEqual(vehicle_parking.parking_slot.vehicle_parking_id, vehicle_parking.pk)
+
+    @skipUnless(connection.vendor == 'sqlite', 'the write lock of SQLite')
+    def test_read_only_transactions_do_not_wait_for_writers(self):
+        APIClient().post('/parking/mall_parking_slots/', {
+            'mall_parking': {'name': 'Mall', 'num_entries': 3},
+            'parking_slot_distance_list': [[1, 2, 3]],
+            'parking_slot_size_list': [0]
+        }, format='json')
+
+        # another connection holds the write lock
+        writer = sqlite3.connect(connection.settings_dict['NAME'])
+        writer.execute('BEGIN IMMEDIATE')
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(occupancy.reconcile(), [])
+                self.assertEqual(journal.verify(journal.replay()), [])
+        finally:
+            writer.rollback()
+            writer.close()
+        self.assertEqual([query['sql'] for query in queries if query['sql'].startswith('BEGIN')], ['BEGIN', 'BEGIN'])
+
+        with CaptureQueriesContext(connection) as queries:
+            occupancy.reconcile(fix=True)
+        self.assertEqual([query['sql'] for query in queries if query['sql'].startswith('BEGIN')], ['BEGIN IMMEDIATE'])
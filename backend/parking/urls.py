@@ -1,6 +1,7 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import include, path, re_path
 
+from . import async_views
 from . import views
 
 router = DefaultRouter()
@@ -17,7 +18,19 @@ router.register(r'mall_parking_slots', views.MallParkingSlotsViewSet)
 urlpatterns = [
     path('mall_parking_slots/view', views.VehicleParkingViewSet.as_view({'get': 'list'})),
     path('mall_parking_slots/view/<int:pk>', views.VehicleParkingViewSet.as_view({'get': 'retrieve'})),
+    path('mall_parking_slots/occupancy/<int:pk>', views.MallParkingOccupancyViewSet.as_view({'get': 'retrieve'})),
+    path('mall_parking_slots/config_cache', views.ConfigCacheStatsViewSet.as_view({'get': 'list'})),
+    path('mall_parking_slots/idempotency_cache', views.IdempotencyCacheStatsViewSet.as_view({'get': 'list'})),
+    path('mall_parking_slots/imports', views.LayoutImportViewSet.as_view({'post': 'create'})),
+    path('mall_parking_slots/imports/<int:pk>', views.LayoutImportViewSet.as_view({'get': 'retrieve'})),
+    path('mall_parking_slots/export', views.VehicleParkingExportViewSet.as_view({'get': 'list'})),
+    path('mall_parking_slots/analytics', views.AnalyticsViewSet.as_view({'get': 'list'})),
+    path('mall_parking_slots/analytics/what_if', views.WhatIfViewSet.as_view({'post': 'create'})),
     path('mall_parking_slots/entry', views.VehicleParkingEntryViewSet.as_view({'post': 'create'})),
+    path('mall_parking_slots/entry/bulk', views.VehicleParkingBulkEntryViewSet.as_view({'post': 'create'})),
+    path('mall_parking_slots/async/entry', async_views.vehicle_entry),
+    path('mall_parking_slots/async/exit', async_views.vehicle_exit),
     path('mall_parking_slots/exit', views.VehicleParkingViewSet.as_view({'patch': 'partial_update'})),
+    path('mall_parking_slots/exit/bulk', views.VehicleParkingBulkExitViewSet.as_view({'patch': 'partial_update'})),
     re_path(r'', include(router.urls))
 ]
\ No newline at end of file
@@ -1,10 +1,18 @@
 from drf_yasg.utils import swagger_auto_schema
+from django.http import Http404, StreamingHttpResponse
 from django.utils.decorators import method_decorator
-from rest_framework import viewsets, mixins, status, generics
+from rest_framework import viewsets, mixins, parsers, status, generics
 from rest_framework.response import Response
 
+from . import analytics
+from . import archive
+from . import exports
+from . import idempotency
 from . import models
+from . import occupancy
+from . import pagination
 from . import serializers
+from .config_cache import config_cache
 
 # Base view set for table attributes containing the create, read and update actions but not delete.
 class BaseViewSet(viewsets.GenericViewSet, 
@@ -42,7 +50,8 @@ class ParkingSlotSizeViewSet(BaseViewSet):
     serializer_class = serializers.ParkingSlotSizeSerializer
 
 class ParkingSlotViewSet(BaseViewSet):
-    queryset = models.ParkingSlot.objects.all()
+    # the nested mall parking and parking slot size are loaded in the same query
+    queryset = models.ParkingSlot.objects.select_related('mall_parking', 'parking_slot_size')
     serializer_class = serializers.ParkingSlotSerializer
 
 @method_decorator(name='partial_update', decorator=swagger_auto_schema(
@@ -55,9 +64,31 @@ class VehicleParkingViewSet(viewsets.GenericViewSet,
     mixins.RetrieveModelMixin,
     mixins.UpdateModelMixin
 ):
-    queryset = models.VehicleParking.objects.all()
+    # the nested parking slot and vehicle are loaded in the same query, and the charges are stored on the parking
+    queryset = models.VehicleParking.objects.select_related(
+        'parking_slot__mall_parking',
+        'parking_slot__parking_slot_size',
+        'vehicle'
+    )
     serializer_class = serializers.VehicleParkingSerializer
+    pagination_class = pagination.VehicleParkingCursorPagination
+
+    # the history also shows the archived parkings
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return archive.ParkingHistory(queryset, models.ArchivedVehicleParking.objects.all())
+        return queryset
 
+    def get_object(self):
+        try:
+            vehicle_parking = archive.get_vehicle_parking(self.get_queryset(), self.kwargs['pk'])
+        except models.VehicleParking.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(self.request, vehicle_parking)
+        return vehicle_parking
+
+    @idempotency.idempotent
     def update(self, request, *args, **kwargs):
         # Get the parking slot for the vehicle. We expect there to be only one parking slot containing the vehicle.
         parking_slot_queryset = models.ParkingSlot.objects.filter(vehicle_parking__vehicle__pk=request.data['plate_number'])
@@ -68,18 +99,167 @@ class VehicleParkingViewSet(viewsets.GenericViewSet,
 
         serializer = self.serializer_class(instance=vehicle_parking, data=request.data)
         if serializer.is_valid():
-            content = serializer.save()
-            return Response(content, status=status.HTTP_200_OK)
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_200_OK)
         else:
             content = serializer.errors
             return Response(content, status=status.HTTP_400_BAD_REQUEST)
 
+@method_decorator(name='partial_update', decorator=swagger_auto_schema(
+    operation_description="""Bulk unpark function for the application. 
+    This takes in a list of plate numbers, and every vehicle that is parked inside a parking slot exits the parking space in one transaction. 
+    The response contains the parking fees of every vehicle, and an error for the plate numbers that are not parked.""",
+))
+class VehicleParkingBulkExitViewSet(viewsets.GenericViewSet):
+    queryset = models.VehicleParking.objects.all()
+    serializer_class = serializers.VehicleParkingBulkExitSerializer
+
+    def partial_update(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+
+        # respond with multi-status when some of the vehicles are not parked
+        if any('errors' in result for result in results):
+            return Response(results, status=status.HTTP_207_MULTI_STATUS)
+        return Response(results, status=status.HTTP_200_OK)
+
+@method_decorator(name='list', decorator=swagger_auto_schema(
+    operation_description="""Parking history export function. 
+    This streams the parkings that entered between the start (inclusive) and the end (exclusive) datetimes as newline delimited JSON or CSV, 
+    optionally only for the parking slots of one mall. The rows are ordered by their entry datetime.""",
+    query_serializer=serializers.VehicleParkingExportSerializer,
+))
+class VehicleParkingExportViewSet(viewsets.GenericViewSet):
+    queryset = models.VehicleParking.objects.all()
+    serializer_class = serializers.VehicleParkingExportSerializer
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        rows = exports.history_rows(start=params.get('start'), end=params.get('end'), mall_parking=params.get('mall_parking'))
+        if params['file_format'] == 'csv':
+            response = StreamingHttpResponse(exports.csv_stream(rows), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="vehicle_parkings.csv"'
+        else:
+            response = StreamingHttpResponse(exports.ndjson_stream(rows), content_type='application/x-ndjson')
+        return response
+
+@method_decorator(name='list', decorator=swagger_auto_schema(
+    operation_description="""Revenue and utilization analytics. 
+    This returns the revenue, the number of parkings, the average duration in seconds and the occupancy rate of the parkings that exited between 
+    the start (inclusive) and the end (exclusive) datetimes, the last 30 days by default, grouped by any of the hour or the day of the exit, the mall, 
+    the parking slot size and the entry index. The values are aggregated by the database from the charges stored at exit.""",
+    query_serializer=serializers.AnalyticsSerializer,
+))
+class AnalyticsViewSet(viewsets.GenericViewSet):
+    queryset = models.VehicleParking.objects.all()
+    serializer_class = serializers.AnalyticsSerializer
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        rows = analytics.revenue_and_utilization(
+            params['start'], params['end'], group_by=params['group_by'], mall_parking=params.get('mall_parking')
+        )
+        return Response({'start': params['start'], 'end': params['end'], 'results': rows}, status=status.HTTP_200_OK)
+
+@method_decorator(name='create', decorator=swagger_auto_schema(
+    operation_description="""What-if tariff simulation. 
+    This re-rates the parkings that exited between the start (inclusive) and the end (exclusive) datetimes, the last 30 days by default, 
+    with the given flat rate, exceed rate, flat rate duration, exceed duration and continuous rates of the parking slot sizes, the current 
+    values being used for the ones that are not given. It returns the revenue of every mall at the stored charges, at the current tariffs and 
+    at the what-if tariffs. The fixed starting rates stored at exit are kept.""",
+))
+class WhatIfViewSet(viewsets.GenericViewSet):
+    queryset = models.VehicleParking.objects.all()
+    serializer_class = serializers.WhatIfSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        rows = analytics.what_if_revenue(
+            params['start'], params['end'], mall_parking=params.get('mall_parking'),
+            tariff=params['tariff'], slot_rates=params['slot_rates']
+        )
+        return Response({'start': params['start'], 'end': params['end'], 'results': rows}, status=status.HTTP_200_OK)
+
+@method_decorator(name='retrieve', decorator=swagger_auto_schema(
+    operation_description="""Occupancy function for display boards. 
+    This returns the number of slots and occupied slots of every parking slot size of the mall, along with the distance of the nearest 
+    free slot from every entry of the mall.""",
+))
+class MallParkingOccupancyViewSet(viewsets.GenericViewSet,
+    mixins.RetrieveModelMixin
+):
+    queryset = models.MallParking.objects.all()
+    serializer_class = serializers.MallParkingSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(occupancy.mall_occupancy(self.get_object()), status=status.HTTP_200_OK)
+
+@method_decorator(name='list', decorator=swagger_auto_schema(
+    operation_description="""Statistics of the mall parking and parking slot size configuration cache of the process handling the request, 
+    with the number of hits, misses and invalidations.""",
+))
+class ConfigCacheStatsViewSet(viewsets.GenericViewSet):
+    queryset = models.MallParking.objects.all()
+    serializer_class = serializers.MallParkingSerializer
+
+    def list(self, request, *args, **kwargs):
+        return Response(config_cache.stats(), status=status.HTTP_200_OK)
+
+@method_decorator(name='list', decorator=swagger_auto_schema(
+    operation_description="""Statistics of the idempotency key cache of the process handling the request, with the number of cached responses, 
+    the hits of the retried entries and exits, the misses, the hit rate, and the evicted and expired responses.""",
+))
+class IdempotencyCacheStatsViewSet(viewsets.GenericViewSet):
+    queryset = models.VehicleParking.objects.all()
+    serializer_class = serializers.VehicleParkingSerializer
+
+    def list(self, request, *args, **kwargs):
+        return Response(idempotency.idempotency_cache.stats(), status=status.HTTP_200_OK)
+
+@method_decorator(name='create', decorator=swagger_auto_schema(
+    operation_description="""Layout import function. 
+    This takes in a CSV or NDJSON file with one parking slot per line, with the parking slot size and the distance from every entry, and adds the slots to 
+    an existing mall or to a new mall. The file is read and inserted in batches, and an import that failed can be resumed by uploading the fixed file 
+    with the layout import.""",
+    request_body=serializers.LayoutImportUploadSerializer,
+))
+@method_decorator(name='retrieve', decorator=swagger_auto_schema(
+    operation_description="""Progress of a layout import, with the number of imported rows and the error of a failed import.""",
+))
+class LayoutImportViewSet(viewsets.GenericViewSet,
+    mixins.RetrieveModelMixin
+):
+    queryset = models.LayoutImport.objects.all()
+    serializer_class = serializers.LayoutImportSerializer
+    parser_classes = [parsers.MultiPartParser]
+
+    def create(self, request, *args, **kwargs):
+        serializer = serializers.LayoutImportUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        layout_import = serializer.save()
+
+        content = serializers.LayoutImportSerializer(layout_import).data
+        if layout_import.status == models.LayoutImport.Status.COMPLETED:
+            return Response(content, status=status.HTTP_201_CREATED)
+        return Response(content, status=status.HTTP_400_BAD_REQUEST)
+
 # viewset for entering vehicles and parking slot assignment
 @method_decorator(name='create', decorator=swagger_auto_schema(
     operation_description="""Park function for the application. 
     This takes in the entry index to denote which entrance the vehicle entered in, along with the vehicle details: the plate number and the vehicle size/type. 
     The parking is assigned based on the nearest possible slot and then when there are slots with similar distances from the entrance, we prioritize 
-    slots that are smaller and are better fit for the vehicle.""",
+    slots that are smaller and are better fit for the vehicle. When the mall parking is given, only the slots of that mall are considered, which is 
+    recommended when there are several malls.""",
 ))
 class VehicleParkingEntryViewSet(viewsets.GenericViewSet, 
     mixins.CreateModelMixin,
@@ -87,6 +267,32 @@ class VehicleParkingEntryViewSet(viewsets.GenericViewSet,
     queryset = models.VehicleParking.objects.all()
     serializer_class = serializers.VehicleParkingEntrySerializer
 
+    @idempotency.idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+@method_decorator(name='create', decorator=swagger_auto_schema(
+    operation_description="""Bulk park function for gate controllers that batch their arrivals. 
+    This takes in a list of vehicles with their plate numbers, vehicle types and entry indexes, and assigns parking slots to all of them in one transaction 
+    using the same rules as the park function, including the optional mall parking of every vehicle. The response contains the result of every vehicle in the same order, with the errors of the vehicles 
+    that could not be parked.""",
+))
+class VehicleParkingBulkEntryViewSet(viewsets.GenericViewSet, 
+    mixins.CreateModelMixin,
+):
+    queryset = models.VehicleParking.objects.all()
+    serializer_class = serializers.VehicleParkingBulkEntrySerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+
+        # respond with multi-status when some of the vehicles could not be parked
+        if any('errors' in result for result in results):
+            return Response(results, status=status.HTTP_207_MULTI_STATUS)
+        return Response(results, status=status.HTTP_201_CREATED)
+
 @method_decorator(name='create', decorator=swagger_auto_schema(
     operation_description="""Mall creation function. It allows the user to initialize the configuration of the mall with its name, number of entrances and its parkings slots. 
     It is also possible to customize the parking rates and the duration on which different rates apply.""",